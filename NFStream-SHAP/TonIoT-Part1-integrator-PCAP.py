@@ -10,12 +10,31 @@
 #
 # Entrada : .pcap/.pcapng bajo PCAP/Normal/ y PCAP/Attacks/<clase>/
 # Salida  : un _base.csv por archivo PCAP en NFStream-SHAP/DATASETS/
+#
+# Uso:
+#   python TonIoT-Part1-integrator-PCAP.py                  # serial (1 archivo a la vez)
+#   python TonIoT-Part1-integrator-PCAP.py --workers 0      # pool, workers segun CPUs
+#   python TonIoT-Part1-integrator-PCAP.py --workers 4 --n-meters 2
+#   python TonIoT-Part1-integrator-PCAP.py --force          # ignora el manifest
+#   python TonIoT-Part1-integrator-PCAP.py --slices 8       # PCAPs >= 1 GiB en 8 slices
+#   python TonIoT-Part1-integrator-PCAP.py --follow /captures/Normal   # ingesta continua
+#   python TonIoT-Part1-integrator-PCAP.py --fused          # PCAP -> _combined.csv directo
 
+import argparse
+import hashlib
+import json
 import os
+import shutil
+import struct
+import tempfile
 import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
 import nfstream
+from nfstream import NFPlugin
+import numpy as np
 import pandas as pd
 
 # Mapeo de carpetas a etiquetas canónicas. La clave es el nombre de la carpeta
@@ -50,22 +69,21 @@ LABEL_MAPPING = {
 #   dns_rejected  ∈ {F, T, '-', Other, None}
 #
 # Estas funciones convierten los valores que entrega NFStream a ese
-# vocabulario. Cualquier valor inesperado cae en "Other" o "None" (faltante)
-# y el caller emite un WARN una vez para detectar drift.
+# vocabulario. Cualquier valor inesperado cae en "Other" o "None" (faltante).
+# Son la referencia valor a valor; process_pcap aplica lo mismo en una sola
+# pasada vectorizada por chunk (ver normalize_raw_frame), que además cuenta
+# los valores inesperados para detectar drift.
+
+PROTO_VOCAB      = {6: "tcp", 17: "udp"}
+CONN_STATE_VOCAB = {"S0", "SF", "REJ", "OTH"}
+SERVICE_VOCAB    = {"-", "dns", "http"}
 
-_proto_warn_seen = set()
-_conn_state_warn_seen = set()
-_service_warn_seen = set()
 
 def proto_to_str(proto_int):
     """IANA protocol number → Zeek string."""
     if proto_int is None:
         return "None"
-    mapping = {6: "tcp", 17: "udp"}
-    if proto_int not in mapping and proto_int not in _proto_warn_seen:
-        print(f"WARN: unexpected proto value {proto_int!r}, mapping to 'Other'")
-        _proto_warn_seen.add(proto_int)
-    return mapping.get(proto_int, "Other")
+    return PROTO_VOCAB.get(proto_int, "Other")
 
 
 def dns_bool_to_zeek_str(value):
@@ -79,26 +97,14 @@ def normalize_conn_state(value):
     """NFStream connection_state → Zeek conn_state vocabulary."""
     if value is None or value == "":
         return "None"
-    allowed = {"S0", "SF", "REJ", "OTH"}
-    if value in allowed:
-        return value
-    if value not in _conn_state_warn_seen:
-        print(f"WARN: unexpected conn_state value {value!r}, mapping to 'Other'")
-        _conn_state_warn_seen.add(value)
-    return "Other"
+    return value if value in CONN_STATE_VOCAB else "Other"
 
 
 def normalize_service(value):
     """NFStream requested_service → Zeek service vocabulary."""
     if value is None or value == "":
         return "None"
-    allowed = {"-", "dns", "http"}
-    if value in allowed:
-        return value
-    if value not in _service_warn_seen:
-        print(f"WARN: unexpected service value {value!r}, mapping to 'Other'")
-        _service_warn_seen.add(value)
-    return "Other"
+    return value if value in SERVICE_VOCAB else "Other"
 
 
 # ----------------------------------------------------------------------------
@@ -122,8 +128,12 @@ def derive_conn_state(flow):
     if upstream is not None and upstream != "":
         return normalize_conn_state(upstream)
 
-    src_pkts = getattr(flow, "src2dst_packets", 0) or 0
-    dst_pkts = getattr(flow, "dst2src_packets", 0) or 0
+    return conn_state_from_counts(getattr(flow, "src2dst_packets", 0) or 0,
+                                  getattr(flow, "dst2src_packets", 0) or 0)
+
+
+def conn_state_from_counts(src_pkts, dst_pkts):
+    """Síntesis S0/SF/OTH desde los packet counts por dirección."""
     if src_pkts > 0 and dst_pkts == 0:
         return "S0"
     elif src_pkts > 0 and dst_pkts > 0:
@@ -139,7 +149,11 @@ def derive_service(flow):
     if upstream is not None and upstream != "":
         return normalize_service(upstream)
 
-    app = getattr(flow, "application_name", None)
+    return service_from_app(getattr(flow, "application_name", None))
+
+
+def service_from_app(app):
+    """application_name de nDPI → vocabulario Zeek {dns, http, -, Other, None}."""
     if app is None or app == "":
         return "None"
 
@@ -156,6 +170,330 @@ def derive_service(flow):
     return "Other"
 
 
+# ----------------------------------------------------------------------------
+# Buffer columnar de flujos
+# ----------------------------------------------------------------------------
+# En vez de un dict de 19 claves por flujo (y pd.DataFrame infiriendo columnas
+# desde millones de dicts), cada campo del _base.csv tiene su propio arreglo
+# NumPy tipado y preasignado. El buffer crece por bloques de block_size filas:
+# los bloques llenos se guardan tal cual y recién se concatenan al convertir,
+# así que nunca se re-copia lo ya escrito.
+#
+# BASE_SCHEMA define el orden de columnas del _base.csv y el dtype de cada
+# una (object = string).
+BASE_SCHEMA = [
+    # Identificadores
+    ('src_ip',           object),
+    ('dst_ip',           object),
+    ('src_port',         np.int64),
+    ('dst_port',         np.int64),
+    ('proto',            object),
+    ('stime',            np.int64),
+    ('ltime',            np.int64),
+    ('dur',              np.float64),
+    # ToN-IoT / Zeek features (convertidas)
+    ('dns_query',        object),
+    ('dns_rejected',     object),
+    ('dns_RD',           object),
+    ('conn_state',       object),
+    ('service',          object),
+    ('http_status_code', np.int64),
+    # Métricas crudas (renombradas a estilo Zeek)
+    ('src_ip_bytes',     np.int64),
+    ('dst_ip_bytes',     np.int64),
+    ('src_pkts',         np.int64),
+    ('dst_pkts',         np.int64),
+    # Etiqueta
+    ('label',            object),
+]
+BASE_COLUMNS = [name for name, _ in BASE_SCHEMA]
+
+# Lo que process_pcap copia de cada NFlow, sin convertir: los campos que
+# alimentan proto/dns_*/conn_state/service van crudos y se normalizan por
+# chunk en normalize_raw_frame. Los enteros faltantes se guardan como
+# MISSING_INT.
+RAW_SCHEMA = [
+    ('src_ip',                    object),
+    ('dst_ip',                    object),
+    ('src_port',                  np.int64),
+    ('dst_port',                  np.int64),
+    ('protocol',                  np.int64),
+    ('stime',                     np.int64),
+    ('ltime',                     np.int64),
+    ('duration_ms',               np.int64),
+    ('dns_query',                 object),
+    ('dns_rejected',              object),
+    ('dns_rd',                    object),
+    ('connection_state',          object),
+    ('requested_service',         object),
+    ('application_name',          object),
+    ('http_status_code',          np.int64),
+    ('src_ip_bytes',              np.int64),
+    ('dst_ip_bytes',              np.int64),
+    ('src_pkts',                  np.int64),
+    ('dst_pkts',                  np.int64),
+    ('label',                     object),
+]
+RAW_COLUMNS = [name for name, _ in RAW_SCHEMA]
+MISSING_INT = -1
+
+DEFAULT_BLOCK_SIZE = 65_536
+
+
+class FlowColumnBuffer:
+    """Buffer de filas con una columna NumPy tipada por campo de BASE_SCHEMA.
+    append() recibe una tupla en el orden de BASE_COLUMNS."""
+
+    def __init__(self, schema=BASE_SCHEMA, block_size=DEFAULT_BLOCK_SIZE):
+        self.names      = [name for name, _ in schema]
+        self.dtypes     = [dtype for _, dtype in schema]
+        self.block_size = block_size
+        self.clear()
+
+    def _new_block(self):
+        return [np.empty(self.block_size, dtype=dtype) for dtype in self.dtypes]
+
+    def clear(self):
+        self._full_blocks = []
+        self._block = self._new_block()
+        self._pos = 0
+
+    def __len__(self):
+        return len(self._full_blocks) * self.block_size + self._pos
+
+    def append(self, row):
+        pos = self._pos
+        # Si una asignación falla (valor no convertible al dtype) _pos no
+        # avanza y la fila parcial se sobreescribe con la siguiente.
+        for column, value in zip(self._block, row):
+            column[pos] = value
+        self._pos = pos + 1
+        if self._pos == self.block_size:
+            self._full_blocks.append(self._block)
+            self._block = self._new_block()
+            self._pos = 0
+
+    def to_arrays(self):
+        """dict columna -> arreglo con las filas acumuladas (sin copiar el
+        bloque en curso más allá de las filas usadas)."""
+        arrays = {}
+        for i, name in enumerate(self.names):
+            parts = [block[i] for block in self._full_blocks]
+            parts.append(self._block[i][:self._pos])
+            arrays[name] = parts[0] if len(parts) == 1 else np.concatenate(parts)
+        return arrays
+
+    def to_frame(self):
+        return pd.DataFrame(self.to_arrays(), columns=self.names, copy=False)
+
+
+# ----------------------------------------------------------------------------
+# Normalización vectorizada (chunk crudo → vocabulario Zeek)
+# ----------------------------------------------------------------------------
+# Las columnas de texto crudas (application_name, connection_state, ...)
+# tienen muy pocos valores distintos por chunk. Se factorizan (códigos
+# enteros + valores únicos), cada valor único pasa una sola vez por el
+# normalizador escalar de arriba y el resultado se expande con una tabla de
+# lookup indexada por código. Así los chequeos de substring de
+# service_from_app corren por valor distinto, no por flujo.
+#
+# En vez de un WARN por valor la primera vez que aparece, los valores
+# inesperados (fuera de PROTO_VOCAB / CONN_STATE_VOCAB / SERVICE_VOCAB) se
+# cuentan (un Counter por campo) y process_pcap reporta los conteos al terminar.
+
+DRIFT_FIELDS = ('proto', 'conn_state', 'service')
+
+
+def new_drift_counts():
+    """Conteos de valores inesperados por campo: {campo: Counter}."""
+    return {field: Counter() for field in DRIFT_FIELDS}
+
+
+def report_drift(drift, source):
+    for field in DRIFT_FIELDS:
+        if drift[field]:
+            values = ", ".join(f"{value!r} x{count}"
+                               for value, count in drift[field].most_common())
+            print(f"WARN: unexpected {field} values mapped to 'Other' in {source}: {values}")
+
+
+def _lookup(values, fn, missing):
+    """Aplica fn a cada valor distinto de values y expande por código.
+    None/NaN (código -1 de factorize) → missing. Devuelve (resultado,
+    códigos, únicos)."""
+    codes, uniques = pd.factorize(values)
+    table = np.array([fn(u) for u in uniques] + [missing], dtype=object)
+    return table[codes], codes, uniques
+
+
+def _count_unexpected(counter, codes, uniques, expected):
+    """Suma a counter cuántas filas tienen cada valor único no esperado."""
+    unexpected = [i for i, u in enumerate(uniques) if u != "" and u not in expected]
+    if unexpected:
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        for i in unexpected:
+            counter[uniques[i]] += int(counts[i])
+
+
+def proto_column(protocol, drift=None):
+    out = np.full(len(protocol), "Other", dtype=object)
+    for number, name in PROTO_VOCAB.items():
+        out[protocol == number] = name
+    out[protocol == MISSING_INT] = "None"
+    if drift is not None:
+        other = protocol[out == "Other"]
+        if len(other):
+            values, counts = np.unique(other, return_counts=True)
+            drift['proto'].update(dict(zip(values.tolist(), counts.tolist())))
+    return out
+
+
+def conn_state_column(connection_state, src_pkts, dst_pkts, drift=None):
+    """connection_state upstream si viene, si no síntesis S0/SF/OTH desde los
+    packet counts (como derive_conn_state)."""
+    upstream, codes, uniques = _lookup(connection_state, normalize_conn_state, "None")
+    if drift is not None:
+        _count_unexpected(drift['conn_state'], codes, uniques, CONN_STATE_VOCAB)
+    synthesized = np.select(
+        [(src_pkts > 0) & (dst_pkts == 0), (src_pkts > 0) & (dst_pkts > 0)],
+        ["S0", "SF"], default="OTH",
+    ).astype(object)
+    return np.where(upstream == "None", synthesized, upstream)
+
+
+def service_column(requested_service, application_name, drift=None):
+    """requested_service upstream si viene, si no application_name de nDPI
+    (como derive_service)."""
+    upstream, codes, uniques = _lookup(requested_service, normalize_service, "None")
+    if drift is not None:
+        _count_unexpected(drift['service'], codes, uniques, SERVICE_VOCAB)
+    from_app, _, _ = _lookup(application_name, service_from_app, "None")
+    return np.where(upstream == "None", from_app, upstream)
+
+
+def dns_flag_column(values):
+    return _lookup(values, dns_bool_to_zeek_str, "-")[0]
+
+
+def normalize_raw_frame(raw, drift=None):
+    """Chunk con columnas RAW_COLUMNS → DataFrame con BASE_COLUMNS (mismos
+    valores que los normalizadores escalares flujo a flujo)."""
+    src_pkts = raw['src_pkts'].to_numpy()
+    dst_pkts = raw['dst_pkts'].to_numpy()
+    columns = {
+        'src_ip':           raw['src_ip'],
+        'dst_ip':           raw['dst_ip'],
+        'src_port':         raw['src_port'],
+        'dst_port':         raw['dst_port'],
+        'proto':            proto_column(raw['protocol'].to_numpy(), drift),
+        'stime':            raw['stime'],
+        'ltime':            raw['ltime'],
+        'dur':              raw['duration_ms'].to_numpy() / 1000.0,
+        'dns_query':        raw['dns_query'],
+        'dns_rejected':     dns_flag_column(raw['dns_rejected'].to_numpy()),
+        'dns_RD':           dns_flag_column(raw['dns_rd'].to_numpy()),
+        'conn_state':       conn_state_column(raw['connection_state'].to_numpy(),
+                                              src_pkts, dst_pkts, drift),
+        'service':          service_column(raw['requested_service'].to_numpy(),
+                                           raw['application_name'].to_numpy(), drift),
+        'http_status_code': raw['http_status_code'],
+        'src_ip_bytes':     raw['src_ip_bytes'],
+        'dst_ip_bytes':     raw['dst_ip_bytes'],
+        'src_pkts':         src_pkts,
+        'dst_pkts':         dst_pkts,
+        'label':            raw['label'],
+    }
+    return pd.DataFrame(columns, columns=BASE_COLUMNS)
+
+
+# ----------------------------------------------------------------------------
+# Normalización dentro de los meters de NFStream (NFPlugins)
+# ----------------------------------------------------------------------------
+# Alternativa a normalize_raw_frame (--normalize-in meters): cada
+# normalización es un NFPlugin que corre en on_expire, dentro del proceso
+# meter que expira el flujo, y deja el valor Zeek en flow.udps. El consumidor
+# solo copia atributos ya terminados (flow_to_plugin_row).
+#
+# Los plugins solo implementan on_init/on_expire, pero con cualquier plugin
+# NFStream sincroniza el flujo con Python y llama on_update en cada paquete,
+# así que el costo por paquete de los meters sube. Conviene solo cuando el
+# consumidor es el cuello de botella (varios meters, muchos flujos cortos);
+# bench_part1_normalization.py compara ambos modos sobre una captura.
+#
+# Drift: el plugin guarda en udps el valor crudo solo cuando es inesperado
+# (None en otro caso) y el consumidor lo cuenta igual que en el modo
+# vectorizado.
+
+class ZeekProtoPlugin(NFPlugin):
+    def on_init(self, packet, flow):
+        flow.udps.zeek_proto = proto_to_str(flow.protocol)
+        flow.udps.zeek_proto_drift = (
+            None if flow.protocol in PROTO_VOCAB else flow.protocol
+        )
+
+
+class ZeekDnsFlagsPlugin(NFPlugin):
+    def on_expire(self, flow):
+        flow.udps.zeek_dns_rejected = dns_bool_to_zeek_str(getattr(flow, "dns_rejected", None))
+        flow.udps.zeek_dns_rd       = dns_bool_to_zeek_str(getattr(flow, "dns_rd", None))
+
+
+class ZeekConnStatePlugin(NFPlugin):
+    def on_expire(self, flow):
+        flow.udps.zeek_conn_state = derive_conn_state(flow)
+        upstream = getattr(flow, "connection_state", None)
+        flow.udps.zeek_conn_state_drift = (
+            upstream if upstream and upstream not in CONN_STATE_VOCAB else None
+        )
+
+
+class ZeekServicePlugin(NFPlugin):
+    def on_expire(self, flow):
+        flow.udps.zeek_service = derive_service(flow)
+        upstream = getattr(flow, "requested_service", None)
+        flow.udps.zeek_service_drift = (
+            upstream if upstream and upstream not in SERVICE_VOCAB else None
+        )
+
+
+def zeek_plugins():
+    return (ZeekProtoPlugin(), ZeekDnsFlagsPlugin(), ZeekConnStatePlugin(),
+            ZeekServicePlugin())
+
+
+def flow_to_plugin_row(flow, label, drift=None):
+    """NFlow ya normalizado por zeek_plugins() → tupla en el orden de
+    BASE_COLUMNS."""
+    udps = flow.udps
+    if drift is not None:
+        for field, value in (('proto', udps.zeek_proto_drift),
+                             ('conn_state', udps.zeek_conn_state_drift),
+                             ('service', udps.zeek_service_drift)):
+            if value is not None:
+                drift[field][value] += 1
+    return (
+        flow.src_ip or "0.0.0.0",
+        flow.dst_ip or "0.0.0.0",
+        flow.src_port or 0,
+        flow.dst_port or 0,
+        udps.zeek_proto,
+        getattr(flow, "bidirectional_first_seen_ms", 0.0),
+        getattr(flow, "bidirectional_last_seen_ms", 0.0),
+        (getattr(flow, "bidirectional_duration_ms", 0) or 0) / 1000.0,
+        getattr(flow, "dns_query", "") or "",
+        udps.zeek_dns_rejected,
+        udps.zeek_dns_rd,
+        udps.zeek_conn_state,
+        udps.zeek_service,
+        getattr(flow, "http_response_status_code", -1),
+        flow.src2dst_bytes,
+        flow.dst2src_bytes,
+        flow.src2dst_packets,
+        flow.dst2src_packets,
+        label,
+    )
+
+
 # ----------------------------------------------------------------------------
 # Procesamiento de un PCAP individual
 # ----------------------------------------------------------------------------
@@ -177,72 +515,618 @@ def _to_ascii_safe_path(p):
     return buf.value if rv else p
 
 
-def process_pcap(file_path, label):
-    """Lee un archivo PCAP con NFStreamer y devuelve una lista de filas (dicts)
-    con nombres y valores en convención Zeek."""
+def flow_to_raw_row(flow, label):
+    """NFlow → tupla con los campos crudos, en el orden de RAW_COLUMNS."""
+    protocol = flow.protocol
+    return (
+        flow.src_ip or "0.0.0.0",
+        flow.dst_ip or "0.0.0.0",
+        flow.src_port or 0,
+        flow.dst_port or 0,
+        MISSING_INT if protocol is None else protocol,
+        getattr(flow, "bidirectional_first_seen_ms", 0),
+        getattr(flow, "bidirectional_last_seen_ms", 0),
+        getattr(flow, "bidirectional_duration_ms", 0) or 0,
+        getattr(flow, "dns_query", "") or "",
+        getattr(flow, "dns_rejected", None),
+        getattr(flow, "dns_rd", None),
+        getattr(flow, "connection_state", None),
+        getattr(flow, "requested_service", None),
+        getattr(flow, "application_name", None),
+        getattr(flow, "http_response_status_code", -1),
+        flow.src2dst_bytes,
+        flow.dst2src_bytes,
+        flow.src2dst_packets or 0,
+        flow.dst2src_packets or 0,
+        label,
+    )
+
+
+# ----------------------------------------------------------------------------
+# Opciones de NFStreamer derivadas de las columnas que se necesitan
+# ----------------------------------------------------------------------------
+# flow_to_raw_row solo lee campos básicos del flujo (IPs, puertos,
+# protocolo, timestamps, bytes y paquetes por dirección) más los campos nDPI
+# que usa service_column. Nada usa las features estadísticas
+# (statistical_analysis) ni las secuencias de paquetes (splt_analysis), y la
+# disección nDPI solo hace falta si alguien consume 'service'.
+#
+# NFSTREAM_REQUIREMENTS declara qué opción requiere cada columna de
+# _base.csv; las columnas ausentes solo necesitan el metering básico. Las
+# columnas dns_* y http_status_code no tienen atributo en NFStream 6.6 (caen
+# siempre al default de getattr), así que tampoco requieren nada.
+NFSTREAM_REQUIREMENTS = {
+    'service': {'n_dissections': 20},
+}
+
+# Configuración histórica de Part1 (default, --analysis full).
+FULL_NFSTREAM_OPTIONS = {
+    'statistical_analysis': True,
+    'splt_analysis':        True,
+    'n_dissections':        20,
+}
+
+_MINIMAL_NFSTREAM_OPTIONS = {
+    'statistical_analysis': False,
+    'splt_analysis':        0,
+    'n_dissections':        0,
+}
+
+
+def nfstream_options_for(columns):
+    """Opciones mínimas de NFStreamer que producen correctamente las columnas
+    pedidas (las demás columnas del _base.csv pueden quedar degradadas)."""
+    options = dict(_MINIMAL_NFSTREAM_OPTIONS)
+    for column in columns:
+        for key, value in NFSTREAM_REQUIREMENTS.get(column, {}).items():
+            options[key] = max(options[key], value)
+    return options
+
+
+def load_part2(script_dir):
+    """Importa TonIoT-Part2-integrator-of-features.py como módulo."""
+    import importlib.util
+    spec = importlib.util.spec_from_file_location(
+        'part2', str(Path(script_dir) / 'TonIoT-Part2-integrator-of-features.py')
+    )
+    part2 = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(part2)
+    return part2
+
+
+def part2_base_columns(script_dir):
+    """Columnas de _base.csv que Part2 consume: REQUIRED_BASE_COLUMNS más las
+    de SELECTED_FEATURES que pasan tal cual desde _base.csv."""
+    part2 = load_part2(script_dir)
+    needed = list(part2.REQUIRED_BASE_COLUMNS)
+    needed += [c for c in part2.SELECTED_FEATURES if c in BASE_COLUMNS and c not in needed]
+    return needed
+
+
+# Timeouts de expiración de NFStreamer (sus defaults). Son explícitos porque
+# el procesamiento por slices los necesita para re-unir flujos cortados.
+NFSTREAM_IDLE_TIMEOUT_S   = 120
+NFSTREAM_ACTIVE_TIMEOUT_S = 1800
+
+# NFStream emite cada flujo al expirar: a lo más idle_timeout después de su
+# último paquete, y ningún flujo dura más de active_timeout. Un flujo emitido
+# después de otro no puede empezar más de 2 * idle + active antes del ltime
+# de aquel; es la ventana con la que sort_by_stime re-ordena por stime.
+STIME_HORIZON_MS = (2 * NFSTREAM_IDLE_TIMEOUT_S + NFSTREAM_ACTIVE_TIMEOUT_S) * 1000
+
+# Tamaño por defecto de cada chunk que emite process_pcap. La memoria de Part1
+# queda acotada por un chunk (más el estado interno de NFStream), sin importar
+# el tamaño del PCAP.
+DEFAULT_CHUNK_SIZE = 100_000
+
+
+NORMALIZE_MODES = ("consumer", "meters")
+
+
+def process_pcap(file_path, label, n_meters=0, chunk_size=DEFAULT_CHUNK_SIZE,
+                 nfstream_options=None, bpf_filter=None, normalize_in="consumer"):
+    """Lee un archivo PCAP con NFStreamer y emite (generador) DataFrames de a
+    lo más chunk_size filas con nombres y valores en convención Zeek.
+    n_meters se pasa tal cual a NFStreamer (0 = auto-escalado de NFStream
+    según los cores). nfstream_options (statistical_analysis, splt_analysis,
+    n_dissections) por defecto es FULL_NFSTREAM_OPTIONS. bpf_filter
+    (opcional) se pasa tal cual a NFStreamer. normalize_in elige dónde se
+    convierte al vocabulario Zeek: "consumer" (normalize_raw_frame por chunk)
+    o "meters" (zeek_plugins())."""
     pcap_path = _to_ascii_safe_path(str(file_path))
     print(f"Procesando {pcap_path} como {label}...")
 
+    if nfstream_options is None:
+        nfstream_options = FULL_NFSTREAM_OPTIONS
+    if normalize_in not in NORMALIZE_MODES:
+        raise ValueError(f"normalize_in debe ser uno de {NORMALIZE_MODES}: {normalize_in!r}")
+    in_meters = normalize_in == "meters"
     stream = nfstream.NFStreamer(
         source=pcap_path,
-        statistical_analysis=True,
-        splt_analysis=True,
-        n_dissections=20,
+        bpf_filter=bpf_filter,
+        idle_timeout=NFSTREAM_IDLE_TIMEOUT_S,
+        active_timeout=NFSTREAM_ACTIVE_TIMEOUT_S,
+        n_meters=n_meters,
+        udps=zeek_plugins() if in_meters else None,
+        **nfstream_options,
     )
 
-    flows = []
+    schema = BASE_SCHEMA if in_meters else RAW_SCHEMA
+    buffer = FlowColumnBuffer(schema, block_size=min(chunk_size, DEFAULT_BLOCK_SIZE))
+    drift = new_drift_counts()
+
+    def flush():
+        frame = buffer.to_frame()
+        buffer.clear()
+        return frame if in_meters else normalize_raw_frame(frame, drift)
+
     for flow in stream:
         try:
-            flows.append({
-                # Identificadores
-                'src_ip':   flow.src_ip or "0.0.0.0",
-                'dst_ip':   flow.dst_ip or "0.0.0.0",
-                'src_port': flow.src_port or 0,
-                'dst_port': flow.dst_port or 0,
-                'proto':    proto_to_str(flow.protocol),
-                'stime':    getattr(flow, "bidirectional_first_seen_ms", 0.0),
-                'ltime':    getattr(flow, "bidirectional_last_seen_ms", 0.0),
-                'dur':      (getattr(flow, "bidirectional_duration_ms", 0) or 0) / 1000.0,
-
-                # ToN-IoT / Zeek features (convertidas)
-                'dns_query':    getattr(flow, "dns_query", "") or "",
-                'dns_rejected': dns_bool_to_zeek_str(getattr(flow, "dns_rejected", None)),
-                'dns_RD':       dns_bool_to_zeek_str(getattr(flow, "dns_rd", None)),
-                'conn_state':   derive_conn_state(flow),
-                'service':      derive_service(flow),
-                'http_status_code': getattr(flow, "http_response_status_code", -1),
-
-                # Métricas crudas (renombradas a estilo Zeek)
-                'src_ip_bytes': flow.src2dst_bytes,
-                'dst_ip_bytes': flow.dst2src_bytes,
-                'src_pkts':     flow.src2dst_packets,
-                'dst_pkts':     flow.dst2src_packets,
-
-                # Etiqueta
-                'label': label,
-            })
+            if in_meters:
+                buffer.append(flow_to_plugin_row(flow, label, drift))
+            else:
+                buffer.append(flow_to_raw_row(flow, label))
         except Exception as e:
             print(f"Error en flujo: {e}")
+            continue
 
-    return flows
+        if len(buffer) >= chunk_size:
+            yield flush()
+
+    if len(buffer):
+        yield flush()
+    report_drift(drift, os.path.basename(str(file_path)))
+
+
+def write_base_csv(chunks, out_path):
+    """Escribe los chunks de process_pcap a out_path de forma incremental y
+    devuelve la cantidad de filas escritas. La escritura va a un .tmp que se
+    renombra al final: un _base.csv a medio escribir (job abortado) nunca
+    queda con el nombre final. Si no hay filas no se crea el archivo."""
+    out_path = Path(out_path)
+    tmp_path = out_path.with_name(out_path.name + ".tmp")
+    n_rows = 0
+    try:
+        for chunk in chunks:
+            chunk.to_csv(tmp_path, mode='w' if n_rows == 0 else 'a',
+                         header=(n_rows == 0), index=False)
+            n_rows += len(chunk)
+    except BaseException:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
+    if n_rows:
+        os.replace(tmp_path, out_path)
+    return n_rows
 
 
 # ----------------------------------------------------------------------------
-# Main
+# Un PCAP gigante en paralelo: slices + re-unión de flujos en los bordes
 # ----------------------------------------------------------------------------
-if __name__ == '__main__':
-    script_dir    = Path(__file__).resolve().parent
-    pcap_folder   = script_dir.parent.parent / "PCAP"      # CololocovsLaChile01032026/PCAP/
-    output_folder = script_dir / "DATASETS"
-    output_folder.mkdir(parents=True, exist_ok=True)
+# Cuando un solo archivo domina el tiempo total (normal, ddos), el PCAP se
+# corta en n slices contiguos (por bytes o por tiempo, siempre en bordes de
+# paquete), cada slice se mide con process_pcap en su propio proceso y los
+# flujos que cruzan un borde se vuelven a unir.
+#
+# Un flujo cortado aparece como una "cola" al final del slice i y una
+# "cabeza" al inicio del slice i+1 con la misma llave bidireccional
+# (proto + los dos endpoints ip:puerto). NFStream, sobre el archivo completo,
+# los habría juntado si y solo si:
+#   - cabeza.stime - cola.ltime <  idle_timeout     (si no, expira por idle)
+#   - cabeza.ltime - cola.stime <  active_timeout   (si no, expira por active)
+# La cola es el flujo de esa llave con mayor ltime en el slice i y la cabeza
+# el de menor stime en el slice i+1; un flujo puede cruzar varios slices.
+#
+# Si solo falla la condición de active_timeout, la corrida serial habría
+# cortado el flujo en un paquete interior de la cabeza, que no se puede
+# reconstruir desde las filas. Esas llaves ("conflictos", flujos de más de
+# active_timeout que cruzan un borde) se vuelven a medir completas sobre el
+# PCAP original con un filtro BPF por llave; como NFStream arma los flujos de
+# cada llave solo con sus propios paquetes, el resultado es el serial.
+#
+# Solo las filas a menos de idle_timeout del inicio o del fin de su slice
+# pueden participar; esas quedan en memoria y el resto se copia directo al
+# _base.csv, así que la memoria queda acotada por el tráfico en los bordes.
+#
+# Diferencias conocidas con la corrida serial:
+#   - El orden de filas no es el de expiración de NFStream sino el de stime:
+#     las filas interiores pasan por sort_by_stime y las de borde re-unidas y
+#     las re-medidas se intercalan por stime. Entre slices el orden se
+#     mantiene: cada slice empieza después del último paquete del anterior.
+#   - 'service' del flujo unido es el de la cola (nDPI vio los primeros
+#     paquetes ahí); si la cola quedó sin detectar ('-'/'None') se toma el de
+#     la cabeza, que puede diferir de lo que nDPI habría concluido.
+#   - Solo PCAP clásico (libpcap); pcapng se procesa en serial.
+#   - 'Other' agrupa todos los protocolos que no son TCP/UDP, así que dos
+#     flujos no-TCP/UDP entre los mismos hosts comparten llave.
 
-    if not pcap_folder.exists():
-        raise FileNotFoundError(
-            f"PCAP folder not found at {pcap_folder}. "
-            "Expected layout: <project>/PCAP/Normal/ and <project>/PCAP/Attacks/<clase>/"
+# magic -> (endianness, divisor de la fracción de segundo)
+_PCAP_MAGICS = {
+    b'\xd4\xc3\xb2\xa1': ('<', 1e6),   # microsegundos, little endian
+    b'\xa1\xb2\xc3\xd4': ('>', 1e6),
+    b'\x4d\x3c\xb2\xa1': ('<', 1e9),   # nanosegundos
+    b'\xa1\xb2\x3c\x4d': ('>', 1e9),
+}
+_PCAP_GLOBAL_HEADER_LEN = 24
+_PCAP_RECORD_HEADER_LEN = 16
+
+
+def scan_pcap_records(path):
+    """Recorre los headers de registro de un PCAP clásico y genera
+    (offset, timestamp en segundos) por paquete, sin leer los payloads.
+    Lanza ValueError si el archivo no es PCAP clásico."""
+    with open(path, 'rb') as f:
+        header = f.read(_PCAP_GLOBAL_HEADER_LEN)
+        if len(header) < _PCAP_GLOBAL_HEADER_LEN or header[:4] not in _PCAP_MAGICS:
+            raise ValueError(f"{path} no es un PCAP clásico (¿pcapng?)")
+        endian, frac = _PCAP_MAGICS[header[:4]]
+        record = struct.Struct(endian + 'IIII')
+        offset = _PCAP_GLOBAL_HEADER_LEN
+        while True:
+            raw = f.read(_PCAP_RECORD_HEADER_LEN)
+            if len(raw) < _PCAP_RECORD_HEADER_LEN:
+                return
+            ts_sec, ts_frac, incl_len, _ = record.unpack(raw)
+            yield offset, ts_sec + ts_frac / frac
+            f.seek(incl_len, 1)
+            offset += _PCAP_RECORD_HEADER_LEN + incl_len
+
+
+def plan_pcap_slices(path, n_slices, slice_by='bytes'):
+    """Cortes de un PCAP en a lo más n_slices rangos de bytes contiguos,
+    alineados a registros. slice_by='bytes' reparte por tamaño y 'time' por
+    intervalos iguales de tiempo de captura (una pasada extra para conocer el
+    rango). Devuelve una lista de dicts con start/end (offsets) y
+    first_ts/last_ts (segundos). Memoria constante: no guarda los registros."""
+    if slice_by == 'time':
+        first_ts = last_ts = None
+        for _, ts in scan_pcap_records(path):
+            if first_ts is None:
+                first_ts = ts
+            last_ts = ts
+        if first_ts is None:
+            return []
+        step = (last_ts - first_ts) / n_slices
+        targets = [first_ts + k * step for k in range(1, n_slices)]
+        position = 1
+    else:
+        size = os.path.getsize(path) - _PCAP_GLOBAL_HEADER_LEN
+        targets = [_PCAP_GLOBAL_HEADER_LEN + k * size / n_slices for k in range(1, n_slices)]
+        position = 0
+
+    slices = []
+    target_iter = iter(targets)
+    target = next(target_iter, None)
+    current = None
+    prev_ts = None
+    for record in scan_pcap_records(path):
+        offset, ts = record
+        if current is None:
+            current = {'start': offset, 'first_ts': ts}
+        else:
+            crossed = False
+            while target is not None and record[position] >= target:
+                crossed = True
+                target = next(target_iter, None)
+            if crossed:
+                current.update(end=offset, last_ts=prev_ts)
+                slices.append(current)
+                current = {'start': offset, 'first_ts': ts}
+        prev_ts = ts
+    if current is not None:
+        current.update(end=os.path.getsize(path), last_ts=prev_ts)
+        slices.append(current)
+    return slices
+
+
+def write_pcap_slice(path, slice_, out_path):
+    """Copia el header global y el rango de registros del slice a out_path."""
+    with open(path, 'rb') as src, open(out_path, 'wb') as dst:
+        dst.write(src.read(_PCAP_GLOBAL_HEADER_LEN))
+        src.seek(slice_['start'])
+        remaining = slice_['end'] - slice_['start']
+        while remaining > 0:
+            block = src.read(min(remaining, 1 << 20))
+            if not block:
+                break
+            dst.write(block)
+            remaining -= len(block)
+
+
+def is_classic_pcap(path):
+    with open(path, 'rb') as f:
+        return f.read(4) in _PCAP_MAGICS
+
+
+def _meter_slice(slice_path, label, out_csv, n_meters, chunk_size, nfstream_options,
+                 normalize_in="consumer"):
+    """Worker: mide un slice y escribe sus filas a out_csv."""
+    chunks = process_pcap(slice_path, label, n_meters=n_meters, chunk_size=chunk_size,
+                          nfstream_options=nfstream_options, normalize_in=normalize_in)
+    return write_base_csv(chunks, out_csv)
+
+
+def flow_key(row):
+    """Llave bidireccional de un flujo (no depende de quién inició)."""
+    a = (row['src_ip'], row['src_port'])
+    b = (row['dst_ip'], row['dst_port'])
+    return (row['proto'],) + ((a, b) if a <= b else (b, a))
+
+
+def merge_flow_rows(tail, head):
+    """Une la cola de un flujo (slice anterior) con su cabeza (slice
+    siguiente). La dirección es la de la cola; si la cabeza quedó invertida
+    (su primer paquete fue la respuesta) se cruzan sus contadores."""
+    same_dir = (head['src_ip'], head['src_port']) == (tail['src_ip'], tail['src_port'])
+    h_src = 'src_' if same_dir else 'dst_'
+    h_dst = 'dst_' if same_dir else 'src_'
+
+    merged = dict(tail)
+    merged['ltime']        = max(tail['ltime'], head['ltime'])
+    merged['dur']          = (merged['ltime'] - tail['stime']) / 1000.0
+    merged['src_ip_bytes'] = tail['src_ip_bytes'] + head[h_src + 'ip_bytes']
+    merged['dst_ip_bytes'] = tail['dst_ip_bytes'] + head[h_dst + 'ip_bytes']
+    merged['src_pkts']     = tail['src_pkts'] + head[h_src + 'pkts']
+    merged['dst_pkts']     = tail['dst_pkts'] + head[h_dst + 'pkts']
+    merged['conn_state']   = conn_state_from_counts(merged['src_pkts'], merged['dst_pkts'])
+    if tail['service'] in ('-', 'None'):
+        merged['service'] = head['service']
+    return merged
+
+
+def stitch_slice_flows(slices_rows, slices_last_ms, idle_timeout_ms, active_timeout_ms):
+    """slices_rows: por slice (en orden), la lista de filas de borde como
+    (fila, es_cabeza, es_cola); slices_last_ms: timestamp del último paquete
+    de cada slice. Devuelve (filas finales, n_uniones, llaves en conflicto
+    por active_timeout)."""
+    finished = []
+    open_tails = {}   # llave -> cola que todavía puede continuar
+    conflicts = set()
+    n_merged = 0
+
+    for rows, last_ms in zip(slices_rows, slices_last_ms):
+        # Cabeza de cada llave en este slice: la de menor stime.
+        heads = {}
+        for i, (row, is_head, _) in enumerate(rows):
+            if is_head:
+                key = flow_key(row)
+                if key not in heads or row['stime'] < rows[heads[key]][0]['stime']:
+                    heads[key] = i
+
+        rows = [list(r) for r in rows]
+        carried = {}
+        for key, tail in open_tails.items():
+            if key in heads:
+                head = rows[heads[key]][0]
+                if head['stime'] - tail['ltime'] >= idle_timeout_ms:
+                    finished.append(tail)
+                elif head['ltime'] - tail['stime'] < active_timeout_ms:
+                    rows[heads[key]][0] = merge_flow_rows(tail, head)
+                    n_merged += 1
+                else:
+                    conflicts.add(key)
+                    finished.append(tail)
+            elif last_ms - tail['ltime'] < idle_timeout_ms + 1:
+                # La llave no aparece en este slice (más corto que el idle
+                # timeout): la cola puede seguir en un slice posterior.
+                carried[key] = tail
+            else:
+                finished.append(tail)
+
+        # Nuevas colas: la de mayor ltime por llave entre las candidatas.
+        open_tails = carried
+        for row, _, is_tail in rows:
+            if not is_tail:
+                finished.append(row)
+                continue
+            key = flow_key(row)
+            prev = open_tails.get(key)
+            if prev is None or row['ltime'] > prev['ltime']:
+                if prev is not None:
+                    finished.append(prev)
+                open_tails[key] = row
+            else:
+                finished.append(row)
+
+    finished.extend(open_tails.values())
+    finished = [r for r in finished if flow_key(r) not in conflicts]
+    finished.sort(key=lambda r: r['stime'])
+    return finished, n_merged, conflicts
+
+
+_BPF_KEYS_PER_PASS = 64
+
+
+def _bpf_for_keys(keys):
+    """Filtro BPF que deja pasar solo los paquetes de las llaves dadas."""
+    clauses = []
+    for proto, (ip_a, port_a), (ip_b, port_b) in keys:
+        parts = [f"host {ip_a}", f"host {ip_b}"]
+        if proto in ('tcp', 'udp'):
+            parts = [proto] + parts + [f"port {port_a}", f"port {port_b}"]
+        else:
+            parts += ["not tcp", "not udp"]
+        clauses.append("(" + " and ".join(parts) + ")")
+    return " or ".join(clauses)
+
+
+def remeter_flow_keys(file_path, label, keys, n_meters=0, chunk_size=DEFAULT_CHUNK_SIZE,
+                      nfstream_options=None, normalize_in="consumer"):
+    """Vuelve a medir, sobre el PCAP completo, solo los paquetes de las
+    llaves dadas (en pasadas de a _BPF_KEYS_PER_PASS llaves). Devuelve un
+    DataFrame con todos los flujos de esas llaves."""
+    keys = sorted(keys)
+    frames = []
+    for i in range(0, len(keys), _BPF_KEYS_PER_PASS):
+        group = keys[i:i + _BPF_KEYS_PER_PASS]
+        wanted = set(group)
+        for chunk in process_pcap(file_path, label, n_meters=n_meters, chunk_size=chunk_size,
+                                  nfstream_options=nfstream_options,
+                                  bpf_filter=_bpf_for_keys(group),
+                                  normalize_in=normalize_in):
+            # El filtro puede dejar pasar combinaciones cruzadas de host/puerto.
+            mask = [flow_key(r) in wanted for r in chunk.to_dict('records')]
+            frames.append(chunk[mask])
+    if not frames:
+        return pd.DataFrame(columns=BASE_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _read_base_csv(path, chunk_size):
+    """Lee un _base.csv propio por chunks con los dtypes de BASE_SCHEMA (sin
+    convertir '' ni 'None' a NaN), para re-escribirlo sin cambios."""
+    dtypes = {name: (str if dtype is object else dtype) for name, dtype in BASE_SCHEMA}
+    return pd.read_csv(path, chunksize=chunk_size, dtype=dtypes, keep_default_na=False)
+
+
+def sort_by_stime(chunks, horizon_ms=STIME_HORIZON_MS):
+    """Re-ordena por stime (sort estable) un stream de DataFrames que viene en
+    orden de expiración de NFStream. Libera las filas con stime menor que el
+    mayor ltime visto menos horizon_ms: ninguna fila por llegar puede ir
+    antes. La memoria queda acotada por los flujos de una ventana."""
+    pending = None
+    max_ltime = -np.inf
+    for chunk in chunks:
+        pending = chunk if pending is None else pd.concat([pending, chunk], ignore_index=True)
+        max_ltime = max(max_ltime, chunk['ltime'].max())
+        ready = pending['stime'] < max_ltime - horizon_ms
+        if ready.any():
+            yield pending[ready].sort_values('stime', kind='mergesort')
+            pending = pending[~ready].reset_index(drop=True)
+    if pending is not None and len(pending):
+        yield pending.sort_values('stime', kind='mergesort')
+
+
+def process_pcap_sliced(file_path, label, out_path, n_slices, workers, slice_by='bytes',
+                        n_meters=0, chunk_size=DEFAULT_CHUNK_SIZE, nfstream_options=None,
+                        normalize_in="consumer"):
+    """Procesa un PCAP cortado en n_slices medidos en paralelo (workers
+    procesos) y escribe un _base.csv equivalente al de process_pcap.
+    Devuelve (flujos escritos, uniones en bordes)."""
+    out_path = Path(out_path)
+    idle_ms   = NFSTREAM_IDLE_TIMEOUT_S * 1000
+    active_ms = NFSTREAM_ACTIVE_TIMEOUT_S * 1000
+
+    slices = plan_pcap_slices(str(file_path), n_slices, slice_by)
+    print(f"{os.path.basename(str(file_path))}: {len(slices)} slices por {slice_by}.")
+
+    with tempfile.TemporaryDirectory(prefix="slices_", dir=out_path.parent) as tmp:
+        tmp = Path(tmp)
+        slice_csvs = [tmp / f"slice_{k:04d}_base.csv" for k in range(len(slices))]
+        # Los slices se escriben a disco de a uno justo antes de encolarlos;
+        # el pool empieza a medir mientras se copian los siguientes.
+        with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = []
+            for k, slice_ in enumerate(slices):
+                slice_pcap = tmp / f"slice_{k:04d}.pcap"
+                write_pcap_slice(str(file_path), slice_, slice_pcap)
+                futures.append(pool.submit(_meter_slice, str(slice_pcap), label,
+                                           slice_csvs[k], n_meters, chunk_size,
+                                           nfstream_options, normalize_in))
+            for future in futures:
+                future.result()
+
+        # Pasada 1: solo las filas de borde (a menos de idle_timeout del
+        # inicio o del fin de su slice) van a memoria.
+        idle_margin = idle_ms + 1   # +1 ms por el redondeo de NFStream a ms
+        boundary = []
+        for k, slice_ in enumerate(slices):
+            rows = []
+            if slice_csvs[k].exists():
+                first_ms = slice_['first_ts'] * 1000.0
+                last_ms  = slice_['last_ts'] * 1000.0
+                for chunk in _read_base_csv(slice_csvs[k], chunk_size):
+                    is_head = (chunk['stime'] - first_ms < idle_margin) & (k > 0)
+                    is_tail = (last_ms - chunk['ltime'] < idle_margin) & (k < len(slices) - 1)
+                    edge = is_head | is_tail
+                    rows.extend(zip(chunk[edge].to_dict('records'),
+                                    is_head[edge].tolist(), is_tail[edge].tolist()))
+            boundary.append(rows)
+
+        stitched, n_merged, conflicts = stitch_slice_flows(
+            boundary, [sl['last_ts'] * 1000.0 for sl in slices], idle_ms, active_ms
         )
+        del boundary
+        remetered = None
+        if conflicts:
+            print(f"{len(conflicts)} llaves con flujos > active_timeout en un borde; "
+                  f"re-midiendo con filtro BPF...")
+            remetered = remeter_flow_keys(file_path, label, conflicts, n_meters=n_meters,
+                                          chunk_size=chunk_size,
+                                          nfstream_options=nfstream_options,
+                                          normalize_in=normalize_in)
+        conflict_ips = {ip for _, (ip, _), _ in conflicts}
+
+        # Pasada 2: filas interiores (menos las llaves re-medidas) ordenadas
+        # por stime, con las de borde re-unidas y las re-medidas intercaladas.
+        tmp_out = out_path.with_name(out_path.name + ".tmp")
+        n_rows = 0
+
+        def append(frame):
+            nonlocal n_rows
+            if len(frame):
+                frame.to_csv(tmp_out, mode='w' if n_rows == 0 else 'a',
+                             header=(n_rows == 0), index=False)
+                n_rows += len(frame)
 
-    total_pcap = 0
+        def interior_chunks():
+            for k, slice_ in enumerate(slices):
+                if not slice_csvs[k].exists():
+                    continue
+                first_ms = slice_['first_ts'] * 1000.0
+                last_ms  = slice_['last_ts'] * 1000.0
+                for chunk in _read_base_csv(slice_csvs[k], chunk_size):
+                    edge = (((chunk['stime'] - first_ms < idle_margin) & (k > 0))
+                            | ((last_ms - chunk['ltime'] < idle_margin) & (k < len(slices) - 1)))
+                    interior = chunk[~edge]
+                    if conflicts:
+                        suspect = (interior['src_ip'].isin(conflict_ips)
+                                   | interior['dst_ip'].isin(conflict_ips))
+                        drop = [flow_key(r) in conflicts
+                                for r in interior[suspect].to_dict('records')]
+                        interior = interior.drop(interior[suspect].index[drop])
+                    if len(interior):
+                        yield interior
+
+        extra = [pd.DataFrame(stitched, columns=BASE_COLUMNS)]
+        if remetered is not None:
+            extra.append(remetered)
+        extra = pd.concat(extra, ignore_index=True).sort_values('stime', kind='mergesort')
+        extra_stime = extra['stime'].to_numpy()
+        n_extra = 0
+        for ready in sort_by_stime(interior_chunks()):
+            # ready va después de todo lo ya escrito: antes entran las filas
+            # extra con stime hasta el último de ready.
+            upto = int(np.searchsorted(extra_stime, ready['stime'].iloc[-1], side='right'))
+            if upto > n_extra:
+                ready = pd.concat([ready, extra.iloc[n_extra:upto]], ignore_index=True)
+                ready = ready.sort_values('stime', kind='mergesort')
+                n_extra = upto
+            append(ready)
+        append(extra.iloc[n_extra:])
+        if n_rows:
+            os.replace(tmp_out, out_path)
+    return n_rows, n_merged
+
+
+# ----------------------------------------------------------------------------
+# Ingesta de múltiples PCAPs (serial o con pool de procesos)
+# ----------------------------------------------------------------------------
+# Cada PCAP es un job independiente: su _base.csv no depende de ningún otro
+# archivo, así que los jobs se pueden repartir en un ProcessPoolExecutor.
+# NFStreamer lanza sus propios procesos meter (n_meters) además del proceso
+# que consume los flujos, por lo que cada job ocupa n_meters + 1 cores. El
+# número de workers por defecto se calcula con eso en mente para no
+# sobre-suscribir la máquina.
+#
+# Los jobs se agendan del más grande al más chico (por tamaño en disco): el
+# PCAP más pesado arranca primero y los chicos rellenan los huecos al final,
+# en vez de quedar un único archivo gigante corriendo solo al terminar.
+
+def collect_pcap_jobs(pcap_folder):
+    """Recorre pcap_folder y devuelve los jobs de ingesta ordenados por tamaño
+    descendente. Cada job es un dict con file_path, label, out_name y size."""
+    jobs = []
     for root, _, files in os.walk(pcap_folder):
         for pcap_file in files:
             if not pcap_file.endswith((".pcap", ".pcapng")):
@@ -255,17 +1139,711 @@ if __name__ == '__main__':
                 print(f"Omitido: carpeta '{raw_label}' no está mapeada.")
                 continue
 
-            print(f"\nLeyendo archivo: {file_path}")
-            start = time.time()
-            flows = process_pcap(file_path, label)
-            print(f"Archivo procesado en {time.time() - start:.2f} segundos.")
+            jobs.append({
+                'file_path': file_path,
+                'pcap':      Path(os.path.relpath(file_path, pcap_folder)).as_posix(),
+                'label':     label,
+                'out_name':  os.path.splitext(pcap_file)[0] + "_base.csv",
+                'size':      os.path.getsize(file_path),
+            })
+
+    jobs.sort(key=lambda j: j['size'], reverse=True)
+    return jobs
+
+
+def default_workers(n_meters):
+    """Workers que caben en la máquina si cada job usa n_meters meters más
+    el proceso consumidor."""
+    return max(1, (os.cpu_count() or 1) // (n_meters + 1))
+
+
+def _job_result(job, error=None):
+    """Resumen vacío de un job (lo que reporta print_summary)."""
+    return {
+        'file':     os.path.basename(job['file_path']),
+        'pcap':     job['pcap'],
+        'out_name': job['out_name'],
+        'label':    job['label'],
+        'flows':    0,
+        'seconds':  0.0,
+        'output':   None,
+        'source':   None,
+        'error':    error,
+    }
+
+
+def ingest_pcap(job, output_folder, n_meters=0, chunk_size=DEFAULT_CHUNK_SIZE,
+                nfstream_options=None):
+    """Procesa un job y escribe su _base.csv. Se ejecuta tanto en serial como
+    dentro de un worker del pool, así que nunca lanza excepciones: los errores
+    vuelven en el resumen del job. Si el job trae 'slicing' ({'n', 'by',
+    'workers'}) y es PCAP clásico, se procesa con process_pcap_sliced; su
+    'normalize_in' (default "consumer") se pasa a process_pcap."""
+    out_path = Path(output_folder) / job['out_name']
+    result = _job_result(job)
+
+    print(f"\nLeyendo archivo: {job['file_path']}")
+    start = time.time()
+    try:
+        # Huella del PCAP tomada antes de leerlo (va al manifest). El hash se
+        # calcula aquí para que en modo pool también corra en paralelo.
+        result['source'] = pcap_fingerprint(job['file_path'])
+        normalize_in = job.get('normalize_in', "consumer")
+        slicing = job.get('slicing')
+        if slicing and is_classic_pcap(job['file_path']):
+            result['flows'], n_merged = process_pcap_sliced(
+                job['file_path'], job['label'], out_path, slicing['n'], slicing['workers'],
+                slice_by=slicing['by'], n_meters=n_meters, chunk_size=chunk_size,
+                nfstream_options=nfstream_options, normalize_in=normalize_in,
+            )
+            print(f"{n_merged} flujos re-unidos en bordes de slice.")
+        else:
+            chunks = process_pcap(job['file_path'], job['label'],
+                                  n_meters=n_meters, chunk_size=chunk_size,
+                                  nfstream_options=nfstream_options,
+                                  normalize_in=normalize_in)
+            result['flows'] = write_base_csv(chunks, out_path)
+        if result['flows']:
+            result['output'] = str(out_path)
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['seconds'] = time.time() - start
+
+    if result['error']:
+        print(f"Error procesando {result['file']}: {result['error']}")
+    else:
+        print(f"Archivo procesado en {result['seconds']:.2f} segundos.")
+        if result['output']:
+            print(f"Guardado en: {result['output']}")
+    return result
+
+
+def run_ingestion(jobs, output_folder, workers=1, n_meters=0,
+                  chunk_size=DEFAULT_CHUNK_SIZE, nfstream_options=None,
+                  on_result=None):
+    """Ejecuta los jobs y devuelve sus resúmenes en el orden de agenda.
+    workers == 1 corre en el proceso actual (comportamiento original).
+    Los jobs con 'slicing' corren primero, de a uno y desde este proceso (su
+    paralelismo está dentro del archivo). on_result(result), si se entrega,
+    se llama en este proceso apenas termina cada job (p.ej. para ir
+    actualizando el manifest)."""
+    results = [None] * len(jobs)
+    pending = []
+    for i, job in enumerate(jobs):
+        if workers > 1 and not job.get('slicing'):
+            pending.append(i)
+            continue
+        results[i] = ingest_pcap(job, output_folder, n_meters, chunk_size, nfstream_options)
+        if on_result:
+            on_result(results[i])
+    if not pending:
+        return results
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(ingest_pcap, jobs[i], output_folder, n_meters, chunk_size,
+                        nfstream_options): i
+            for i in pending
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                # El worker murió (p.ej. BrokenProcessPool por OOM).
+                results[i] = _job_result(jobs[i], f"{type(e).__name__}: {e}")
+            if on_result:
+                on_result(results[i])
+    return results
+
+
+def print_summary(results, wall_seconds):
+    """Resumen por archivo: tiempo, flujos y fallas."""
+    print("\nResumen de ingesta:")
+    print(f"  {'archivo':<40s} {'etiqueta':<11s} {'flujos':>10s} {'seg':>9s}  estado")
+    for r in results:
+        status = "ERROR: " + r['error'] if r['error'] else ("ok" if r['output'] else "sin flujos")
+        print(f"  {r['file']:<40s} {r['label']:<11s} {r['flows']:>10d} "
+              f"{r['seconds']:>9.2f}  {status}")
+    n_failed = sum(1 for r in results if r['error'])
+    print(f"  total: {sum(r['flows'] for r in results)} flujos, "
+          f"{n_failed} fallas, {wall_seconds:.2f} s de reloj "
+          f"({sum(r['seconds'] for r in results):.2f} s sumados por archivo)")
+
+
+# ----------------------------------------------------------------------------
+# Manifest de ingesta (saltar PCAPs sin cambios)
+# ----------------------------------------------------------------------------
+# DATASETS/part1_manifest.json guarda, por cada _base.csv, de qué PCAP salió
+# (ruta relativa a PCAP/, tamaño, mtime, sha256 del contenido) y con qué
+# configuración de Part1 (PART1_CONFIG: LABEL_MAPPING, columnas, versión de
+# los normalizadores). En una re-corrida solo se re-ingestan los PCAPs
+# nuevos, modificados o cuya configuración cambió; el resto se omite.
+#
+# Comparación en dos niveles (como el índice de git): si tamaño y mtime
+# coinciden se confía en la entrada; si solo cambió el mtime se re-hashea y,
+# si el contenido es el mismo, se actualiza la entrada sin re-ingestar.
+
+MANIFEST_NAME = "part1_manifest.json"
+
+# Subir cuando cambie la lógica de proto_to_str / dns_bool_to_zeek_str /
+# normalize_* / derive_* / *_column: invalida todos los _base.csv.
+NORMALIZER_VERSION = 1
+
+
+def part1_config(nfstream_options):
+    """Todo lo que, si cambia, hace que un _base.csv existente quede obsoleto.
+    De las opciones de NFStreamer solo n_dissections cambia valores del
+    _base.csv (service); statistical/splt no se leen."""
+    return {
+        'label_mapping':      LABEL_MAPPING,
+        'columns':            BASE_COLUMNS,
+        'normalizer_version': NORMALIZER_VERSION,
+        'n_dissections':      nfstream_options['n_dissections'],
+    }
+
+
+def config_fingerprint(config):
+    blob = json.dumps(config, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(blob).hexdigest()[:16]
+
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def pcap_fingerprint(path):
+    """size/mtime/sha256 de un PCAP. El stat se toma antes del hash: si el
+    archivo cambia mientras se lee, la próxima corrida lo verá modificado."""
+    st = os.stat(path)
+    return {
+        'size':     st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'sha256':   file_sha256(path),
+    }
+
+
+def load_manifest(output_folder):
+    path = Path(output_folder) / MANIFEST_NAME
+    if not path.exists():
+        return {'entries': {}}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, output_folder):
+    path = Path(output_folder) / MANIFEST_NAME
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def job_status(job, entry, output_folder, config_fp):
+    """Estado de un job contra su entrada del manifest:
+    'nuevo', 'sin salida', 'config', 'modificado', 'al día' o 'tocado'
+    (solo cambió el mtime; el contenido es el mismo)."""
+    if entry is None:
+        return 'nuevo'
+    if not (Path(output_folder) / job['out_name']).exists():
+        return 'sin salida'
+    if entry.get('config') != config_fp:
+        return 'config'
+    if entry.get('pcap') != job['pcap'] or entry.get('size') != job['size']:
+        return 'modificado'
+    if entry.get('mtime_ns') == os.stat(job['file_path']).st_mtime_ns:
+        return 'al día'
+    return 'tocado' if file_sha256(job['file_path']) == entry.get('sha256') else 'modificado'
+
+
+def plan_ingestion(jobs, manifest, output_folder, config_fp, force=False):
+    """Separa los jobs en (a_procesar, estados). estados es una lista de
+    (out_name, estado) que incluye los _base.csv del manifest cuyo PCAP ya no
+    existe ('huérfano'). Los jobs 'tocado' no se re-ingestan, pero su entrada
+    se refresca con el nuevo mtime."""
+    entries  = manifest['entries']
+    to_run   = []
+    statuses = []
+    for job in jobs:
+        status = 'forzado' if force else job_status(
+            job, entries.get(job['out_name']), output_folder, config_fp
+        )
+        if status == 'tocado':
+            entries[job['out_name']]['mtime_ns'] = os.stat(job['file_path']).st_mtime_ns
+        elif status != 'al día':
+            to_run.append(job)
+        statuses.append((job['out_name'], status))
+
+    current = {job['out_name'] for job in jobs}
+    statuses.extend((name, 'huérfano') for name in sorted(entries) if name not in current)
+    return to_run, statuses
+
+
+def print_plan(statuses):
+    stale = [(name, st) for name, st in statuses if st not in ('al día', 'tocado')]
+    print(f"Manifest: {len(statuses) - len(stale)} _base.csv al día, "
+          f"{len(stale)} obsoletos o nuevos.")
+    for name, status in stale:
+        print(f"  {name:<45s} {status}")
+
+
+def manifest_updater(manifest, output_folder, config_fp):
+    """Callback para run_ingestion: registra cada job exitoso en el manifest
+    y lo persiste de inmediato, así una corrida interrumpida no pierde lo ya
+    ingestado."""
+    def on_result(result):
+        if result['error'] or result['source'] is None:
+            return
+        entries = manifest['entries']
+        if result['output']:
+            entries[result['out_name']] = {
+                'pcap':   result['pcap'],
+                'config': config_fp,
+                'flows':  result['flows'],
+                **result['source'],
+            }
+        else:
+            # PCAP sin flujos: no hay _base.csv que registrar.
+            entries.pop(result['out_name'], None)
+        save_manifest(manifest, output_folder)
+    return on_result
 
-            if flows:
-                total_pcap += 1
-                df = pd.DataFrame(flows)
-                out_name = os.path.splitext(pcap_file)[0] + "_base.csv"
-                out_path = output_folder / out_name
-                df.to_csv(out_path, index=False)
-                print(f"Guardado en: {out_path}")
 
+def stale_downstream(results, script_dir):
+    """_combined.csv de Part2 derivados de _base.csv re-ingestados en esta
+    corrida: quedaron obsoletos y hay que regenerarlos."""
+    multifet = Path(script_dir) / "Ton-IoT-MultiFet"
+    stale = []
+    for r in results:
+        if r['output']:
+            combined = multifet / r['out_name'].replace("_base.csv", "_combined.csv")
+            if combined.exists():
+                stale.append(combined.name)
+    return stale
+
+
+# ----------------------------------------------------------------------------
+# Modo follow: ingesta continua de capturas rotadas (tcpdump -G / -C)
+# ----------------------------------------------------------------------------
+# En los sensores tcpdump escribe una captura nueva cada -G segundos (o cada
+# -C MB). follow_captures vigila un directorio y, apenas una captura queda
+# cerrada, la mide con process_pcap y agrega sus flujos al final de un único
+# _base.csv (sin reconstruir nada de lo ya ingestado).
+#
+# Una captura se considera cerrada cuando:
+#   - ya existe una captura más nueva en el directorio (tcpdump rotó), o
+#   - no cambió de tamaño ni mtime en los últimos settle segundos (la última
+#     captura cuando el sensor se detiene, o archivos copiados a mano).
+# Con poll_s = 1 la latencia desde la rotación hasta las filas en disco es
+# ~1 s más el tiempo de medir la captura.
+#
+# Estado en el manifest, bajo 'follow' -> out_name: configuración, capturas
+# ya ingestadas y el tamaño en bytes del _base.csv tras la última captura
+# completa. Al reanudar, si el _base.csv es más largo que eso (la corrida
+# anterior murió a mitad de un append) se trunca a ese tamaño y la captura
+# se vuelve a ingestar, así que nunca quedan flujos duplicados ni a medias.
+#
+# Los flujos que cruzan una rotación quedan partidos en dos filas (una por
+# captura), igual que si cada captura se procesara por separado en batch.
+
+DEFAULT_FOLLOW_PATTERN = "*.pcap*"   # .pcap, .pcapng y las rotaciones -C (x.pcap1)
+DEFAULT_FOLLOW_POLL_S  = 1.0
+DEFAULT_FOLLOW_SETTLE_S = 5.0
+
+
+def closed_captures(watch_dir, pattern, done, settle_s, now=None):
+    """Capturas de watch_dir (que calzan con pattern, sin recorrer
+    subcarpetas) cerradas y todavía no ingestadas, en orden de escritura.
+    done es el conjunto de nombres ya ingestados."""
+    now = time.time() if now is None else now
+    captures = []
+    for path in Path(watch_dir).glob(pattern):
+        if path.is_file() and not path.name.endswith(".tmp"):
+            st = path.stat()
+            captures.append((st.st_mtime, path.name, path))
+    captures.sort()
+
+    ready = []
+    for i, (mtime, name, path) in enumerate(captures):
+        if name in done:
+            continue
+        rotated = i < len(captures) - 1
+        if rotated or now - mtime >= settle_s:
+            ready.append(path)
+    return ready
+
+
+def load_follow_state(manifest, out_name, config_fp, out_path, force=False):
+    """Estado de follow para out_name (ver arriba). Con force, o si el
+    _base.csv no existe, se parte de cero. Si la configuración de Part1
+    cambió, o si el _base.csv existe pero no hay estado de follow (no lo
+    generó --follow, p. ej. un _base.csv batch o un manifest borrado), aborta
+    sin tocarlo: solo se borra con --force."""
+    follow = manifest.setdefault('follow', {})
+    state = follow.get(out_name)
+    if state is None and out_path.exists() and not force:
+        raise SystemExit(
+            f"{out_name} ya existe y no tiene estado de follow en el manifest; usar "
+            f"--force para reemplazarlo por uno generado con las capturas presentes."
+        )
+    if force or state is None or not out_path.exists():
+        state = {'config': config_fp, 'captures': {}, 'bytes': 0, 'flows': 0}
+        follow[out_name] = state
+        if out_path.exists():
+            out_path.unlink()
+        return state
+    if state['config'] != config_fp:
+        raise SystemExit(
+            f"{out_name} se generó con otra configuración de Part1; usar --force "
+            f"para regenerarlo desde cero con las capturas presentes."
+        )
+    size = out_path.stat().st_size
+    if size > state['bytes']:
+        print(f"{out_name}: descartando {size - state['bytes']} bytes de un append "
+              f"interrumpido.")
+        with open(out_path, 'r+b') as f:
+            f.truncate(state['bytes'])
+    return state
+
+
+def append_capture(capture, label, out_path, state, n_meters=0,
+                   chunk_size=DEFAULT_CHUNK_SIZE, nfstream_options=None,
+                   normalize_in="consumer"):
+    """Mide una captura cerrada y agrega sus flujos al final de out_path.
+    Los flujos van primero a un .tmp y se copian de una vez al final, así el
+    _base.csv solo crece con capturas completas. Devuelve los flujos
+    agregados."""
+    tmp_csv = out_path.with_name(out_path.name + ".capture.tmp")
+    chunks = process_pcap(str(capture), label, n_meters=n_meters, chunk_size=chunk_size,
+                          nfstream_options=nfstream_options, normalize_in=normalize_in)
+    n_flows = write_base_csv(chunks, tmp_csv)
+    if n_flows:
+        with open(tmp_csv, 'rb') as src, open(out_path, 'ab') as dst:
+            if state['bytes'] > 0:
+                src.readline()   # el header ya está en out_path
+            shutil.copyfileobj(src, dst)
+            dst.flush()
+            os.fsync(dst.fileno())
+        tmp_csv.unlink()
+        state['bytes'] = out_path.stat().st_size
+    state['flows'] += n_flows
+    state['captures'][capture.name] = {'flows': n_flows, **pcap_fingerprint(capture)}
+    return n_flows
+
+
+def follow_captures(watch_dir, label, output_folder, out_name, manifest, config_fp,
+                    pattern=DEFAULT_FOLLOW_PATTERN, poll_s=DEFAULT_FOLLOW_POLL_S,
+                    settle_s=DEFAULT_FOLLOW_SETTLE_S, n_meters=0,
+                    chunk_size=DEFAULT_CHUNK_SIZE, nfstream_options=None,
+                    normalize_in="consumer", once=False, force=False):
+    """Ingesta continua de watch_dir hacia output_folder/out_name. Corre hasta
+    Ctrl+C; con once procesa las capturas ya cerradas y termina. Devuelve el
+    número de capturas ingestadas."""
+    out_path = Path(output_folder) / out_name
+    state = load_follow_state(manifest, out_name, config_fp, out_path, force=force)
+    save_manifest(manifest, output_folder)
+    print(f"Siguiendo {watch_dir} ({pattern}) -> {out_path}  [label={label}, "
+          f"{len(state['captures'])} capturas ya ingestadas]")
+
+    n_ingested = 0
+    try:
+        while True:
+            for capture in closed_captures(watch_dir, pattern, state['captures'], settle_s):
+                start = time.time()
+                try:
+                    n_flows = append_capture(capture, label, out_path, state, n_meters,
+                                             chunk_size, nfstream_options, normalize_in)
+                except Exception as e:
+                    # Captura corrupta o truncada: se registra para no
+                    # reintentarla en cada vuelta y se sigue con la próxima.
+                    print(f"Error procesando {capture.name}: {type(e).__name__}: {e}")
+                    state['captures'][capture.name] = {
+                        'flows': 0, 'error': f"{type(e).__name__}: {e}",
+                    }
+                else:
+                    n_ingested += 1
+                    print(f"{capture.name}: {n_flows} flujos en {time.time() - start:.2f} s "
+                          f"(total {state['flows']}).")
+                save_manifest(manifest, output_folder)
+            if once:
+                break
+            time.sleep(poll_s)
+    except KeyboardInterrupt:
+        print("\nFollow detenido.")
+    return n_ingested
+
+
+# ----------------------------------------------------------------------------
+# Modo fused: PCAP -> _combined.csv en una pasada (Part1 + Part2)
+# ----------------------------------------------------------------------------
+# En vez de escribir _base.csv, releerlo en Part2 y re-ordenarlo por stime,
+# los chunks de process_pcap pasan directo por enrich_dataset de Part2
+# (KitsuneExtractor, counters y agregaciones) y se escriben las filas de
+# _combined.csv. _base.csv pasa a ser salida opcional de debug (--keep-base).
+#
+# NFStream emite los flujos en orden de expiración, no de stime. Un flujo
+# que todavía no expiró tiene su último paquete a menos de idle_timeout del
+# reloj del meter y dura menos de active_timeout, así que su stime es mayor
+# que (reloj - idle - active). Como el reloj es al menos el mayor ltime ya
+# emitido, StimeReorderBuffer (definido en Part2, que lo usa también para
+# --merge) puede liberar, ordenados por (stime, orden de emisión), todos los
+# flujos con stime < max_ltime - STIME_HORIZON_MS (la misma ventana que
+# sort_by_stime en --slices): ninguno que llegue después puede ir antes. Es
+# el mismo orden que el sort estable de enrich_dataset sobre el _base.csv
+# completo. La memoria queda acotada por los flujos de una ventana de ~35
+# minutos de tráfico, no por el PCAP.
+#
+# El estado de Part2 se comparte entre archivos, así que se procesan en
+# serie y en orden de su primer paquete (Part2 batch usa el stime del primer
+# flujo del _base.csv; coinciden salvo PCAPs que se solapan en el tiempo).
+# Los _combined.csv se regeneran todos; el manifest de Part1 no se toca.
+
+
+def pcap_first_timestamp(path):
+    """Timestamp del primer paquete de un PCAP clásico (None si no es clásico
+    o está vacío)."""
+    if not is_classic_pcap(path):
+        return None
+    for _, ts in scan_pcap_records(path):
+        return ts
+    return None
+
+
+def _append_csv(frame, path, first):
+    frame.to_csv(path, mode='w' if first else 'a', header=first, index=False)
+
+
+def fuse_pcap(job, part2, kitsune, dst_bytes_running, combined_path, base_path=None,
+              n_meters=0, chunk_size=DEFAULT_CHUNK_SIZE, nfstream_options=None,
+              normalize_in="consumer"):
+    """PCAP -> _combined.csv (y _base.csv si base_path). kitsune y
+    dst_bytes_running son el estado de Part2 que sigue al próximo archivo.
+    Devuelve (flujos medidos, filas de _combined.csv, flujos fuera de orden)."""
+    combined_tmp = combined_path.with_name(combined_path.name + ".tmp")
+    base_tmp = base_path.with_name(base_path.name + ".tmp") if base_path else None
+    conn_counters = part2.new_conn_counters()
+    reorder = part2.StimeReorderBuffer(STIME_HORIZON_MS, BASE_COLUMNS)
+    n_flows = n_rows = 0
+
+    def enrich(ready):
+        nonlocal n_rows
+        if len(ready):
+            enriched = part2.enrich_dataset(part2.base_frame_as_read(ready), kitsune,
+                                            dst_bytes_running, conn_counters)
+            if len(enriched):
+                _append_csv(enriched, combined_tmp, n_rows == 0)
+                n_rows += len(enriched)
+
+    try:
+        for chunk in process_pcap(job['file_path'], job['label'], n_meters=n_meters,
+                                  chunk_size=chunk_size, nfstream_options=nfstream_options,
+                                  normalize_in=normalize_in):
+            if base_tmp:
+                _append_csv(chunk, base_tmp, n_flows == 0)
+            n_flows += len(chunk)
+            enrich(reorder.push(chunk))
+        enrich(reorder.flush())
+    except BaseException:
+        for tmp in (combined_tmp, base_tmp):
+            if tmp and tmp.exists():
+                tmp.unlink()
+        raise
+    if n_rows:
+        os.replace(combined_tmp, combined_path)
+    if base_tmp and n_flows:
+        os.replace(base_tmp, base_path)
+    return n_flows, n_rows, reorder.late
+
+
+def run_fused(jobs, script_dir, keep_base=False, n_meters=0, chunk_size=DEFAULT_CHUNK_SIZE,
+              nfstream_options=None, normalize_in="consumer", evict_below=None,
+              evict_every_s=60.0):
+    """Procesa todos los jobs en modo fused, en orden de primer paquete.
+    evict_below / evict_every_s configuran la eviction del KitsuneExtractor."""
+    part2 = load_part2(script_dir)
+    combined_folder = Path(script_dir) / "Ton-IoT-MultiFet"
+    combined_folder.mkdir(parents=True, exist_ok=True)
+    base_folder = Path(script_dir) / "DATASETS"
+
+    for job in jobs:
+        job['first_ts'] = pcap_first_timestamp(job['file_path'])
+        if job['first_ts'] is None:
+            print(f"WARN: {job['pcap']} no es PCAP clásico; se procesa al final.")
+    jobs = sorted(jobs, key=lambda j: (j['first_ts'] is None, j['first_ts'] or 0, j['pcap']))
+
+    kitsune = part2.KitsuneExtractor(evict_below, evict_every_s,
+                                     part2.kitsune_columns(part2.SELECTED_FEATURES))
+    dst_bytes_running = defaultdict(float)
+    for job in jobs:
+        combined_name = job['out_name'].replace("_base.csv", "_combined.csv")
+        print(f"\nLeyendo archivo: {job['file_path']}")
+        start = time.time()
+        n_flows, n_rows, late = fuse_pcap(
+            job, part2, kitsune, dst_bytes_running, combined_folder / combined_name,
+            base_path=base_folder / job['out_name'] if keep_base else None,
+            n_meters=n_meters, chunk_size=chunk_size, nfstream_options=nfstream_options,
+            normalize_in=normalize_in,
+        )
+        print(f"{n_flows} flujos -> {n_rows} filas en {combined_name} "
+              f"({time.time() - start:.2f} s).")
+        if late:
+            print(f"WARN: {late} flujos llegaron después de su ventana de re-orden; "
+                  f"quedaron fuera de orden de stime.")
+    print("\n" + part2.kitsune_state_report(kitsune))
+
+
+# ----------------------------------------------------------------------------
+# Main
+# ----------------------------------------------------------------------------
+def parse_args():
+    parser = argparse.ArgumentParser(description="PCAP -> DATASETS/*_base.csv (convención Zeek)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="PCAPs procesados en paralelo. 1 = serial (default); "
+                             "0 = auto (cpu_count // (n_meters + 1)).")
+    parser.add_argument("--n-meters", type=int, default=None,
+                        help="Procesos meter de NFStreamer por PCAP. Default: 0 (auto de "
+                             "NFStream) en serial, 1 con pool.")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="Flujos por chunk escrito a disco (acota la memoria por PCAP).")
+    parser.add_argument("--analysis", choices=("full", "auto"), default="full",
+                        help="Opciones de NFStreamer. full (default): statistical + SPLT + "
+                             "n_dissections=20 como siempre; auto: lo mínimo que requieren "
+                             "las columnas que Part2 consume.")
+    parser.add_argument("--normalize-in", choices=NORMALIZE_MODES, default="consumer",
+                        help="Dónde se convierte al vocabulario Zeek: consumer (default, "
+                             "vectorizado por chunk) o meters (NFPlugins en los procesos "
+                             "meter de NFStream; opt-in, suele ser más lento: con un plugin "
+                             "registrado NFStream llama a Python en cada paquete).")
+    parser.add_argument("--fused", action="store_true",
+                        help="PCAP -> Ton-IoT-MultiFet/*_combined.csv en una pasada (Part1 + "
+                             "Part2), sin escribir _base.csv.")
+    parser.add_argument("--keep-base", action="store_true",
+                        help="Con --fused: escribe también DATASETS/*_base.csv (debug).")
+    parser.add_argument("--evict-below", type=float, default=None,
+                        help="Con --fused: borra los streams Kitsune cuyo weight cayó bajo "
+                             "este valor en todas sus lambdas (p.ej. 1e-6).")
+    parser.add_argument("--evict-every", type=float, default=60.0,
+                        help="Con --fused: segundos de captura entre chequeos de eviction.")
+    parser.add_argument("--slices", type=int, default=0,
+                        help="Corta cada PCAP de al menos --slice-min-mb en N slices medidos en "
+                             "paralelo y re-une los flujos de borde. 0 = desactivado.")
+    parser.add_argument("--slice-by", choices=("bytes", "time"), default="bytes",
+                        help="Cortar en partes de igual tamaño (default) o igual duración.")
+    parser.add_argument("--slice-min-mb", type=float, default=1024,
+                        help="Tamaño mínimo (MB) para cortar un PCAP en slices.")
+    parser.add_argument("--follow", metavar="DIR", default=None,
+                        help="Modo follow: vigila DIR y agrega los flujos de cada captura "
+                             "rotada (ya cerrada) a un único _base.csv.")
+    parser.add_argument("--follow-label", default=None,
+                        help="Clase de las capturas de --follow (carpeta de LABEL_MAPPING o "
+                             "etiqueta final). Default: según el nombre de DIR.")
+    parser.add_argument("--follow-output", default=None,
+                        help="Nombre del _base.csv en DATASETS/. Default: "
+                             "<label>_follow_base.csv.")
+    parser.add_argument("--follow-pattern", default=DEFAULT_FOLLOW_PATTERN,
+                        help="Glob de las capturas dentro de DIR.")
+    parser.add_argument("--poll", type=float, default=DEFAULT_FOLLOW_POLL_S,
+                        help="Segundos entre revisiones de DIR.")
+    parser.add_argument("--settle", type=float, default=DEFAULT_FOLLOW_SETTLE_S,
+                        help="Segundos sin cambios para dar por cerrada la última captura.")
+    parser.add_argument("--once", action="store_true",
+                        help="Con --follow: ingesta lo que ya está cerrado y termina.")
+    parser.add_argument("--force", action="store_true",
+                        help=f"Re-ingesta todos los PCAPs aunque {MANIFEST_NAME} diga que están al día.")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args          = parse_args()
+    script_dir    = Path(__file__).resolve().parent
+    pcap_folder   = script_dir.parent.parent / "PCAP"      # CololocovsLaChile01032026/PCAP/
+    output_folder = script_dir / "DATASETS"
+    output_folder.mkdir(parents=True, exist_ok=True)
+
+    if args.follow:
+        # Modo follow: no toca PCAP/ ni las entradas batch del manifest.
+        raw_label = args.follow_label or Path(args.follow).resolve().name
+        label = LABEL_MAPPING.get(raw_label, args.follow_label)
+        if label is None:
+            raise SystemExit(f"La carpeta '{raw_label}' no está en LABEL_MAPPING; "
+                             f"indicar la clase con --follow-label.")
+        if args.analysis == "full":
+            nfstream_options = dict(FULL_NFSTREAM_OPTIONS)
+        else:
+            nfstream_options = nfstream_options_for(part2_base_columns(script_dir))
+        manifest = load_manifest(output_folder)
+        out_name = args.follow_output or f"{label}_follow_base.csv"
+        follow_captures(args.follow, label, output_folder, out_name, manifest,
+                        config_fingerprint(part1_config(nfstream_options)),
+                        pattern=args.follow_pattern, poll_s=args.poll,
+                        settle_s=args.settle, n_meters=args.n_meters or 0,
+                        chunk_size=args.chunk_size, nfstream_options=nfstream_options,
+                        normalize_in=args.normalize_in, once=args.once, force=args.force)
+        raise SystemExit(0)
+
+    if not pcap_folder.exists():
+        raise FileNotFoundError(
+            f"PCAP folder not found at {pcap_folder}. "
+            "Expected layout: <project>/PCAP/Normal/ and <project>/PCAP/Attacks/<clase>/"
+        )
+
+    n_meters = args.n_meters
+    if n_meters is None:
+        n_meters = 0 if args.workers == 1 else 1
+    workers = args.workers if args.workers > 0 else default_workers(n_meters)
+
+    if args.analysis == "full":
+        nfstream_options = dict(FULL_NFSTREAM_OPTIONS)
+    else:
+        nfstream_options = nfstream_options_for(part2_base_columns(script_dir))
+    print(f"Opciones de NFStreamer ({args.analysis}): {nfstream_options}")
+
+    if args.fused:
+        start = time.time()
+        run_fused(collect_pcap_jobs(pcap_folder), script_dir, keep_base=args.keep_base,
+                  n_meters=n_meters, chunk_size=args.chunk_size,
+                  nfstream_options=nfstream_options, normalize_in=args.normalize_in,
+                  evict_below=args.evict_below, evict_every_s=args.evict_every)
+        print(f"Modo fused terminado en {time.time() - start:.2f} s.")
+        raise SystemExit(0)
+
+    config_fp = config_fingerprint(part1_config(nfstream_options))
+    manifest  = load_manifest(output_folder)
+    jobs      = collect_pcap_jobs(pcap_folder)
+    jobs, statuses = plan_ingestion(jobs, manifest, output_folder, config_fp, force=args.force)
+    save_manifest(manifest, output_folder)   # persiste las entradas 'tocado'
+    print_plan(statuses)
+    print(f"{len(jobs)} PCAPs a procesar con {workers} worker(s), n_meters={n_meters}.")
+
+    for job in jobs:
+        job['normalize_in'] = args.normalize_in
+
+    if args.slices > 1:
+        # Con --workers 1 igual se paralelizan los slices (para eso se pidieron).
+        slice_workers = workers if workers > 1 else default_workers(n_meters)
+        for job in jobs:
+            if job['size'] >= args.slice_min_mb * 2**20:
+                job['slicing'] = {'n': args.slices, 'by': args.slice_by,
+                                  'workers': slice_workers}
+                print(f"  {job['pcap']}: {args.slices} slices por {args.slice_by}, "
+                      f"{slice_workers} workers")
+
+    start   = time.time()
+    results = run_ingestion(jobs, output_folder, workers=workers, n_meters=n_meters,
+                            chunk_size=args.chunk_size, nfstream_options=nfstream_options,
+                            on_result=manifest_updater(manifest, output_folder, config_fp))
+    print_summary(results, time.time() - start)
+
+    total_pcap = sum(1 for r in results if r['output'])
     print(f"\n{total_pcap} archivos PCAP procesados y flujos base generados.")
+
+    stale = stale_downstream(results, script_dir)
+    if stale:
+        print(f"\n{len(stale)} _combined.csv de Part2 quedaron obsoletos (su _base.csv "
+              f"fue regenerado); borrarlos antes de re-correr Part2:")
+        for name in stale:
+            print(f"  Ton-IoT-MultiFet/{name}")
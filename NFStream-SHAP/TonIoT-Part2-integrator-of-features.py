@@ -16,10 +16,33 @@
 #
 # Entrada : DATASETS/*_base.csv     (de Part1)
 # Salida  : Ton-IoT-MultiFet/*_combined.csv
+#
+# El estado entre archivos se guarda en Ton-IoT-MultiFet/.part2_state/ despues
+# de cada archivo; una corrida con _base.csv nuevos retoma del ultimo
+# checkpoint valido (ver "Checkpoints").
+#
+# Con --features / --shap-union se escriben solo las columnas objetivo (y lo
+# que necesitan, ver "Registro de features"); por defecto SELECTED_FEATURES.
+# --kitsune-families / --kitsune-lambdas agregan el resto de Kitsune: H,
+# MI_dir, HH, HH_jit y HpHp (HH y HpHp con los stats 2D magnitude, radius,
+# covariance y pcc) sobre las lambdas 0.01, 0.1, 1, 3 y 5.
+#
+# Part1 --fused usa enrich_dataset directamente sobre los flujos de
+# NFStreamer (sin pasar por _base.csv) y produce los mismos _combined.csv.
 
+import argparse
+import hashlib
+import heapq
+import itertools
+import json
 import math
+import multiprocessing
 import os
-from collections import defaultdict
+import pickle
+import queue
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import numpy as np
@@ -52,6 +75,26 @@ SELECTED_FEATURES = [
     'label',
 ]
 
+# Columnas de _base.csv que enrich_dataset necesita en cada fila (las filas
+# con alguna de estas vacia se descartan). Part1 las usa, junto con las de
+# SELECTED_FEATURES que vienen tal cual de _base.csv, para decidir que
+# analisis de NFStreamer activar.
+REQUIRED_BASE_COLUMNS = [
+    'src_ip', 'dst_ip', 'src_pkts', 'dst_pkts',
+    'src_ip_bytes', 'dst_ip_bytes', 'proto', 'dst_port',
+    'stime', 'ltime', 'dur', 'conn_state', 'service', 'dns_rejected', 'label',
+]
+
+# Strings que pd.read_csv interpreta como NaN por defecto (na_values de
+# pandas). Un _base.csv leido del disco trae esos valores como NaN, y las
+# filas con NaN en REQUIRED_BASE_COLUMNS se descartan (p.ej. service='None').
+# base_frame_as_read aplica lo mismo a flujos que no pasaron por el CSV.
+CSV_NA_VALUES = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+    '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a',
+    'nan', 'null',
+}
+
 _PROTO_TO_NUM = {"tcp": 6, "udp": 17, "Other": 0, "None": -1}
 _STATE_TO_NUM = {"S0": 1, "SF": 2, "REJ": 3, "OTH": 0, "Other": -1, "None": -2}
 
@@ -60,197 +103,1792 @@ _STATE_TO_NUM = {"S0": 1, "SF": 2, "REJ": 3, "OTH": 0, "Other": -1, "None": -2}
 # Kitsune-style damped incremental statistics
 # (Mirsky et al. 2018, "Kitsune: An Ensemble of Autoencoders for Online
 #  Network Intrusion Detection".)
+#
+# Estado: para cada familia (H, MI_dir, HH_jit) una _DampedStatTable con una
+# fila por stream y una columna por lambda (las 2D, HH y HpHp, una
+# _DampedCovTable). Los hosts se internan a ids enteros y las llaves de pares
+# se arman como un solo entero (src_id << 32 | dst_id, o min/max para el par
+# sin direccion), asi que el estado es un dict llave-entera -> fila mas
+# arreglos NumPy (n_streams, n_lambdas). HpHp arma sus pares con ids de
+# endpoint (host, puerto) en lugar de ids de host.
 # ============================================================================
-class _DampedStat:
-    """Single damped statistic accumulator para una (stream, lambda)."""
-    __slots__ = ('lam', 'last_t', 'count', 'lin_sum', 'sq_sum')
-
-    def __init__(self, lam):
-        self.lam = lam
-        self.last_t = None
-        self.count = 0.0
-        self.lin_sum = 0.0
-        self.sq_sum = 0.0
-
-    def update(self, t_ms, value):
-        if self.last_t is not None and t_ms > self.last_t:
-            dt = (t_ms - self.last_t) / 1000.0   # ms -> seconds
-            decay = math.exp(-self.lam * dt)
-            self.count *= decay
-            self.lin_sum *= decay
-            self.sq_sum *= decay
-        self.count += 1.0
-        self.lin_sum += value
-        self.sq_sum += value * value
-        self.last_t = t_ms
-
-    def weight(self):
-        return self.count
-
-    def mean(self):
-        return self.lin_sum / self.count if self.count > 0 else 0.0
-
-    def std(self):
-        if self.count <= 0:
+_HOST_ID_BITS = 32
+_PORT_BITS     = 17   # puerto + 1 (0 = sin puerto) en la llave de endpoint de HpHp
+_KITSUNE_STATS    = ('weight', 'mean', 'std')
+_KITSUNE_STATS_2D = _KITSUNE_STATS + ('magnitude', 'radius', 'covariance', 'pcc')
+
+
+def _intern(keys, index, start=None):
+    """Ids de keys (arreglo) segun el dict index, agregando las llaves nuevas
+    con ids consecutivos desde start (por defecto len(index)) en orden de
+    primera aparicion. Solo las llaves distintas del arreglo pasan por el
+    dict (factorize las devuelve en orden de aparicion)."""
+    codes, uniques = pd.factorize(np.asarray(keys))
+    uniques = uniques.tolist()
+    ids = [index.get(k, -1) for k in uniques]
+    new = [j for j, i in enumerate(ids) if i < 0]
+    if new:
+        if start is None:
+            start = len(index)
+        for offset, j in enumerate(new):
+            ids[j] = index[uniques[j]] = start + offset
+    return np.asarray(ids, dtype=np.int64)[codes]
+
+
+def _bytes_array(values):
+    """Bytes como float64 con la misma regla que update_and_extract
+    (float(v or 0)): None cuenta como 0, NaN e inf se conservan."""
+    values = np.asarray(values)
+    if values.dtype == object:
+        values = np.where(values == None, 0.0, values)   # noqa: E711
+    return values.astype(float)
+
+
+def _step(x, ab):
+    return x * ab[0] + ab[1]
+
+
+def _segmented_scan(a, b, starts, tail=4):
+    """Scan inclusivo de x_j = a_j * x_{j-1} + b_j dentro de cada segmento
+    (de starts[i] hasta antes de starts[i+1]), in place en b. a es (m, L) y b
+    (m, L, k). Cada x_j sale de las mismas dos operaciones (y redondeos) que
+    el update de a un flujo: se avanza un paso por vez en todos los segmentos
+    que siguen activos (vectorizado entre streams) y, cuando quedan tail o
+    menos, esos se terminan con un loop escalar."""
+    m = len(b)
+    lengths = np.diff(np.append(starts, m))
+    order = np.argsort(-lengths, kind='stable')
+    s_desc, l_desc = starts[order], lengths[order]
+    max_len = int(l_desc[0]) if len(l_desc) else 0
+    # n_active[k]: segmentos con mas de k elementos (los primeros de s_desc).
+    n_active = np.searchsorted(-l_desc, -np.arange(max_len), side='left')
+    k = 1
+    while k < max_len and n_active[k] > tail:
+        p = s_desc[:n_active[k]] + k
+        b[p] += a[p][:, :, None] * b[p - 1]
+        k += 1
+    if k < max_len:
+        for s, length in zip(s_desc[:n_active[k]].tolist(), l_desc[:n_active[k]].tolist()):
+            seg_a, seg_b = a[s + k:s + length], b[s + k - 1:s + length]
+            for i in range(b.shape[1]):
+                ai = seg_a[:, i].tolist()
+                for c in range(b.shape[2]):
+                    col = seg_b[:, i, c]
+                    col[:] = list(itertools.accumulate(zip(ai, col[1:].tolist()), _step,
+                                                       initial=float(col[0])))
+    return b
+
+
+class _DampedStatTable:
+    """Estadisticas damped de todos los streams de una familia, para todas
+    sus lambdas: count, lin_sum y sq_sum son arreglos (capacidad, n_lambdas)
+    y last_t (capacidad,) guarda el tiempo (ms) del ultimo update de cada
+    stream (NaN si nunca se actualizo). Con sides > 0 guarda ademas
+    last_r (capacidad, sides, n_lambdas), el ultimo residuo de cada lado
+    de un stream conjunto (ver _DampedCovTable).
+
+    El update de a un flujo lee y escribe los elementos a traves de
+    memoryviews planos de esos mismos arreglos: indexar un memoryview con
+    floats de Python es bastante mas barato que operar sobre filas NumPy de
+    3-4 elementos, y deja las mismas operaciones (y redondeos) que el
+    acumulador escalar original."""
+
+    def __init__(self, lambdas, capacity=1024, sides=0):
+        self.lambdas   = tuple(float(lam) for lam in lambdas)
+        self._neg_lams = tuple(-lam for lam in self.lambdas)
+        self.sides     = sides
+        self.index     = {}   # llave entera -> fila
+        self._alloc(capacity)
+
+    def _alloc(self, capacity):
+        n = len(self.lambdas)
+        self.count   = np.zeros((capacity, n))
+        self.lin_sum = np.zeros((capacity, n))
+        self.sq_sum  = np.zeros((capacity, n))
+        self.last_t  = np.full(capacity, np.nan)
+        if self.sides:
+            self.last_r = np.zeros((capacity, self.sides, n))
+        self._views()
+
+    def _arrays(self):
+        arrays = (self.count, self.lin_sum, self.sq_sum, self.last_t)
+        return arrays + (self.last_r,) if self.sides else arrays
+
+    def _views(self):
+        self._count   = memoryview(self.count).cast('B').cast('d')
+        self._lin_sum = memoryview(self.lin_sum).cast('B').cast('d')
+        self._sq_sum  = memoryview(self.sq_sum).cast('B').cast('d')
+        self._last_t  = memoryview(self.last_t)
+
+    def _grow(self):
+        old = self._arrays()
+        size = len(self.last_t)
+        self._alloc(2 * size)
+        for new_arr, old_arr in zip(self._arrays(), old):
+            new_arr[:size] = old_arr
+
+    def __getstate__(self):
+        # Los memoryviews no se pueden picklear; se rehacen al cargar.
+        state = dict(self.__dict__)
+        for view in ('_count', '_lin_sum', '_sq_sum', '_last_t'):
+            del state[view]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._views()
+
+    def __len__(self):
+        return len(self.index)
+
+    def evict(self, now_ms, threshold, min_idle_ms=0.0):
+        """Borra los streams cuyo weight decaido hasta now_ms quedo bajo
+        threshold en todas las lambdas (y sin updates hace al menos
+        min_idle_ms) y compacta las filas vivas al principio (reduce la
+        capacidad si sobra mas de 3/4). Una llave borrada vuelve a empezar
+        de cero si reaparece. Devuelve el numero de streams borrados."""
+        n = len(self.index)
+        if n == 0:
+            return 0
+        idle = now_ms - self.last_t[:n]
+        dt = np.maximum(idle, 0.0) / 1000.0
+        weight = self.count[:n] * np.exp(-np.asarray(self.lambdas)[None, :] * dt[:, None])
+        keep = ~((weight < threshold).all(axis=1) & (idle >= min_idle_ms))
+        n_keep = int(keep.sum())
+        if n_keep == n:
+            return 0
+
+        keys = np.fromiter(self.index.keys(), dtype=np.int64, count=n)
+        rows = np.fromiter(self.index.values(), dtype=np.int64, count=n)
+        new_row = np.cumsum(keep) - 1
+        alive = keep[rows]
+        self.index = dict(zip(keys[alive].tolist(), new_row[rows[alive]].tolist()))
+
+        live = [arr[:n][keep] for arr in self._arrays()]
+        capacity = len(self.last_t)
+        while capacity > 1024 and n_keep < capacity // 4:
+            capacity //= 2
+        if capacity < len(self.last_t):
+            self._alloc(capacity)
+        else:
+            for arr in self._arrays():
+                arr[n_keep:n] = 0.0
+            self.last_t[n_keep:n] = np.nan
+        for arr, values in zip(self._arrays(), live):
+            arr[:n_keep] = values
+        return n - n_keep
+
+    def nbytes(self):
+        return sum(arr.nbytes for arr in self._arrays())
+
+    def keys(self):
+        """Llaves de los streams vivos, como arreglo int64."""
+        return np.fromiter(self.index, dtype=np.int64, count=len(self.index))
+
+    def row(self, key):
+        """Fila del stream key (la crea si no existe)."""
+        r = self.index.get(key)
+        if r is None:
+            r = len(self.index)
+            if r == len(self.last_t):
+                self._grow()
+            self.index[key] = r
+        return r
+
+    def rows(self, keys):
+        """Filas de un arreglo de llaves (crea las que falten)."""
+        rows = _intern(keys, self.index)
+        while len(self.index) > len(self.last_t):
+            self._grow()
+        return rows
+
+    def scan(self, rows, t_ms, values):
+        """Version batch de update: aplica, en el orden dado, un update por
+        elemento (fila rows[j], tiempo t_ms[j], valor values[j]) y devuelve
+        count, lin_sum y sq_sum despues de cada uno, como arreglos (m, L).
+
+        Por stream la recurrencia es lineal: x_j = decay_j * x_{j-1} + (1, v,
+        v^2) con decay_j = exp(-lam * dt_j). Se ordena por fila (estable, asi
+        cada stream queda en el orden original), el estado guardado entra en
+        el primer elemento de cada stream y el resto es un scan segmentado.
+        Los decays se calculan con math.exp (np.exp difiere en el ultimo bit
+        en algunos valores) y el scan repite las operaciones de update, asi
+        que el resultado es identico bit a bit al de a un flujo. values puede ser (m,) (el mismo valor en
+        todas las lambdas) o (m, L)."""
+        m, lams = len(rows), np.asarray(self.lambdas)
+        order = np.argsort(rows, kind='stable')
+        r, t = rows[order], t_ms[order]
+        v = values[order]
+        if v.ndim == 1:
+            v = v[:, None]
+        first = np.ones(m, dtype=bool)
+        first[1:] = r[1:] != r[:-1]
+
+        # dt respecto del elemento anterior del stream (o del estado guardado).
+        prev_t = np.empty(m)
+        prev_t[1:] = t[:-1]
+        prev_t[first] = self.last_t[r[first]]
+        dt = t - prev_t
+        a = np.ones((m, len(lams)))   # sin decaimiento si no avanza el tiempo (o NaN)
+        go = dt > 0
+        x = (-lams[None, :] * (dt[go, None] / 1000.0)).ravel().tolist()
+        a[go] = np.fromiter(map(math.exp, x), dtype=float, count=len(x)).reshape(-1, len(lams))
+
+        b = np.empty((m, len(lams), 3))
+        b[:, :, 0] = 1.0
+        b[:, :, 1] = v
+        b[:, :, 2] = v * v
+        rf = r[first]
+        b[first, :, 0] += a[first] * self.count[rf]
+        b[first, :, 1] += a[first] * self.lin_sum[rf]
+        b[first, :, 2] += a[first] * self.sq_sum[rf]
+        a[first] = 0.0
+
+        starts = np.flatnonzero(first)
+        _segmented_scan(a, b, starts)
+
+        # Estado final de cada stream = su ultimo elemento.
+        last = np.append(starts[1:] - 1, m - 1) if m else starts
+        rl = r[last]
+        self.count[rl], self.lin_sum[rl], self.sq_sum[rl] = b[last, :, 0], b[last, :, 1], b[last, :, 2]
+        self.last_t[rl] = t[last]
+
+        out = np.empty_like(b)
+        out[order] = b
+        return out[:, :, 0], out[:, :, 1], out[:, :, 2]
+
+    def gaps(self, rows, t_ms):
+        """Para cada elemento, ms desde el update anterior de su stream (el
+        del bloque o el guardado en la tabla); 0 si el stream es nuevo. Es
+        el jitter de HH_jit. No modifica la tabla."""
+        order = np.argsort(rows, kind='stable')
+        r, t = rows[order], t_ms[order]
+        prev_t = np.empty(len(t))
+        prev_t[1:] = t[:-1]
+        first = np.ones(len(t), dtype=bool)
+        first[1:] = r[1:] != r[:-1]
+        prev_t[first] = self.last_t[r[first]]
+        gap_sorted = t - prev_t
+        gap_sorted[np.isnan(gap_sorted)] = 0.0
+        gaps = np.empty(len(t))
+        gaps[order] = gap_sorted
+        return gaps
+
+    def extract(self, family, rows, t_ms, values, columns=None):
+        """scan + weight/mean/std por lambda, como dict columna -> arreglo
+        con nombres '{family}_L{lambda}_{stat}'. columns (un set) limita las
+        columnas devueltas; mean y std solo se calculan si alguna se pide."""
+        count, lin_sum, sq_sum = self.scan(rows, t_ms, values)
+        wanted = {}
+        for i, lam in enumerate(self.lambdas):
+            for stat in _KITSUNE_STATS:
+                name = f"{family}_L{lam:g}_{stat}"
+                if columns is None or name in columns:
+                    wanted[name] = (stat, i)
+        stats = {'weight': count}
+        if any(stat != 'weight' for stat, _ in wanted.values()):
+            with np.errstate(invalid='ignore', divide='ignore'):
+                stats['mean'] = mean = np.where(count > 0, lin_sum / count, 0.0)
+                if any(stat == 'std' for stat, _ in wanted.values()):
+                    var = np.where(count > 0, sq_sum / count - mean * mean, 0.0)
+                    stats['std'] = np.sqrt(np.where(var > 0, var, 0.0))   # como max(0.0, var)
+        return {name: stats[stat][:, i] for name, (stat, i) in wanted.items()}
+
+    def update(self, r, t_ms, value):
+        """Decae la fila r hasta t_ms (si t_ms es posterior al ultimo update)
+        y le suma value en todas las lambdas."""
+        count, lin_sum, sq_sum = self._count, self._lin_sum, self._sq_sum
+        last_t = self._last_t[r]
+        sq = value * value
+        j = r * len(self._neg_lams)
+        if t_ms > last_t:   # False si last_t es NaN
+            dt = (t_ms - last_t) / 1000.0   # ms -> seconds
+            for neg_lam in self._neg_lams:
+                decay = math.exp(neg_lam * dt)
+                count[j]   = count[j] * decay + 1.0
+                lin_sum[j] = lin_sum[j] * decay + value
+                sq_sum[j]  = sq_sum[j] * decay + sq
+                j += 1
+        else:
+            for _ in self._neg_lams:
+                count[j]   += 1.0
+                lin_sum[j] += value
+                sq_sum[j]  += sq
+                j += 1
+        self._last_t[r] = t_ms
+
+    def weight(self, r, i):
+        return self._count[r * len(self.lambdas) + i]
+
+    def mean(self, r, i):
+        j = r * len(self.lambdas) + i
+        count = self._count[j]
+        return self._lin_sum[j] / count if count > 0 else 0.0
+
+    def std(self, r, i):
+        j = r * len(self.lambdas) + i
+        count = self._count[j]
+        if count <= 0:
             return 0.0
-        m = self.mean()
-        var = max(0.0, self.sq_sum / self.count - m * m)
-        return math.sqrt(var)
+        m = self._lin_sum[j] / count
+        return math.sqrt(max(0.0, self._sq_sum[j] / count - m * m))
+
+
+def _last_other_side(groups, side):
+    """Para cada elemento, la posicion del ultimo elemento anterior del
+    mismo grupo con el otro lado (side 0/1), o -1 si no hay en el bloque."""
+    m = len(groups)
+    order = np.argsort(groups, kind='stable')
+    g, s = groups[order], side[order]
+    pos = np.arange(m)
+    first = np.ones(m, dtype=bool)
+    first[1:] = g[1:] != g[:-1]
+    group_start = np.maximum.accumulate(np.where(first, pos, 0)) if m else pos
+    found = np.full(m, -1)
+    for k in (0, 1):
+        last_k = np.maximum.accumulate(np.where(s == k, pos, -1)) if m else pos
+        ok = (s != k) & (last_k >= group_start)
+        found[ok] = last_k[ok]
+    out = np.full(m, -1)
+    out[order] = np.where(found >= 0, order[np.maximum(found, 0)], -1)
+    return out
+
+
+def _mean_var(count, lin_sum, sq_sum):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(count > 0, lin_sum / count, 0.0)
+        var = np.where(count > 0, sq_sum / count - mean * mean, 0.0)
+    return mean, var
+
+
+class _DampedCovTable:
+    """Familia 2D de Kitsune (HH, HpHp): stats damped de cada stream
+    direccional (a -> b) mas, con joint, la covarianza damped entre los dos
+    sentidos del par (incStat_cov de Kitsune). En cada update del lado a
+    con valor v, r_a = v - mean_a (despues del update) y el stream conjunto
+    del par sin direccion suma r_a * r_b, con r_b el ultimo residuo del otro
+    lado (0 si no hay); covariance = esa suma / su weight. magnitude y radius
+    combinan mean y varianza de los dos sentidos (b con su ultimo estado, sin
+    decaer: mean y varianza no cambian con el decaimiento) y
+    pcc = covariance / (std_a * std_b). Un par de un host consigo mismo no
+    tiene otro lado: b es el propio stream."""
+
+    def __init__(self, lambdas, joint=True):
+        self.lambdas = tuple(float(lam) for lam in lambdas)
+        self.streams = _DampedStatTable(lambdas)
+        self.joint   = _DampedStatTable(lambdas, sides=2) if joint else None
+
+    def _tables(self):
+        return (self.streams,) if self.joint is None else (self.streams, self.joint)
+
+    def __len__(self):
+        return len(self.streams)
+
+    def nbytes(self):
+        return sum(table.nbytes() for table in self._tables())
+
+    def keys(self):
+        return np.concatenate([table.keys() for table in self._tables()])
+
+    def evict(self, now_ms, threshold, min_idle_ms=0.0):
+        """Eviction de las dos tablas; devuelve los streams direccionales
+        borrados. Sin su stream conjunto un par vuelve a empezar la
+        covarianza (y los residuos) de cero."""
+        if self.joint is not None:
+            self.joint.evict(now_ms, threshold, min_idle_ms)
+        return self.streams.evict(now_ms, threshold, min_idle_ms)
+
+    def extract(self, family, stream, t_ms, columns=None):
+        """Como _DampedStatTable.extract para un bloque de la familia: stream
+        es (llaves, signal, llaves del par sin direccion, llaves del sentido
+        inverso, lado 0/1 de cada flujo en el par)."""
+        keys, values, joint_keys, rev_keys, side = stream
+        m, n_lams = len(keys), len(self.lambdas)
+        wanted = {}
+        for i, lam in enumerate(self.lambdas):
+            for stat in _KITSUNE_STATS_2D:
+                name = f"{family}_L{lam:g}_{stat}"
+                if columns is None or name in columns:
+                    wanted[name] = (stat, i)
+        stats_wanted = {stat for stat, _ in wanted.values()}
+        two_d = bool(stats_wanted & {'magnitude', 'radius', 'covariance', 'pcc'})
+
+        if two_d:
+            # Estado del sentido inverso al empezar el bloque (sin crear filas).
+            rev_rows = _lookup(rev_keys, self.streams.index, -1, np.int64)
+            rev_known = rev_rows >= 0
+            rev_state = [np.zeros((m, n_lams)) for _ in range(3)]
+            for arr, table_arr in zip(rev_state, (self.streams.count, self.streams.lin_sum,
+                                                  self.streams.sq_sum)):
+                arr[rev_known] = table_arr[rev_rows[rev_known]]
+
+        rows = self.streams.rows(keys)
+        count, lin_sum, sq_sum = self.streams.scan(rows, t_ms, values)
+        mean, var = _mean_var(count, lin_sum, sq_sum)
+        stats = {'weight': count, 'mean': mean}
+        if 'std' in stats_wanted or 'pcc' in stats_wanted:
+            stats['std'] = std = np.sqrt(np.where(var > 0, var, 0.0))
+        if not two_d:
+            return {name: stats[stat][:, i] for name, (stat, i) in wanted.items()}
+
+        # Ultimo estado del sentido inverso antes de cada flujo: el de su
+        # ultimo flujo en el bloque o, si no hay, el guardado en la tabla.
+        opp = _last_other_side(joint_keys, side)
+        in_block = opp >= 0
+        mean_b, var_b = _mean_var(*rev_state)
+        mean_b[in_block], var_b[in_block] = mean[opp[in_block]], var[opp[in_block]]
+        same = keys == rev_keys
+        mean_b[same], var_b[same] = mean[same], var[same]
+        var_a, var_b = np.where(var > 0, var, 0.0), np.where(var_b > 0, var_b, 0.0)
+        stats['magnitude'] = np.sqrt(mean * mean + mean_b * mean_b)
+        stats['radius'] = np.sqrt(var_a * var_a + var_b * var_b)
+
+        if stats_wanted & {'covariance', 'pcc'}:
+            jrows = self.joint.rows(joint_keys)
+            resid = values[:, None] - mean
+            r_b = self.joint.last_r[jrows, 1 - side]
+            r_b[in_block] = resid[opp[in_block]]
+            w3, sr, _ = self.joint.scan(jrows, t_ms, resid * r_b)
+            # Ultimo residuo de cada lado de cada par.
+            last = ~pd.Series(jrows * 2 + side).duplicated(keep='last').to_numpy()
+            self.joint.last_r[jrows[last], side[last]] = resid[last]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                stats['covariance'] = cov = np.where(w3 > 0, sr / w3, 0.0)
+                denom = std * np.sqrt(var_b)
+                stats['pcc'] = np.where(denom > 0, cov / denom, 0.0)
+        return {name: stats[stat][:, i] for name, (stat, i) in wanted.items()}
 
 
 class KitsuneExtractor:
-    """Mantiene el estado damped por stream-id y por lambda para las 10
-    features N-BaIoT que SHAP selecciono. Process flows en orden temporal."""
+    """Mantiene el estado damped por stream-id y por lambda de las features
+    Kitsune pedidas (por defecto weight/mean/std de las lambdas de
+    SELECTED_FEATURES en H, MI_dir y HH_jit). Process flows en orden
+    temporal.
+
+    Familias (Kitsune, Mirsky et al. 2018, llevadas de paquetes a flujos):
+      H       por src_ip; signal = bytes del flujo
+      MI_dir  por (src_ip, dst_ip); signal = src_bytes
+      HH      por (src_ip, dst_ip); signal = bytes del flujo; 2D contra
+              (dst_ip, src_ip): magnitude, radius, covariance, pcc
+      HH_jit  por par de hosts sin direccion; signal = jitter (ms entre flujos)
+      HpHp    por (src_ip:src_port, dst_ip:dst_port); como HH por socket
+    cada una sobre las lambdas de LAMBDAS. Cada familia actualiza todas
+    sus lambdas a la vez (arreglos (n_streams, n_lambdas))."""
 
+    FAMILIES       = ('H', 'MI_dir', 'HH', 'HH_jit', 'HpHp')
+    FAMILIES_2D    = ('HH', 'HpHp')
+    LAMBDAS        = (0.01, 0.1, 1.0, 3.0, 5.0)
+    # Configuracion por defecto: las lambdas que usa SELECTED_FEATURES.
     LAMBDAS_H      = (0.01, 0.1, 1.0, 3.0)   # H_Lx_weight para 0.01/0.1/1/3, H_Lx_mean para 0.01
     LAMBDAS_MI_DIR = (0.01, 0.1, 1.0)        # MI_dir_Lx_weight para 0.01/0.1/1, mean para 0.1
     LAMBDAS_HH_JIT = (1.0,)                  # solo HH_jit_L1_mean
+    _BATCH_ROWS    = 1 << 20                 # flujos por bloque en update_and_extract_batch
+
+    def __init__(self, evict_below=None, evict_every_s=60.0, columns=None):
+        """evict_below: si no es None, cada evict_every_s segundos (de tiempo
+        de captura, chequeado al llegar cada flujo) se borran los streams
+        cuyo weight quedo bajo evict_below en todas sus lambdas (ver
+        evict); asi el estado queda acotado por el working set activo y no
+        por el largo de la captura. Un stream borrado que reaparece empieza
+        de cero (el primer jitter de un par vuelve a ser 0).
+
+        columns: columnas Kitsune a calcular (ver all_columns); None =
+        default_columns(). Solo se guarda estado para las familias y lambdas
+        que alguna de ellas necesita; una familia sin columnas pedidas no se
+        calcula. HpHp necesita los puertos (src_port/dst_port)."""
+        self.evict_below    = evict_below
+        self.evict_every_ms = evict_every_s * 1000.0
+        self._next_evict_ms = -math.inf
+        self.evicted        = dict.fromkeys(('hosts', 'endpoints') + self.FAMILIES, 0)
+        self._host_ids = {}       # ip -> id entero
+        self._next_host_id = 0
+        self._endpoint_ids = {}   # host_id << _PORT_BITS | puerto + 1 -> id entero (HpHp)
+        self._next_endpoint_id = 0
+        self.columns = list(self.default_columns() if columns is None else columns)
+        self._lambdas = self.stream_lambdas(self.columns)
+        available = self.all_columns()
+        # Familias 2D que necesitan el stream conjunto (covariance / pcc).
+        self._joint = {family for family, _, stat in (available[c] for c in self.columns)
+                       if stat in ('covariance', 'pcc')}
+        self._state = self._new_tables(self._lambdas, self._joint)
+        # (columna, familia, stat, indice de lambda) para update_and_extract.
+        self._outputs = [
+            (name, family, stat, self._lambdas[family].index(lam))
+            for name, (family, lam, stat) in ((c, available[c]) for c in self.columns)
+        ]
+
+    @classmethod
+    def all_columns(cls):
+        """Columna -> (familia, lambda, stat) de todas las columnas Kitsune
+        que se pueden pedir, en orden de salida."""
+        return {
+            f"{family}_L{lam:g}_{stat}": (family, lam, stat)
+            for family in cls.FAMILIES
+            for lam in cls.LAMBDAS
+            for stat in (_KITSUNE_STATS_2D if family in cls.FAMILIES_2D else _KITSUNE_STATS)
+        }
+
+    @classmethod
+    def columns_for(cls, families=None, lambdas=None):
+        """Todas las columnas de families x lambdas (None = todas)."""
+        lambdas = None if lambdas is None else {float(lam) for lam in lambdas}
+        return [name for name, (family, lam, _) in cls.all_columns().items()
+                if (families is None or family in families)
+                and (lambdas is None or lam in lambdas)]
+
+    @classmethod
+    def default_columns(cls):
+        """weight/mean/std de las lambdas de LAMBDAS_H, LAMBDAS_MI_DIR y
+        LAMBDAS_HH_JIT (las que usa SELECTED_FEATURES)."""
+        defaults = {'H': cls.LAMBDAS_H, 'MI_dir': cls.LAMBDAS_MI_DIR, 'HH_jit': cls.LAMBDAS_HH_JIT}
+        return [name for name, (family, lam, _) in cls.all_columns().items()
+                if lam in defaults.get(family, ())]
+
+    @classmethod
+    def stream_lambdas(cls, columns):
+        """familia -> lambdas que necesitan columns (solo familias usadas).
+        ValueError si alguna columna no es una columna Kitsune."""
+        available = cls.all_columns()
+        unknown = [c for c in columns if c not in available]
+        if unknown:
+            raise ValueError(f"Columnas Kitsune desconocidas: {unknown}")
+        used = {available[c][:2] for c in columns}
+        lambdas = {}
+        for family in cls.FAMILIES:
+            picked = tuple(lam for lam in cls.LAMBDAS if (family, lam) in used)
+            if picked:
+                lambdas[family] = picked
+        return lambdas
+
+    @classmethod
+    def _new_tables(cls, lambdas, joint=()):
+        # Una tabla por familia con todas sus lambdas. HH_jit: el last_t de
+        # la tabla es el tiempo del flujo anterior del par, con el que se
+        # calcula el jitter.
+        return {
+            family: (_DampedCovTable(lams, family in joint) if family in cls.FAMILIES_2D
+                     else _DampedStatTable(lams))
+            for family, lams in lambdas.items()
+        }
+
+    def _hh_idle_ms(self):
+        # La fila HH_jit guarda tambien el tiempo del flujo anterior del par
+        # (el jitter del proximo flujo): se conserva mientras un stream de
+        # la lambda mas lenta seguiria vivo, no solo lo que dura su L1.
+        slowest = min(self.LAMBDAS)
+        return 1000.0 * math.log(1.0 / self.evict_below) / slowest
+
+    def _host_id_array(self, ips):
+        ids = _intern(ips, self._host_ids, self._next_host_id)
+        self._next_host_id = max(self._next_host_id, int(ids.max()) + 1) if len(ids) else self._next_host_id
+        return ids
+
+    def _host_id(self, ip):
+        host_id = self._host_ids.get(ip)
+        if host_id is None:
+            host_id = self._host_ids[ip] = self._next_host_id
+            self._next_host_id += 1
+        return host_id
 
-    def __init__(self):
-        # H family: stats per source IP (signal = bytes totales del flow)
-        self._H = {}            # src_ip -> {lam: _DampedStat}
-        # MI_dir family: stats per (src_ip, dst_ip) direccional (signal = src_bytes)
-        self._MIdir = {}        # (src_ip, dst_ip) -> {lam: _DampedStat}
-        # HH_jit family: jitter (inter-arrival time) per host-host pair (sin direccion)
-        self._HHjit = {}        # frozenset({src_ip, dst_ip}) -> {lam: _DampedStat}
-        self._HHjit_lastt = {}  # frozenset({src_ip, dst_ip}) -> t_last_ms
+    def _endpoint_id_array(self, host_ids, ports):
+        """Ids de endpoint (host, puerto) para HpHp; puerto vacio = -1."""
+        if ports is None:
+            raise ValueError("HpHp necesita src_port y dst_port")
+        ports = np.nan_to_num(np.asarray(ports, dtype=float), nan=-1.0).astype(np.int64)
+        ids = _intern((host_ids << _PORT_BITS) | (ports + 1), self._endpoint_ids,
+                      self._next_endpoint_id)
+        if len(ids):
+            self._next_endpoint_id = max(self._next_endpoint_id, int(ids.max()) + 1)
+        return ids
 
-    def update_and_extract(self, t_ms, src_ip, dst_ip, src_bytes, dst_bytes):
+    def seed_pair_times(self, src_ip, dst_ip, t_ms):
+        """Fija el tiempo del flujo anterior de pares HH_jit sin estado damped
+        (count 0): el proximo flujo del par tiene el jitter real desde t_ms.
+        Lo usa el modo por segmentos (ver run_segmented)."""
+        table = self._state.get('HH_jit')
+        if table is None:
+            return
+        src_id = self._host_id_array(src_ip)
+        dst_id = self._host_id_array(dst_ip)
+        keys, _ = _family_streams(src_id, dst_id, None, None, ('HH_jit',))['HH_jit']
+        rows = table.rows(keys)   # puede crecer la tabla: antes de tomar last_t
+        table.last_t[rows] = np.asarray(t_ms, dtype=float)
+
+    def evict(self, now_ms):
+        """Borra los streams decaidos bajo evict_below (ver __init__) y los
+        hosts y endpoints que ya no aparecen en ningun stream. Los ids no se
+        reusan, asi las llaves de pares vivas siguen siendo validas.
+        Devuelve los borrados de esta pasada por familia y acumula en
+        self.evicted."""
+        self._next_evict_ms = now_ms + self.evict_every_ms
+        counts, used = _evict_tables(self._tables(), now_ms, self.evict_below, self._hh_idle_ms())
+        return self._drop_stale_ids(counts, used)
+
+    def _drop_stale_ids(self, counts, used):
+        """Olvida los endpoints y hosts fuera de used (ids vivos por espacio,
+        de _evict_tables) y acumula counts en self.evicted."""
+        used_endpoints = set(used['endpoints'].tolist())
+        stale = [k for k, ep_id in self._endpoint_ids.items() if ep_id not in used_endpoints]
+        for k in stale:
+            del self._endpoint_ids[k]
+        counts['endpoints'] = len(stale)
+        # Un endpoint vivo mantiene vivo a su host (su llave lleva el id).
+        used_hosts = set(used['hosts'].tolist())
+        used_hosts.update(k >> _PORT_BITS for k in self._endpoint_ids)
+        stale = [ip for ip, host_id in self._host_ids.items() if host_id not in used_hosts]
+        for ip in stale:
+            del self._host_ids[ip]
+        counts['hosts'] = len(stale)
+        for family, n in counts.items():
+            self.evicted[family] += n
+        return counts
+
+    def _tables(self):
+        return self._state
+
+    def close(self):
+        """Nada que liberar en proceso (ver ShardedKitsuneExtractor)."""
+
+    def state_size(self):
+        """Streams vivos por familia (0 si no se calcula) y hosts internados."""
+        size = dict.fromkeys(self.FAMILIES, 0)
+        size['hosts'] = len(self._host_ids)
+        size.update({family: len(table) for family, table in self._state.items()})
+        return size
+
+    def state_nbytes(self):
+        """Bytes de los arreglos de estado (sin contar los dicts de llaves)."""
+        return sum(table.nbytes() for table in self._state.values())
+
+    def update_and_extract(self, t_ms, src_ip, dst_ip, src_bytes, dst_bytes,
+                           src_port=None, dst_port=None):
+        t_ms       = float(t_ms)   # exacto: los ms epoch caben en un double
+        if self.evict_below is not None and t_ms >= self._next_evict_ms:
+            self.evict(t_ms)
+        if any(family in self.FAMILIES_2D for family in self._state):
+            # Las familias 2D van por el camino batch, con un bloque de un flujo.
+            one = [None if x is None else np.array([x])
+                   for x in (t_ms, src_ip, dst_ip, src_bytes, dst_bytes, src_port, dst_port)]
+            one[3:5] = [np.array([x], dtype=float) for x in (src_bytes or 0, dst_bytes or 0)]
+            return {name: float(v[0]) for name, v in self._extract_block(*one).items()}
         flow_bytes = float(src_bytes or 0) + float(dst_bytes or 0)
         dir_bytes  = float(src_bytes or 0)
-        hh_key     = frozenset((src_ip, dst_ip))
+        src_id     = self._host_id(src_ip)
+        dst_id     = self._host_id(dst_ip)
+        tables, rows = self._state, {}
 
         # --- H (per source IP)
-        H_for_src = self._H.setdefault(
-            src_ip, {lam: _DampedStat(lam) for lam in self.LAMBDAS_H}
-        )
-        for lam in self.LAMBDAS_H:
-            H_for_src[lam].update(t_ms, flow_bytes)
+        if 'H' in tables:
+            rows['H'] = h = tables['H'].row(src_id)
+            tables['H'].update(h, t_ms, flow_bytes)
 
-        # --- MI_dir (per (src,dst) ordered tuple, directional bytes)
-        mi_key = (src_ip, dst_ip)
-        MIdir_for_pair = self._MIdir.setdefault(
-            mi_key, {lam: _DampedStat(lam) for lam in self.LAMBDAS_MI_DIR}
-        )
-        for lam in self.LAMBDAS_MI_DIR:
-            MIdir_for_pair[lam].update(t_ms, dir_bytes)
+        # --- MI_dir (per (src,dst) ordered pair, directional bytes)
+        if 'MI_dir' in tables:
+            rows['MI_dir'] = mi = tables['MI_dir'].row((src_id << _HOST_ID_BITS) | dst_id)
+            tables['MI_dir'].update(mi, t_ms, dir_bytes)
 
         # --- HH_jit (inter-arrival jitter, per unordered host-host pair)
-        last_t = self._HHjit_lastt.get(hh_key)
-        jitter = float(t_ms - last_t) if last_t is not None else 0.0
-        self._HHjit_lastt[hh_key] = t_ms
-        HHjit_for_pair = self._HHjit.setdefault(
-            hh_key, {lam: _DampedStat(lam) for lam in self.LAMBDAS_HH_JIT}
-        )
-        for lam in self.LAMBDAS_HH_JIT:
-            HHjit_for_pair[lam].update(t_ms, jitter)
+        if 'HH_jit' in tables:
+            HH = tables['HH_jit']
+            lo, hi = (src_id, dst_id) if src_id <= dst_id else (dst_id, src_id)
+            rows['HH_jit'] = hh = HH.row((lo << _HOST_ID_BITS) | hi)
+            last_t = HH._last_t[hh]
+            jitter = float(t_ms - last_t) if last_t == last_t else 0.0   # NaN: primer flujo
+            HH.update(hh, t_ms, jitter)
 
-        return {
-            'H_L0.01_weight':       H_for_src[0.01].weight(),
-            'H_L0.1_weight':        H_for_src[0.1].weight(),
-            'H_L1_weight':          H_for_src[1.0].weight(),
-            'H_L3_weight':          H_for_src[3.0].weight(),
-            'H_L0.01_mean':         H_for_src[0.01].mean(),
-            'MI_dir_L0.01_weight':  MIdir_for_pair[0.01].weight(),
-            'MI_dir_L0.1_weight':   MIdir_for_pair[0.1].weight(),
-            'MI_dir_L1_weight':     MIdir_for_pair[1.0].weight(),
-            'MI_dir_L0.1_mean':     MIdir_for_pair[0.1].mean(),
-            'HH_jit_L1_mean':       HHjit_for_pair[1.0].mean(),
-        }
+        return {name: getattr(tables[family], stat)(rows[family], i)
+                for name, family, stat, i in self._outputs}
+
+    def update_and_extract_batch(self, t_ms, src_ip, dst_ip, src_bytes, dst_bytes,
+                                 src_port=None, dst_port=None):
+        """Version batch de update_and_extract para arreglos de flujos en
+        orden temporal. Devuelve un dict columna -> arreglo con las mismas
+        columnas que update_and_extract (p.ej. 'H_L0.01_weight',
+        'MI_dir_L1_std', 'HH_jit_L1_mean'). Coincide con el camino de a un
+        flujo bit a bit.
+        Entradas de mas de _BATCH_ROWS flujos se procesan por bloques para
+        acotar la memoria temporal del scan; con eviction, los bloques se
+        cortan ademas en cada vencimiento de evict_every_s, igual que en el
+        camino de a un flujo."""
+        t_ms = np.asarray(t_ms, dtype=float)
+        arrays = (t_ms, np.asarray(src_ip), np.asarray(dst_ip),
+                  np.asarray(src_bytes), np.asarray(dst_bytes),
+                  None if src_port is None else np.asarray(src_port),
+                  None if dst_port is None else np.asarray(dst_port))
+        parts = [self._extract_block(*_slice(arrays, i, end)) for i, end in self._blocks(t_ms)]
+        return _concat_columns(parts) if parts else self._extract_block(*arrays)
+
+    def _blocks(self, t_ms):
+        """Cortes (i, end) de un batch: bloques de a lo sumo _BATCH_ROWS y,
+        con eviction, cortados en cada vencimiento (que se ejecuta antes de
+        entregar el bloque siguiente)."""
+        i = 0
+        while i < len(t_ms):
+            end = min(i + self._BATCH_ROWS, len(t_ms))
+            if self.evict_below is not None:
+                if t_ms[i] >= self._next_evict_ms:
+                    self.evict(t_ms[i])
+                end = min(end, i + max(1, int(np.searchsorted(t_ms[i:end], self._next_evict_ms))))
+            yield i, end
+            i = end
+
+    def _block_streams(self, src_ip, dst_ip, src_bytes, dst_bytes, src_port, dst_port):
+        """Streams de las familias calculadas para un bloque (interna hosts y,
+        con HpHp, endpoints)."""
+        src_bytes  = _bytes_array(src_bytes)
+        dst_bytes  = _bytes_array(dst_bytes)
+        flow_bytes = src_bytes + dst_bytes
+        src_id     = self._host_id_array(src_ip)
+        dst_id     = self._host_id_array(dst_ip)
+        src_ep = dst_ep = None
+        if 'HpHp' in self._lambdas:
+            src_ep = self._endpoint_id_array(src_id, src_port)
+            dst_ep = self._endpoint_id_array(dst_id, dst_port)
+        # HH_jit: el signal (jitter) sale de la propia tabla (values None).
+        return _family_streams(src_id, dst_id, flow_bytes, src_bytes, self._lambdas,
+                               src_ep, dst_ep)
+
+    def _extract_block(self, t_ms, src_ip, dst_ip, src_bytes, dst_bytes,
+                       src_port=None, dst_port=None):
+        if not self._state:
+            return {}
+        streams = self._block_streams(src_ip, dst_ip, src_bytes, dst_bytes, src_port, dst_port)
+        return _extract_families(self._tables(), streams, t_ms, set(self.columns))
+
+
+def _slice(arrays, i, end):
+    return [None if a is None else a[i:end] for a in arrays]
+
+
+def _concat_columns(parts):
+    if len(parts) == 1:
+        return parts[0]
+    return {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+
+
+def _pair_stream(src, dst, values):
+    """Stream de una familia 2D: (llaves src -> dst, signal, llaves del par
+    sin direccion, llaves dst -> src, lado del flujo en el par)."""
+    lo, hi = np.minimum(src, dst), np.maximum(src, dst)
+    return ((src << _HOST_ID_BITS) | dst, values, (lo << _HOST_ID_BITS) | hi,
+            (dst << _HOST_ID_BITS) | src, (src > dst).astype(np.int64))
+
+
+def _family_streams(src_id, dst_id, flow_bytes, src_bytes, families, src_ep=None, dst_ep=None):
+    """family -> stream para un bloque de flujos, solo para las familias
+    pedidas: (llaves de stream, signal) o, en las familias 2D, la tupla de
+    _pair_stream."""
+    streams = {}
+    if 'H' in families:
+        streams['H'] = (src_id, flow_bytes)
+    if 'MI_dir' in families:
+        streams['MI_dir'] = ((src_id << _HOST_ID_BITS) | dst_id, src_bytes)
+    if 'HH' in families:
+        streams['HH'] = _pair_stream(src_id, dst_id, flow_bytes)
+    if 'HH_jit' in families:
+        lo, hi = np.minimum(src_id, dst_id), np.maximum(src_id, dst_id)
+        streams['HH_jit'] = ((lo << _HOST_ID_BITS) | hi, None)
+    if 'HpHp' in families:
+        streams['HpHp'] = _pair_stream(src_ep, dst_ep, flow_bytes)
+    return streams
+
+
+def _extract_families(tables, streams, t_ms, columns=None):
+    """Columnas Kitsune de un bloque: streams es family -> (llaves, signal)
+    (signal None = jitter, el gap desde el flujo anterior del stream) o la
+    tupla de _pair_stream, y t_ms el tiempo de cada elemento (un arreglo
+    comun o uno por familia). columns (set) limita las columnas calculadas."""
+    out = {}
+    for family, stream in streams.items():
+        t = t_ms[family] if isinstance(t_ms, dict) else t_ms
+        table = tables[family]
+        if isinstance(table, _DampedCovTable):
+            out.update(table.extract(family, stream, t, columns))
+            continue
+        keys, values = stream
+        rows = table.rows(keys)
+        if values is None:
+            values = table.gaps(rows, t)
+        out.update(table.extract(family, rows, t, values, columns))
+    return out
+
+
+def _evict_tables(tables, now_ms, threshold, hh_idle_ms):
+    """Eviction de un juego de tablas. Devuelve (borrados por familia, ids
+    que siguen apareciendo en algun stream: {'hosts': ..., 'endpoints': ...})."""
+    counts = {
+        family: table.evict(now_ms, threshold, hh_idle_ms if family == 'HH_jit' else 0.0)
+        for family, table in tables.items()
+    }
+    mask = (1 << _HOST_ID_BITS) - 1
+    used = {'hosts': [np.zeros(0, dtype=np.int64)], 'endpoints': [np.zeros(0, dtype=np.int64)]}
+    for family, table in tables.items():
+        keys = table.keys()
+        # H va por host; las demas familias por par (dos ids por llave), de
+        # hosts o, en HpHp, de endpoints.
+        ids = [keys] if family == 'H' else [keys >> _HOST_ID_BITS, keys & mask]
+        used['endpoints' if family == 'HpHp' else 'hosts'] += ids
+    return counts, {space: np.unique(np.concatenate(ids)) for space, ids in used.items()}
+
+
+# ----------------------------------------------------------------------------
+# Kitsune en paralelo, particionado por llave de stream
+# ----------------------------------------------------------------------------
+# Cada stream (src_ip de H, par ordenado de MI_dir, par sin orden de HH_jit,
+# par sin orden con sus dos sentidos en HH y HpHp) solo depende de sus
+# propios flujos, asi que el stream temporal se puede
+# repartir por hash de la llave: cada worker guarda las tablas de los streams
+# que le tocan y procesa, en orden temporal, solo sus filas de cada familia.
+# El proceso principal interna los hosts, arma las llaves, reparte, y
+# vuelve a poner las columnas en el orden original. Como el scan de cada
+# stream no depende de los demas, las features son identicas a las de
+# KitsuneExtractor. Los bloques de un batch se envian de a uno por delante:
+# mientras los workers calculan un bloque, el proceso principal prepara el
+# siguiente.
+
+def _shard_of(keys, n_shards):
+    """Shard de cada llave (hash multiplicativo de Fibonacci sobre 64 bits)."""
+    mixed = keys.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+    return ((mixed >> np.uint64(32)) % np.uint64(n_shards)).astype(np.int64)
+
+
+def _kitsune_shard_worker(conn, tables, columns):
+    """Loop de un worker: atiende comandos del ShardedKitsuneExtractor sobre
+    su juego de tablas hasta recibir 'close'. Los comandos se reciben en un
+    thread aparte: mientras el worker manda un resultado grande el proceso
+    principal ya puede estar mandando el bloque siguiente, y si nadie lo
+    leyera los dos quedarian bloqueados en send."""
+    columns = set(columns)
+    commands = queue.Queue()
+
+    def receive():
+        while True:
+            command = conn.recv()
+            commands.put(command)
+            if command[0] == 'close':
+                return
+
+    threading.Thread(target=receive, daemon=True).start()
+    while True:
+        cmd, payload = commands.get()
+        if cmd == 'extract':
+            streams, t_ms = payload
+            conn.send(_extract_families(tables, streams, t_ms, columns))
+        elif cmd == 'evict':
+            conn.send(_evict_tables(tables, *payload))
+        elif cmd == 'size':
+            conn.send(({family: len(table) for family, table in tables.items()},
+                       sum(table.nbytes() for table in tables.values())))
+        elif cmd == 'tables':
+            conn.send(tables)
+        elif cmd == 'close':
+            conn.close()
+            return
+
+
+class ShardedKitsuneExtractor(KitsuneExtractor):
+    """KitsuneExtractor cuyo estado vive repartido en `workers` procesos
+    (ver arriba). Misma interfaz, mismas features y eviction; pensado para
+    update_and_extract_batch: update_and_extract manda el flujo como un
+    bloque de uno, correcto pero con un ida y vuelta a los workers por
+    flujo. close() termina los workers; el objeto se puede picklear
+    (checkpoints): el estado de los workers viaja con el."""
+
+    def __init__(self, workers, evict_below=None, evict_every_s=60.0, columns=None):
+        super().__init__(evict_below, evict_every_s, columns)
+        del self._state
+        self.workers = workers
+        self._in_flight = []   # posiciones de los bloques enviados sin respuesta
+        self._done = []        # columnas de los bloques ya recibidos
+        self._start([self._new_tables(self._lambdas, self._joint) for _ in range(workers)])
+
+    def _start(self, shard_tables):
+        self._conns, self._procs = [], []
+        for tables in shard_tables:
+            parent, child = multiprocessing.Pipe()
+            proc = multiprocessing.Process(target=_kitsune_shard_worker,
+                                           args=(child, tables, self.columns), daemon=True)
+            proc.start()
+            child.close()
+            self._conns.append(parent)
+            self._procs.append(proc)
+
+    def _ask_all(self, cmd, payload=None):
+        self._drain()
+        for conn in self._conns:
+            conn.send((cmd, payload))
+        return [conn.recv() for conn in self._conns]
+
+    def close(self):
+        if not self._procs:
+            return
+        for conn in self._conns:
+            conn.send(('close', None))
+        for proc in self._procs:
+            proc.join()
+        self._conns, self._procs = [], []
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_shard_tables'] = self._ask_all('tables')
+        del state['_conns'], state['_procs']
+        state['_done'] = []
+        return state
+
+    def __setstate__(self, state):
+        shard_tables = state.pop('_shard_tables')
+        self.__dict__.update(state)
+        self._start(shard_tables)
+
+    def update_and_extract(self, t_ms, src_ip, dst_ip, src_bytes, dst_bytes,
+                           src_port=None, dst_port=None):
+        ports = [None if p is None else [p] for p in (src_port, dst_port)]
+        columns = self.update_and_extract_batch([t_ms], [src_ip], [dst_ip],
+                                                [src_bytes], [dst_bytes], *ports)
+        return {name: float(columns[name][0]) for name in self.columns}
+
+    def update_and_extract_batch(self, t_ms, src_ip, dst_ip, src_bytes, dst_bytes,
+                                 src_port=None, dst_port=None):
+        t_ms = np.asarray(t_ms, dtype=float)
+        arrays = (t_ms, np.asarray(src_ip), np.asarray(dst_ip),
+                  np.asarray(src_bytes), np.asarray(dst_bytes),
+                  None if src_port is None else np.asarray(src_port),
+                  None if dst_port is None else np.asarray(dst_port))
+        self._done = []
+        for i, end in self._blocks(t_ms):
+            self._send_block(*_slice(arrays, i, end))
+            if len(self._in_flight) > 1:
+                self._done.append(self._recv_block())
+        self._drain()
+        parts, self._done = self._done, []
+        return _concat_columns(parts) if parts else self._extract_block(*arrays)
+
+    def _drain(self):
+        while self._in_flight:
+            self._done.append(self._recv_block())
+
+    def evict(self, now_ms):
+        self._next_evict_ms = now_ms + self.evict_every_ms
+        counts = dict.fromkeys(self.FAMILIES, 0)
+        used = {'hosts': [], 'endpoints': []}
+        for shard_counts, shard_used in self._ask_all(
+                'evict', (now_ms, self.evict_below, self._hh_idle_ms())):
+            for family, n in shard_counts.items():
+                counts[family] += n
+            for space, ids in shard_used.items():
+                used[space].append(ids)
+        return self._drop_stale_ids(counts, {space: np.concatenate(ids)
+                                             for space, ids in used.items()})
+
+    def state_size(self):
+        size = dict.fromkeys(self.FAMILIES, 0)
+        size['hosts'] = len(self._host_ids)
+        for shard_size, _ in self._ask_all('size'):
+            for family, n in shard_size.items():
+                size[family] += n
+        return size
+
+    def state_nbytes(self):
+        return sum(nbytes for _, nbytes in self._ask_all('size'))
+
+    def _extract_block(self, t_ms, src_ip, dst_ip, src_bytes, dst_bytes,
+                       src_port=None, dst_port=None):
+        if not self._lambdas:
+            return {}
+        self._send_block(t_ms, src_ip, dst_ip, src_bytes, dst_bytes, src_port, dst_port)
+        return self._recv_block()
+
+    def _send_block(self, t_ms, src_ip, dst_ip, src_bytes, dst_bytes,
+                    src_port=None, dst_port=None):
+        streams = self._block_streams(src_ip, dst_ip, src_bytes, dst_bytes, src_port, dst_port)
+
+        # Filas de cada familia por shard, en orden temporal (sort estable).
+        # Las familias 2D se reparten por el par sin direccion: los dos
+        # sentidos (y su stream conjunto) quedan en el mismo worker.
+        payloads = [({}, {}) for _ in range(self.workers)]
+        positions = {}
+        for family, stream in streams.items():
+            shard = _shard_of(stream[2] if len(stream) > 2 else stream[0], self.workers)
+            order = np.argsort(shard, kind='stable')
+            bounds = np.cumsum(np.bincount(shard, minlength=self.workers))[:-1]
+            positions[family] = np.split(order, bounds)
+            for w, idx in enumerate(positions[family]):
+                payloads[w][0][family] = tuple(None if a is None else a[idx] for a in stream)
+                payloads[w][1][family] = t_ms[idx]
+        for conn, payload in zip(self._conns, payloads):
+            conn.send(('extract', payload))
+        self._in_flight.append((len(t_ms), positions))
+
+    def _recv_block(self):
+        n, positions = self._in_flight.pop(0)
+        results = [conn.recv() for conn in self._conns]
+        columns = {}
+        for family in positions:
+            for w, result in enumerate(results):
+                idx = positions[family][w]
+                for name, values in result.items():
+                    if name.startswith(family + '_L'):
+                        if name not in columns:
+                            columns[name] = np.empty(n)
+                        columns[name][idx] = values
+        return columns
+
+
+def make_kitsune(workers=0, evict_below=None, evict_every_s=60.0, columns=None):
+    """KitsuneExtractor en proceso, o ShardedKitsuneExtractor si workers > 1."""
+    if workers > 1:
+        return ShardedKitsuneExtractor(workers, evict_below, evict_every_s, columns)
+    return KitsuneExtractor(evict_below, evict_every_s, columns)
+
+
+# ============================================================================
+# Registro de features (--features / --shap-union)
+# ============================================================================
+# Cada columna que Part2 puede emitir declara de que depende: columnas de
+# _base.csv (strings) y estado que se arrastra entre flujos (tuplas): los
+# counters por IP, el running de TnBPDstIP y los streams Kitsune
+# (familia, lambda). Con una lista de columnas objetivo (p.ej. la union
+# SHAP de Part3b) Part2 calcula y escribe solo esas: un stream Kitsune, un
+# counter o una agregacion que ninguna columna pide no se calcula. Las
+# columnas Kitsune que no estan en SELECTED_FEATURES (p.ej. H_L3_std) se
+# pueden pedir igual.
+_SIGNAL_COLUMNS = ('src_ip_bytes', 'dst_ip_bytes', 'src_pkts', 'dst_pkts')
+
+# Columnas de _base.csv que recibe update_and_extract_batch, en orden
+# (HpHp recibe ademas los puertos).
+_KITSUNE_INPUTS = ('stime', 'src_ip', 'dst_ip', 'src_ip_bytes', 'dst_ip_bytes')
+_KITSUNE_PORTS  = ('src_port', 'dst_port')
+
+# Categoricas que Part3 pasa por one-hot ('proto' -> 'proto_tcp', ...).
+ONE_HOT_COLUMNS = ('proto', 'conn_state', 'service', 'dns_rejected')
+
+FEATURES = {
+    **{name: (name,) for name in (
+        'proto', 'conn_state', 'service', 'dns_rejected',
+        'src_ip_bytes', 'dst_ip_bytes', 'src_pkts', 'dst_pkts', 'http_status_code',
+        'dst_port', 'stime', 'ltime', 'dur',
+    )},
+    'TnBPDstIP':          ('dst_ip', 'src_ip_bytes', 'dst_ip_bytes', ('TnBPDstIP', 'dst_ip')),
+    **{name: _SIGNAL_COLUMNS for name in ('sum', 'max', 'mean', 'min', 'stddev')},
+    'N_IN_Conn_P_DstIP':  ('dst_ip', ('N_IN_Conn', 'dst_ip')),
+    'N_IN_Conn_P_SrcIP':  ('src_ip', ('N_IN_Conn', 'src_ip')),
+    'state_number':       ('conn_state',),
+    'proto_number':       ('proto',),
+    **{name: _KITSUNE_INPUTS + (_KITSUNE_PORTS if stream[0] == 'HpHp' else ()) + (stream[:2],)
+       for name, stream in KitsuneExtractor.all_columns().items()},
+    'label':              ('label',),
+}
+
+
+def resolve_features(targets):
+    """Columnas de Part2 (en el orden de FEATURES) que hacen falta para
+    producir targets: nombres de FEATURES o columnas one-hot de Part3
+    ('proto_tcp' -> 'proto'). 'label' siempre se incluye. ValueError si
+    algun target no se puede producir."""
+    wanted, unknown = {'label'}, []
+    for target in targets:
+        if target in FEATURES:
+            wanted.add(target)
+            continue
+        base = next((c for c in ONE_HOT_COLUMNS if target.startswith(c + '_')), None)
+        if base is None:
+            unknown.append(target)
+        else:
+            wanted.add(base)
+    if unknown:
+        raise ValueError(f"Part2 no produce estas columnas: {unknown}")
+    return [name for name in FEATURES if name in wanted]
+
+
+def feature_streams(features):
+    """Estado (tuplas de FEATURES) que necesitan las columnas features."""
+    return {dep for name in features for dep in FEATURES[name] if isinstance(dep, tuple)}
+
+
+def kitsune_columns(features):
+    """Las columnas Kitsune de features (lo que recibe KitsuneExtractor)."""
+    available = KitsuneExtractor.all_columns()
+    return [name for name in features if name in available]
+
+
+def kitsune_arrays(df, columns):
+    """Argumentos de update_and_extract_batch para las filas de df: los de
+    _KITSUNE_INPUTS y, si columns tiene alguna columna HpHp, los puertos."""
+    inputs = _KITSUNE_INPUTS
+    if 'HpHp' in KitsuneExtractor.stream_lambdas(columns):
+        inputs += _KITSUNE_PORTS
+    return [df[c].to_numpy() for c in inputs]
+
+
+def _regroup_stat_tables(tables, n_shards, shard_key=None):
+    """Reparte las filas vivas de varias _DampedStatTable (mismas lambdas,
+    llaves disjuntas) en n_shards tablas nuevas, por _shard_of(shard_key(llaves))."""
+    first = tables[0]
+    out = [_DampedStatTable(first.lambdas, sides=first.sides) for _ in range(n_shards)]
+    for table in tables:
+        n = len(table.index)
+        keys = np.fromiter(table.index.keys(), dtype=np.int64, count=n)
+        rows = np.fromiter(table.index.values(), dtype=np.int64, count=n)
+        shard = (_shard_of(keys if shard_key is None else shard_key(keys), n_shards)
+                 if n_shards > 1 else np.zeros(n, dtype=np.int64))
+        for dest, sel in ((out[w], shard == w) for w in range(n_shards)):
+            new_rows = dest.rows(keys[sel])   # puede crecer la tabla: antes de _arrays
+            for dst_arr, src_arr in zip(dest._arrays(), table._arrays()):
+                dst_arr[new_rows] = src_arr[rows[sel]]
+    return out
+
+
+def _joint_key(keys):
+    # Llave src -> dst de una familia 2D -> llave del par sin direccion.
+    a, b = keys >> _HOST_ID_BITS, keys & ((1 << _HOST_ID_BITS) - 1)
+    return (np.minimum(a, b) << _HOST_ID_BITS) | np.maximum(a, b)
+
+
+def reshard_kitsune(kitsune, workers):
+    """El mismo estado Kitsune en un extractor con otra cantidad de workers
+    (como make_kitsune(workers)). Cada stream va al shard que le asigna
+    ShardedKitsuneExtractor (las familias 2D por el par sin direccion), asi
+    que las features siguientes no cambian. Cierra kitsune si no se reusa."""
+    n_shards = workers if workers > 1 else 1
+    sharded = isinstance(kitsune, ShardedKitsuneExtractor)
+    if (kitsune.workers if sharded else 1) == n_shards:
+        return kitsune
+    table_sets = kitsune._ask_all('tables') if sharded else [kitsune._state]
+    kitsune.close()
+
+    shards = [{} for _ in range(n_shards)]
+    for family, first in table_sets[0].items():
+        if isinstance(first, _DampedCovTable):
+            streams = _regroup_stat_tables([ts[family].streams for ts in table_sets],
+                                           n_shards, _joint_key)
+            joints = (_regroup_stat_tables([ts[family].joint for ts in table_sets], n_shards)
+                      if first.joint is not None else [None] * n_shards)
+            for shard, table_streams, table_joint in zip(shards, streams, joints):
+                table = shard[family] = _DampedCovTable(first.lambdas, table_joint is not None)
+                table.streams, table.joint = table_streams, table_joint
+        else:
+            tables = _regroup_stat_tables([ts[family] for ts in table_sets], n_shards)
+            for shard, table in zip(shards, tables):
+                shard[family] = table
+
+    state = {k: v for k, v in kitsune.__dict__.items()
+             if k not in ('_state', 'workers', '_in_flight', '_done', '_conns', '_procs')}
+    if n_shards == 1:
+        out = KitsuneExtractor.__new__(KitsuneExtractor)
+        out.__dict__.update(state, _state=shards[0])
+    else:
+        out = ShardedKitsuneExtractor.__new__(ShardedKitsuneExtractor)
+        out.__dict__.update(state, workers=n_shards, _in_flight=[], _done=[])
+        out._start(shards)
+    return out
 
 
 # ============================================================================
 # Enriquecimiento de un DataFrame de _base.csv
 # ============================================================================
-def enrich_dataset(df, kitsune, dst_bytes_running):
+def new_conn_counters():
+    """Counters N_IN_Conn_P_SrcIP / N_IN_Conn_P_DstIP de un archivo."""
+    return defaultdict(int), defaultdict(int)
+
+
+def base_frame_as_read(df):
+    """Deja un DataFrame con columnas de _base.csv como lo devolveria
+    pd.read_csv tras escribirlo: los strings de CSV_NA_VALUES pasan a NaN."""
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == object:
+            df[col] = df[col].mask(df[col].isin(CSV_NA_VALUES))
+    return df
+
+
+def _lookup(keys, mapping, default, dtype):
+    """mapping.get(llave, default) para cada llave del arreglo. Solo las
+    llaves distintas pasan por el dict (Series.map(dict) convierte el dict
+    entero en cada llamada, caro cuando el estado crece entre chunks)."""
+    codes, uniques = pd.factorize(np.asarray(keys))
+    values = np.array([mapping.get(k, default) for k in uniques.tolist()], dtype=dtype)
+    return values[codes] if len(values) else np.zeros(len(codes), dtype=dtype)
+
+
+def _running_counts(keys, counter):
+    """Para cada fila, cuantas filas con la misma llave hubo hasta ella
+    inclusive (cumcount + 1), partiendo de los conteos previos de counter.
+    Actualiza counter con los totales."""
+    keys = pd.Series(keys)
+    previous = _lookup(keys, counter, 0, np.int64)
+    counts = keys.groupby(keys, sort=False).cumcount().to_numpy() + 1 + previous
+    last = ~keys.duplicated(keep='last').to_numpy()
+    counter.update(zip(keys[last], counts[last].tolist()))
+    return counts
+
+
+def _running_sums(keys, values, running):
+    """Suma acumulada de values por llave (en orden de filas), partiendo de
+    running[llave]. Actualiza running con los totales."""
+    keys = pd.Series(keys)
+    previous = _lookup(keys, running, 0.0, float)
+    # El valor previo entra como primer sumando de cada grupo, igual que el
+    # += secuencial (mismo orden de sumas en punto flotante).
+    sums = pd.Series(values).groupby(keys.to_numpy(), sort=False).cumsum().to_numpy()
+    totals = previous + sums
+    first = ~keys.duplicated(keep='first').to_numpy()
+    if not np.all(previous[first] == 0.0):
+        # Con estado previo se recalcula con el previo sumado primero.
+        start = np.where(first, previous + values, values)
+        totals = pd.Series(start).groupby(keys.to_numpy(), sort=False).cumsum().to_numpy()
+    last = ~keys.duplicated(keep='last').to_numpy()
+    running.update(zip(keys[last], totals[last].tolist()))
+    return totals
+
+
+def enrich_dataset(df, kitsune, dst_bytes_running, conn_counters=None, source_column=None,
+                   features=None):
     """Aplica Kitsune + agregaciones + counters al DataFrame de un _base.csv.
     El KitsuneExtractor y el dict dst_bytes_running se pasan desde el caller
     para que su estado persista entre archivos (procesados en orden temporal).
-    Devuelve un DataFrame ya filtrado a SELECTED_FEATURES."""
-    src_ip_counter = defaultdict(int)
-    dst_ip_counter = defaultdict(int)
-    enriched_rows = []
+    conn_counters (de new_conn_counters) permite enriquecer un archivo por
+    partes consecutivas en orden de stime; por defecto se parte de cero.
+    Devuelve un DataFrame con las columnas features (de FEATURES, por
+    defecto SELECTED_FEATURES); solo se calcula lo que ellas necesitan, y
+    las columnas Kitsune tienen que estar entre las de kitsune.
 
-    required_fields = [
-        'src_ip', 'dst_ip', 'src_pkts', 'dst_pkts',
-        'src_ip_bytes', 'dst_ip_bytes', 'proto', 'dst_port',
-        'stime', 'ltime', 'dur', 'conn_state', 'service', 'dns_rejected', 'label',
-    ]
+    Con source_column (filas de varios archivos, ver GlobalStimeMerge) los
+    counters N_IN_Conn_* van por (archivo, IP), como si cada archivo se
+    enriqueciera por separado, y la columna se devuelve al final para
+    separar las filas por archivo.
+
+    Columnar: los counters son cumcount por IP, TnBPDstIP una suma acumulada
+    por dst_ip y las agregaciones del signal vector reducciones por fila de
+    una matriz (n, 4). Kitsune usa update_and_extract_batch (scan sobre el
+    archivo entero, identico al camino de a un flujo)."""
+    if features is None:
+        features = SELECTED_FEATURES
+    if conn_counters is None:
+        conn_counters = new_conn_counters()
+    src_ip_counter, dst_ip_counter = conn_counters
+    wanted = set(features)
+
+    # Filas con algun campo requerido vacio (o columna ausente) se descartan.
+    if any(f not in df.columns for f in REQUIRED_BASE_COLUMNS):
+        return pd.DataFrame()
+    df = df[df[REQUIRED_BASE_COLUMNS].notna().all(axis=1)]
 
     # Procesar en orden temporal (importante para Kitsune)
     df = df.sort_values('stime', kind='mergesort').reset_index(drop=True)
+    if df.empty:
+        return pd.DataFrame()
 
-    for _, row in df.iterrows():
-        if any(pd.isna(row.get(f)) for f in required_fields):
-            continue
-        try:
-            src_ip      = row['src_ip']
-            dst_ip      = row['dst_ip']
-            src_bytes   = row['src_ip_bytes']
-            dst_bytes   = row['dst_ip_bytes']
-            src_pkts    = row['src_pkts']
-            dst_pkts    = row['dst_pkts']
-            proto_str   = row['proto']
-            dst_port    = row['dst_port']
-            stime       = row['stime']
-            ltime       = row['ltime']
-            dur         = row['dur']
-            conn_state  = row['conn_state']
-            service     = row['service']
-
-            # Counters
-            src_ip_counter[src_ip] += 1
-            dst_ip_counter[dst_ip] += 1
-            dst_bytes_running[dst_ip] += float(src_bytes or 0) + float(dst_bytes or 0)
-
-            # Signal vector + agregaciones
-            signal_values = [src_bytes, dst_bytes, src_pkts, dst_pkts]
-            sig_arr       = np.asarray(signal_values, dtype=float)
-
-            # Kitsune features
-            kits = kitsune.update_and_extract(
-                stime, src_ip, dst_ip, src_bytes, dst_bytes
+    # Columnas que pasan tal cual; http_status_code es opcional en el _base.csv
+    out = {name: df[name] for name in features
+           if FEATURES[name] == (name,) and name in df.columns}
+    if 'http_status_code' in wanted and 'http_status_code' not in df.columns:
+        out['http_status_code'] = -1
+
+    # Counters
+    if source_column is None:
+        src_keys, dst_keys = df['src_ip'].to_numpy(), df['dst_ip'].to_numpy()
+    else:
+        source = df[source_column].astype(str) + '|'
+        src_keys = (source + df['src_ip'].astype(str)).to_numpy()
+        dst_keys = (source + df['dst_ip'].astype(str)).to_numpy()
+    if 'N_IN_Conn_P_DstIP' in wanted:
+        out['N_IN_Conn_P_DstIP'] = _running_counts(dst_keys, dst_ip_counter)
+    if 'N_IN_Conn_P_SrcIP' in wanted:
+        out['N_IN_Conn_P_SrcIP'] = _running_counts(src_keys, src_ip_counter)
+    if 'TnBPDstIP' in wanted:
+        flow_bytes = (df['src_ip_bytes'].to_numpy().astype(float)
+                      + df['dst_ip_bytes'].to_numpy().astype(float))
+        out['TnBPDstIP'] = _running_sums(df['dst_ip'].to_numpy(), flow_bytes, dst_bytes_running)
+
+    # Signal vector + agregaciones (una fila de 4 valores por flujo)
+    reductions = [name for name in ('sum', 'max', 'mean', 'min', 'stddev') if name in wanted]
+    if reductions:
+        sig = df[list(_SIGNAL_COLUMNS)].to_numpy(dtype=float)
+        reduce = {'sum': sig.sum, 'max': sig.max, 'mean': sig.mean, 'min': sig.min,
+                  'stddev': sig.std}
+        for name in reductions:
+            out[name] = reduce[name](axis=1)
+
+    if 'state_number' in wanted:
+        out['state_number'] = df['conn_state'].map(_STATE_TO_NUM).fillna(-1).astype(np.int64)
+    if 'proto_number' in wanted:
+        out['proto_number'] = df['proto'].map(_PROTO_TO_NUM).fillna(-1).astype(np.int64)
+
+    # Kitsune features (batch, en orden de stime)
+    kits_wanted = kitsune_columns(features)
+    if kits_wanted:
+        kits = kitsune.update_and_extract_batch(*kitsune_arrays(df, kits_wanted))
+        out.update({name: kits[name] for name in kits_wanted})
+
+    out = pd.DataFrame(out, index=df.index)
+    if source_column is not None:
+        out[source_column] = df[source_column]
+        return out[list(features) + [source_column]]
+    return out[list(features)]
+
+
+# ============================================================================
+# Merge global por stime de varios _base.csv (--merge)
+# ============================================================================
+# Procesar los archivos uno detras de otro no intercala capturas que se
+# solapan en el tiempo: el estado damped ve el tiempo ir hacia atras en el
+# borde. --merge lee todos los _base.csv por chunks y los mezcla en orden
+# global de stime. Cada _base.csv viene en orden de expiracion de NFStream;
+# StimeReorderBuffer lo ordena con una ventana acotada (ver Part1, modo
+# fused) y GlobalStimeMerge mezcla los streams ya ordenados con un heap por
+# el ultimo stime en memoria de cada archivo: todo lo que tenga stime <= el
+# menor de esos ultimos ya no puede ser precedido por nada que falte leer.
+
+# Ventana de re-orden de un _base.csv: 2 * idle + active de NFStreamer en
+# Part1 (120 s y 1800 s).
+BASE_STIME_HORIZON_MS = (2 * 120 + 1800) * 1000
+MERGE_CHUNK_ROWS      = 200_000
+SOURCE_COLUMN         = 'source_file'
+
+
+class StimeReorderBuffer:
+    """Re-ordena por stime un stream de chunks con memoria acotada.
+    push() y flush() devuelven los flujos liberados, ordenados."""
+
+    def __init__(self, horizon_ms=BASE_STIME_HORIZON_MS, columns=()):
+        self.horizon_ms = horizon_ms
+        self.columns = list(columns)   # columnas del frame vacio de flush()
+        self._pending = None
+        self._seq = 0
+        self._max_ltime = None
+        self._released_until = None
+        self.late = 0   # flujos que llegaron con stime ya liberado
+
+    def __len__(self):
+        return 0 if self._pending is None else len(self._pending)
+
+    def _release(self, mask):
+        ready = self._pending[mask]
+        self._pending = self._pending[~mask]
+        ready = ready.sort_values(['stime', '_seq'], kind='mergesort')
+        return ready.drop(columns='_seq').reset_index(drop=True)
+
+    def push(self, chunk):
+        chunk = chunk.assign(_seq=np.arange(self._seq, self._seq + len(chunk)))
+        self._seq += len(chunk)
+        if self._released_until is not None:
+            self.late += int((chunk['stime'] < self._released_until).sum())
+        self._pending = chunk if self._pending is None else pd.concat(
+            [self._pending, chunk], ignore_index=True
+        )
+        chunk_max = chunk['ltime'].max()
+        if self._max_ltime is None or chunk_max > self._max_ltime:
+            self._max_ltime = chunk_max
+        watermark = self._max_ltime - self.horizon_ms
+        self._released_until = watermark
+        return self._release(self._pending['stime'] < watermark)
+
+    def flush(self):
+        if self._pending is None:
+            return pd.DataFrame(columns=self.columns)
+        return self._release(np.ones(len(self._pending), dtype=bool))
+
+
+class GlobalStimeMerge:
+    """Itera DataFrames con las filas de todos los paths en orden global de
+    stime (empates: orden de paths, luego orden dentro del archivo). Cada
+    fila lleva en SOURCE_COLUMN el nombre de su archivo. En memoria hay a lo
+    sumo un chunk (mas la ventana de re-orden) por archivo.
+
+    Al terminar, late[nombre] cuenta las filas que llegaron despues de su
+    ventana de re-orden (quedan fuera de orden, como en Part1 --fused)."""
+
+    def __init__(self, paths, chunk_rows=MERGE_CHUNK_ROWS, horizon_ms=BASE_STIME_HORIZON_MS):
+        self.paths = [Path(p) for p in paths]
+        self.chunk_rows = chunk_rows
+        self.horizon_ms = horizon_ms
+        self.late = {}
+
+    def _sorted_chunks(self, path):
+        reorder = StimeReorderBuffer(self.horizon_ms)
+        for chunk in pd.read_csv(path, chunksize=self.chunk_rows):
+            chunk = chunk[chunk['stime'].notna()]
+            ready = reorder.push(chunk)
+            if len(ready):
+                yield ready
+        ready = reorder.flush()
+        if len(ready):
+            yield ready
+        self.late[path.name] = reorder.late
+
+    def __iter__(self):
+        readers, buffers, heap = {}, {}, []
+
+        def refill(rank):
+            chunk = next(readers[rank], None)
+            if chunk is None:
+                buffers.pop(rank, None)
+                return
+            chunk[SOURCE_COLUMN] = self.paths[rank].name
+            chunk['_rank'] = rank
+            buffers[rank] = chunk
+            heapq.heappush(heap, (chunk['stime'].iloc[-1], rank))
+
+        for rank, path in enumerate(self.paths):
+            readers[rank] = self._sorted_chunks(path)
+            refill(rank)
+
+        while heap:
+            limit, rank = heapq.heappop(heap)
+            ready = []
+            for r, buf in buffers.items():
+                if len(buf) and buf['stime'].iloc[0] <= limit:
+                    cut = int(np.searchsorted(buf['stime'].to_numpy(), limit, side='right'))
+                    ready.append(buf.iloc[:cut])
+                    buffers[r] = buf.iloc[cut:]
+            if ready:
+                merged = pd.concat(ready, ignore_index=True)
+                merged = merged.sort_values(['stime', '_rank'], kind='mergesort')
+                yield merged.drop(columns='_rank').reset_index(drop=True)
+            # El archivo que fijo el limite quedo vacio: se lee su proximo chunk.
+            refill(rank)
+
+
+def run_merged(input_folder, output_folder, files, kitsune, dst_bytes_running,
+               chunk_rows=MERGE_CHUNK_ROWS, features=None):
+    """Enriquece files con el merge global por stime y escribe un
+    _combined.csv por archivo de entrada (las filas de cada uno en orden de
+    stime). Los counters N_IN_Conn_* siguen siendo por archivo. Devuelve
+    ({archivo: filas escritas}, {archivo: filas fuera de ventana})."""
+    merge = GlobalStimeMerge([input_folder / f for f in files], chunk_rows)
+    conn_counters = new_conn_counters()
+    writer = _SplitWriter(output_folder, files)
+    for chunk in merge:
+        writer.write(enrich_dataset(chunk, kitsune, dst_bytes_running, conn_counters,
+                                    SOURCE_COLUMN, features))
+    return writer.finish(), merge.late
+
+
+class _SplitWriter:
+    """Escribe filas enriquecidas con SOURCE_COLUMN en un _combined.csv por
+    archivo de origen (.tmp hasta finish)."""
+
+    def __init__(self, output_folder, files):
+        self.outputs = {f: output_folder / f.replace("_base.csv", "_combined.csv") for f in files}
+        self.rows = dict.fromkeys(files, 0)
+
+    def write(self, enriched):
+        if enriched.empty:
+            return
+        for name, part in enriched.groupby(SOURCE_COLUMN, sort=False):
+            tmp = self.outputs[name].with_suffix(".csv.tmp")
+            part.drop(columns=SOURCE_COLUMN).to_csv(
+                tmp, mode='a' if self.rows[name] else 'w', header=not self.rows[name], index=False
             )
+            self.rows[name] += len(part)
 
-            feature_row = {
-                'proto':              proto_str,
-                'conn_state':         conn_state,
-                'service':            service,
-                'dns_rejected':       row['dns_rejected'],
-                'src_ip_bytes':       src_bytes,
-                'dst_ip_bytes':       dst_bytes,
-                'src_pkts':           src_pkts,
-                'dst_pkts':           dst_pkts,
-                'http_status_code':   row.get('http_status_code', -1),
-                'dst_port':           dst_port,
-                'stime':              stime,
-                'ltime':              ltime,
-                'dur':                dur,
-                'TnBPDstIP':          dst_bytes_running[dst_ip],
-                'sum':                float(sig_arr.sum()),
-                'N_IN_Conn_P_DstIP':  dst_ip_counter[dst_ip],
-                'N_IN_Conn_P_SrcIP':  src_ip_counter[src_ip],
-                'max':                float(sig_arr.max()),
-                'mean':               float(sig_arr.mean()),
-                'min':                float(sig_arr.min()),
-                'stddev':             float(sig_arr.std()),
-                'state_number':       _STATE_TO_NUM.get(conn_state, -1),
-                'proto_number':       _PROTO_TO_NUM.get(proto_str, -1),
-                **kits,
-                'label':              row['label'],
-            }
-            enriched_rows.append({k: feature_row[k] for k in SELECTED_FEATURES})
+    def finish(self):
+        """Renombra los .tmp y devuelve {archivo: filas escritas}."""
+        for name, path in self.outputs.items():
+            if self.rows[name]:
+                os.replace(path.with_suffix(".csv.tmp"), path)
+        return self.rows
 
-        except Exception as e:
-            print(f"Error enriqueciendo fila: {e}")
 
-    return pd.DataFrame(enriched_rows)
+# ============================================================================
+# Segmentos independientes en paralelo (--gap-workers)
+# ============================================================================
+# Tras un hueco de g segundos sin flujos, todo el estado damped quedo
+# multiplicado por a lo sumo exp(-lam_min * g). Con g >= ln(1/tol) / lam_min
+# ese factor es <= tol y el estado es practicamente cero, asi que los
+# segmentos de la linea de tiempo global (GlobalStimeMerge) separados por
+# huecos asi se pueden calcular en paralelo, cada uno con un
+# KitsuneExtractor nuevo. Lo unico que no decae es el tiempo del flujo
+# anterior de cada par HH_jit (el jitter del primer flujo despues del
+# hueco); el proceso principal lo lleva y lo siembra en cada segmento
+# (seed_pair_times). Los counters y TnBPDstIP no decaen y se calculan en el
+# proceso principal, en orden, al recibir cada segmento.
+#
+# El error del corte no es cero: el weight que cruza un hueco g queda en a
+# lo sumo W * exp(-lam_min * g), con W el mayor weight de los segmentos.
+# run_segmented siempre devuelve el hueco minimo de los cortes y esa cota.
+DEFAULT_GAP_TOLERANCE = 1e-6
+
+
+def gap_threshold_ms(tolerance, lambdas):
+    """Hueco minimo (ms) para que el estado decaiga por debajo de tolerance."""
+    return 1000.0 * math.log(1.0 / tolerance) / min(lambdas)
+
+
+def split_at_gaps(t_ms, gap_ms, last_t=None):
+    """Posiciones donde empieza un segmento nuevo en t_ms (ordenado): despues
+    de un hueco >= gap_ms, contando el hueco desde last_t (el ultimo tiempo
+    ya visto) para la posicion 0."""
+    starts = np.flatnonzero(np.diff(t_ms) >= gap_ms) + 1
+    if last_t is not None and len(t_ms) and t_ms[0] - last_t >= gap_ms:
+        starts = np.concatenate([[0], starts])
+    return starts
+
+
+def _segment_kitsune(arrays, seed, evict_below, evict_every_s, columns):
+    """Columnas Kitsune de un segmento con estado nuevo (en un worker)."""
+    kitsune = KitsuneExtractor(evict_below, evict_every_s, columns)
+    if seed is not None:
+        kitsune.seed_pair_times(*seed)
+    return kitsune.update_and_extract_batch(*arrays)
+
+
+class _PrecomputedKitsune:
+    """Hace de KitsuneExtractor en enrich_dataset con columnas ya calculadas
+    para exactamente las filas (filtradas y ordenadas) que recibe."""
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def update_and_extract_batch(self, *arrays):
+        return self.columns
+
+
+def _pair_keys(src_ip, dst_ip):
+    """(lo, hi, "lo|hi") del par sin orden de cada flujo."""
+    src = pd.Series(src_ip).astype(str).to_numpy()
+    dst = pd.Series(dst_ip).astype(str).to_numpy()
+    swap = src > dst
+    lo, hi = np.where(swap, dst, src), np.where(swap, src, dst)
+    return lo, hi, (pd.Series(lo) + '|' + pd.Series(hi)).to_numpy()
+
+
+def run_segmented(input_folder, output_folder, files, workers, tolerance=DEFAULT_GAP_TOLERANCE,
+                  evict_below=None, evict_every_s=60.0, chunk_rows=MERGE_CHUNK_ROWS,
+                  check_serial=False, features=None):
+    """Como run_merged, pero las features Kitsune de cada segmento (ver
+    arriba) se calculan en un pool de `workers` procesos. El hueco de corte
+    sale de la lambda mas lenta que usan las columnas Kitsune de features.
+    Las familias 2D (HH, HpHp) no se pueden segmentar: mean y varianza del
+    otro sentido de un par no decaen en un hueco (ValueError).
+    Las estadisticas incluyen siempre el error de los cortes: min_gap_s
+    (hueco minimo de un corte, inf si no hubo), decay_bound =
+    exp(-lam_min * min_gap_s) y weight_bound = decay_bound * max_weight (mas
+    un ulp de redondeo), cota del desvio absoluto de las columnas weight
+    contra el camino serial. Con check_serial corre ademas un
+    KitsuneExtractor serial sobre el mismo stream y mide el desvio absoluto
+    maximo contra el en esas columnas.
+    Devuelve (filas por archivo, fuera de ventana por archivo,
+    estadisticas)."""
+    if features is None:
+        features = SELECTED_FEATURES
+    columns = kitsune_columns(features)
+    two_d = sorted(set(KitsuneExtractor.stream_lambdas(columns)) & set(KitsuneExtractor.FAMILIES_2D))
+    if two_d:
+        raise ValueError(f"El modo por segmentos no soporta las familias 2D {two_d}; "
+                         "usar --merge (con --kitsune-workers si hace falta).")
+    lambdas = [lam for lams in KitsuneExtractor.stream_lambdas(columns).values() for lam in lams]
+    lambdas = lambdas or [min(KitsuneExtractor.LAMBDAS)]
+    gap_ms = gap_threshold_ms(tolerance, lambdas)
+    lam_min = min(lambdas)
+    merge = GlobalStimeMerge([input_folder / f for f in files], chunk_rows)
+    conn_counters, dst_bytes_running = new_conn_counters(), defaultdict(float)
+    writer = _SplitWriter(output_folder, files)
+    serial = KitsuneExtractor(evict_below, evict_every_s, columns) if check_serial else None
+    stats = {'segments': 0, 'gap_s': gap_ms / 1000.0, 'max_rows': 0,
+             'min_gap_s': math.inf, 'max_weight': 0.0,
+             'max_abs_dev': 0.0, 'worst_column': None}
+    pair_last_t = {}   # "lo|hi" -> tiempo del ultimo flujo del par
+    pending = deque()
+
+    def finish_oldest():
+        segment, future = pending.popleft()
+        kits = future.result()
+        stats['max_weight'] = max([stats['max_weight']] + [
+            float(values.max()) for name, values in kits.items() if name.endswith('_weight')])
+        if serial is not None:
+            arrays = kitsune_arrays(segment, columns)
+            expected = serial.update_and_extract_batch(*arrays)
+            for name in expected:
+                dev = float(np.abs(kits[name] - expected[name]).max())
+                if dev > stats['max_abs_dev']:
+                    stats['max_abs_dev'], stats['worst_column'] = dev, name
+        writer.write(enrich_dataset(segment, _PrecomputedKitsune(kits), dst_bytes_running,
+                                    conn_counters, SOURCE_COLUMN, features))
+
+    def submit(parts):
+        segment = pd.concat(parts, ignore_index=True)
+        lo, hi, keys = _pair_keys(segment['src_ip'], segment['dst_ip'])
+        t = segment['stime'].to_numpy(dtype=float)
+        first = ~pd.Series(keys).duplicated().to_numpy()
+        seen = _lookup(keys[first], pair_last_t, np.nan, float)
+        known = ~np.isnan(seen)
+        seed = (lo[first][known], hi[first][known], seen[known]) if known.any() else None
+        last = ~pd.Series(keys).duplicated(keep='last').to_numpy()
+        pair_last_t.update(zip(keys[last].tolist(), t[last].tolist()))
+        arrays = kitsune_arrays(segment, columns)
+        pending.append((segment, pool.submit(_segment_kitsune, arrays, seed,
+                                             evict_below, evict_every_s, columns)))
+        stats['segments'] += 1
+        stats['max_rows'] = max(stats['max_rows'], len(segment))
+        while len(pending) > 2 * workers:
+            finish_oldest()
+
+    with ProcessPoolExecutor(workers) as pool:
+        current, last_t = [], None
+        for chunk in merge:
+            if any(f not in chunk.columns for f in REQUIRED_BASE_COLUMNS):
+                continue
+            chunk = chunk[chunk[REQUIRED_BASE_COLUMNS].notna().all(axis=1)].reset_index(drop=True)
+            if chunk.empty:
+                continue
+            t = chunk['stime'].to_numpy(dtype=float)
+            start = 0
+            for end in list(split_at_gaps(t, gap_ms, last_t)) + [len(chunk)]:
+                if end > start:
+                    current.append(chunk.iloc[start:end])
+                if end < len(chunk) and current:
+                    gap_s = float(t[end] - (t[end - 1] if end else last_t)) / 1000.0
+                    stats['min_gap_s'] = min(stats['min_gap_s'], gap_s)
+                    submit(current)
+                    current = []
+                start = end
+            last_t = t[-1]
+        if current:
+            submit(current)
+        while pending:
+            finish_oldest()
+    stats['decay_bound'] = math.exp(-lam_min * stats['min_gap_s'])
+    # + un ulp: el camino serial redondea la suma del estado que cruza el corte.
+    stats['weight_bound'] = (stats['decay_bound'] * stats['max_weight']
+                             + float(np.spacing(stats['max_weight'])))
+    return writer.finish(), merge.late, stats
+
+
+def kitsune_state_report(kitsune):
+    """Resumen de una linea del estado Kitsune (y evictions, si hubo)."""
+    size = kitsune.state_size()
+    two_d = [f for f in kitsune.FAMILIES_2D if f in kitsune.stream_lambdas(kitsune.columns)]
+    extra = "".join(f", {size[f]} {f} streams" for f in two_d)
+    report = (f"Kitsune state final: {size['H']} unique src_ips, "
+              f"{size['MI_dir']} unique (src,dst) pairs, {size['HH_jit']} host pairs{extra} "
+              f"({kitsune.state_nbytes() / 2**20:.1f} MiB en arreglos).")
+    if kitsune.evict_below is not None:
+        ev = kitsune.evicted
+        extra = "".join(f", {ev[f]} {f} streams" for f in two_d)
+        if 'HpHp' in two_d:
+            extra += f", {ev['endpoints']} endpoints"
+        report += (f"\nEvicted (weight < {kitsune.evict_below:g}): {ev['H']} src_ips, "
+                   f"{ev['MI_dir']} (src,dst) pairs, {ev['HH_jit']} host pairs{extra}, "
+                   f"{ev['hosts']} hosts.")
+    return report
+
+
+# ============================================================================
+# Checkpoints del estado entre archivos
+# ============================================================================
+# Despues de cada archivo se guarda (pickle) el estado que pasa al siguiente
+# (KitsuneExtractor + dst_bytes_running) en STATE_DIR/<llave>.pkl. La llave
+# de un checkpoint es el hash de la lista ordenada de archivos procesados
+# hasta ahi (nombre, tamanio, mtime) y de la config de Kitsune (no la
+# cantidad de workers: las features no dependen de ella y el estado se
+# reparte de nuevo al cargar, ver reshard_kitsune). Se guarda solo el
+# checkpoint del ultimo archivo: el anterior se borra apenas se escribe el
+# nuevo. Una corrida incremental (archivos nuevos al final del orden) carga
+# ese checkpoint y procesa solo los archivos siguientes; un _base.csv
+# regenerado o que cambia el orden reprocesa todo.
+STATE_DIR = ".part2_state"
+
+
+def checkpoint_keys(input_folder, files, config):
+    """Llave (hex) del checkpoint de cada prefijo files[:k+1]."""
+    digest = hashlib.sha256(json.dumps(config, sort_keys=True).encode())
+    keys = []
+    for name in files:
+        st = os.stat(input_folder / name)
+        digest.update(json.dumps([name, st.st_size, st.st_mtime_ns]).encode())
+        keys.append(digest.copy().hexdigest()[:32])
+    return keys
+
+
+def save_checkpoint(path, kitsune, dst_bytes_running, outputs):
+    """Escribe el checkpoint de forma atomica (tmp + rename)."""
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "wb") as fh:
+        pickle.dump({'kitsune': kitsune, 'dst_bytes_running': dict(dst_bytes_running),
+                     'outputs': list(outputs)}, fh, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def prune_checkpoints(state_dir, keep):
+    """Borra los checkpoints de state_dir salvo keep (una llave)."""
+    for path in state_dir.glob("*.pkl"):
+        if path.stem != keep:
+            path.unlink()
+
+
+def latest_checkpoint(state_dir, keys, output_folder):
+    """(k, kitsune, dst_bytes_running, outputs) del checkpoint valido del
+    prefijo mas largo: k archivos ya procesados. Un checkpoint es valido si
+    se puede leer y los _combined.csv que registra siguen existiendo.
+    Devuelve k = 0 (y estado None) si no hay ninguno."""
+    for k in range(len(keys), 0, -1):
+        path = state_dir / f"{keys[k - 1]}.pkl"
+        if not path.exists():
+            continue
+        try:
+            with open(path, "rb") as fh:
+                state = pickle.load(fh)
+        except Exception as e:
+            print(f"WARN: checkpoint ilegible {path.name} ({e}); se ignora.")
+            continue
+        if all((output_folder / name).exists() for name in state['outputs']):
+            running = defaultdict(float, state['dst_bytes_running'])
+            return k, state['kitsune'], running, state['outputs']
+    return 0, None, None, []
 
 
 # ============================================================================
 # Main — procesa todos los _base.csv en orden temporal global
 # ============================================================================
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DATASETS/*_base.csv -> Ton-IoT-MultiFet/*_combined.csv")
+    parser.add_argument("--evict-below", type=float, default=None,
+                        help="Borra los streams Kitsune cuyo weight cayo bajo este valor en "
+                             "todas sus lambdas (p.ej. 1e-6). Por defecto no se borra nada.")
+    parser.add_argument("--evict-every", type=float, default=60.0,
+                        help="Segundos de captura entre chequeos de eviction.")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="Ignora los checkpoints y reprocesa todos los archivos.")
+    parser.add_argument("--kitsune-workers", type=int, default=0,
+                        help="Procesos para las features Kitsune, repartiendo los streams por "
+                             "hash de su llave (0/1 = en el proceso principal).")
+    parser.add_argument("--merge", action="store_true",
+                        help="Mezcla todos los _base.csv en orden global de stime (capturas "
+                             "solapadas se intercalan) y regenera todos los _combined.csv. "
+                             "No usa checkpoints.")
+    parser.add_argument("--gap-workers", type=int, default=0,
+                        help="Como --merge, pero corta la linea de tiempo en huecos donde el "
+                             "estado damped decae bajo --gap-tolerance y calcula Kitsune de "
+                             "cada segmento en paralelo con este numero de procesos. Con "
+                             "familias 2D (HH, HpHp) no hay segmentos independientes: se usa "
+                             "el camino serial de --merge.")
+    parser.add_argument("--gap-tolerance", type=float, default=DEFAULT_GAP_TOLERANCE,
+                        help="Factor de decaimiento maximo del estado en un hueco de corte "
+                             "(define el hueco minimo: ln(1/tol)/lambda_min).")
+    parser.add_argument("--check-serial", action="store_true",
+                        help="Con --gap-workers: corre tambien Kitsune serial y reporta el "
+                             "desvio maximo contra el.")
+    parser.add_argument("--features", nargs='+', default=None,
+                        help="Columnas objetivo (de FEATURES o one-hot de Part3, p.ej. "
+                             "proto_tcp): Part2 calcula y escribe solo lo que necesitan.")
+    parser.add_argument("--shap-union", action="store_true",
+                        help="Columnas objetivo = load_shap_union() de Part3b (los "
+                             "top10_global.csv del analisis SHAP).")
+    parser.add_argument("--kitsune-families", nargs='+', default=None,
+                        choices=KitsuneExtractor.FAMILIES,
+                        help="Agrega todas las columnas Kitsune de estas familias (HH y HpHp "
+                             "con magnitude/radius/covariance/pcc).")
+    parser.add_argument("--kitsune-lambdas", nargs='+', type=float, default=None,
+                        help="Lambdas de --kitsune-families (default: todas, "
+                             f"{', '.join(f'{lam:g}' for lam in KitsuneExtractor.LAMBDAS)}).")
+    args = parser.parse_args()
+    if args.kitsune_lambdas and not args.kitsune_families:
+        parser.error("--kitsune-lambdas va con --kitsune-families")
+    bad = sorted(set(args.kitsune_lambdas or ()) - set(KitsuneExtractor.LAMBDAS))
+    if bad:
+        parser.error(f"lambdas no soportadas: {bad} (ver KitsuneExtractor.LAMBDAS)")
+
     script_dir    = Path(__file__).resolve().parent
     input_folder  = script_dir / "DATASETS"
     output_folder = script_dir / "Ton-IoT-MultiFet"
@@ -281,35 +1919,128 @@ if __name__ == "__main__":
     print("Ordenando archivos por stime para procesamiento temporal correcto...")
     base_files_sorted = sorted(base_files, key=first_stime)
 
-    # Estado compartido entre archivos.
-    kitsune           = KitsuneExtractor()
-    dst_bytes_running = defaultdict(float)
+    # Columnas a calcular: SELECTED_FEATURES o lo que piden las columnas objetivo.
+    targets = args.features
+    if args.shap_union:
+        import importlib.util
+        spec = importlib.util.spec_from_file_location(
+            'part3b', str(script_dir / 'TonIoT-Part3b-SHAPFilter.py')
+        )
+        part3b = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(part3b)
+        targets = (targets or []) + part3b.load_shap_union()
+    if args.kitsune_families:
+        targets = list(targets or SELECTED_FEATURES) + KitsuneExtractor.columns_for(
+            args.kitsune_families, args.kitsune_lambdas)
+    features = SELECTED_FEATURES if targets is None else resolve_features(targets)
+    kits_columns = kitsune_columns(features)
+    if targets is not None:
+        streams = sorted(f"{name}/{key:g}" if isinstance(key, float) else f"{name}/{key}"
+                         for name, key in feature_streams(features))
+        print(f"Columnas a calcular ({len(features)}): {features}")
+        print(f"Estado entre flujos: {', '.join(streams) or 'ninguno'}")
+
+    two_d = sorted(set(KitsuneExtractor.stream_lambdas(kits_columns))
+                   & set(KitsuneExtractor.FAMILIES_2D))
+    if args.gap_workers and two_d:
+        print(f"Las familias 2D {two_d} no se pueden segmentar (mean y varianza del otro "
+              f"sentido de un par no decaen en un hueco): --gap-workers pasa a --merge.")
+        args.gap_workers, args.merge = 0, True
+
+    if args.gap_workers:
+        print(f"Modo --gap-workers {args.gap_workers}: segmentos independientes en paralelo.")
+        rows, late, stats = run_segmented(
+            input_folder, output_folder, base_files_sorted, args.gap_workers,
+            args.gap_tolerance, args.evict_below, args.evict_every,
+            check_serial=args.check_serial, features=features,
+        )
+        for file in base_files_sorted:
+            output_name = file.replace("_base.csv", "_combined.csv")
+            if rows[file]:
+                print(f"Guardado: {output_folder / output_name}  ({rows[file]} filas)")
+            else:
+                print(f"{file} fue omitido por falta de datos validos.")
+            if late.get(file):
+                print(f"WARN: {late[file]} flujos de {file} llegaron despues de su ventana "
+                      f"de re-orden; quedaron fuera de orden de stime.")
+        print(f"\n{stats['segments']} segmentos (huecos >= {stats['gap_s']:.0f} s, "
+              f"el mayor con {stats['max_rows']} flujos).")
+        if stats['segments'] > 1:
+            print(f"Error de los cortes: hueco minimo {stats['min_gap_s']:.0f} s, el estado "
+                  f"que lo cruza decae por <= {stats['decay_bound']:.3g} (tolerancia "
+                  f"{args.gap_tolerance:g}); desvio de los weights <= "
+                  f"{stats['weight_bound']:.3g} (weight maximo {stats['max_weight']:.3g}). "
+                  f"Means y std: ver --check-serial.")
+        else:
+            print("Sin cortes: un solo segmento, igual al camino serial.")
+        if args.check_serial:
+            print(f"Desvio maximo contra Kitsune serial: {stats['max_abs_dev']:.3g} "
+                  f"({stats['worst_column'] or 'ninguna columna'}).")
+        raise SystemExit(0)
+
+    if args.merge:
+        print("Modo --merge: orden global de stime sobre todos los archivos.")
+        kitsune = make_kitsune(args.kitsune_workers, args.evict_below, args.evict_every,
+                               kits_columns)
+        rows, late = run_merged(input_folder, output_folder, base_files_sorted,
+                                kitsune, defaultdict(float), features=features)
+        for file in base_files_sorted:
+            output_name = file.replace("_base.csv", "_combined.csv")
+            if rows[file]:
+                print(f"Guardado: {output_folder / output_name}  ({rows[file]} filas)")
+            else:
+                print(f"{file} fue omitido por falta de datos validos.")
+            if late.get(file):
+                print(f"WARN: {late[file]} flujos de {file} llegaron despues de su ventana "
+                      f"de re-orden; quedaron fuera de orden de stime.")
+        print(kitsune_state_report(kitsune))
+        kitsune.close()
+        raise SystemExit(0)
+
+    # Estado compartido entre archivos: del ultimo checkpoint valido o de cero.
+    state_dir = output_folder / STATE_DIR
+    state_dir.mkdir(exist_ok=True)
+    config = {'evict_below': args.evict_below, 'evict_every': args.evict_every,
+              'features': list(features)}
+    keys = checkpoint_keys(input_folder, base_files_sorted, config)
+    done, kitsune, dst_bytes_running, outputs = (
+        (0, None, None, []) if args.no_resume else latest_checkpoint(state_dir, keys, output_folder)
+    )
+    if kitsune is None:
+        kitsune           = make_kitsune(args.kitsune_workers, args.evict_below,
+                                         args.evict_every, kits_columns)
+        dst_bytes_running = defaultdict(float)
+    else:
+        kitsune = reshard_kitsune(kitsune, args.kitsune_workers)
+        print(f"Checkpoint cargado: {done} archivos ya procesados con el mismo estado previo.")
 
     processed_files = 0
-    skipped_files   = 0
+    skipped_files   = done
 
-    for file in base_files_sorted:
+    for i, file in enumerate(base_files_sorted):
         output_name = file.replace("_base.csv", "_combined.csv")
         output_path = output_folder / output_name
 
-        if output_path.exists():
-            print(f"Ya existe: {output_name} — omitido.")
-            skipped_files += 1
+        if i < done:
+            print(f"Ya procesado: {output_name} — omitido.")
             continue
 
         print(f"\nEnriqueciendo: {file}")
         df_base     = pd.read_csv(input_folder / file)
-        df_enriched = enrich_dataset(df_base, kitsune, dst_bytes_running)
+        df_enriched = enrich_dataset(df_base, kitsune, dst_bytes_running, features=features)
 
         if not df_enriched.empty:
             df_enriched.to_csv(output_path, index=False)
             print(f"Guardado: {output_path}  ({len(df_enriched)} filas, "
                   f"{df_enriched.shape[1]} columnas)")
             processed_files += 1
+            outputs.append(output_name)
         else:
             print(f"{file} fue omitido por falta de datos validos.")
+        save_checkpoint(state_dir / f"{keys[i]}.pkl", kitsune, dst_bytes_running, outputs)
+        prune_checkpoints(state_dir, keys[i])
 
     print(f"\n{processed_files} archivos enriquecidos.")
-    print(f"{skipped_files} archivos ya existian y fueron omitidos.")
-    print(f"Kitsune state final: {len(kitsune._H)} unique src_ips, "
-          f"{len(kitsune._MIdir)} unique (src,dst) pairs.")
+    print(f"{skipped_files} archivos ya procesados (checkpoint) fueron omitidos.")
+    print(kitsune_state_report(kitsune))
+    kitsune.close()
@@ -68,15 +68,21 @@ def preprocess_dataframe(df, encoder, scaler=None, fit_scaler=False):
         if col not in df.columns:
             df[col] = 'None'
 
-    df = df.dropna(subset=CATEGORICAL_COLS + NUMERIC_COLS + [LABEL_COL])
+    # Part2 con --features/--shap-union emite solo parte de NUMERIC_COLS (y
+    # quizas columnas Kitsune extra): se escalan las numericas presentes.
+    numeric_cols = [c for c in NUMERIC_COLS if c in df.columns]
+    numeric_cols += [c for c in df.columns
+                     if c not in numeric_cols + CATEGORICAL_COLS + [LABEL_COL]]
+
+    df = df.dropna(subset=CATEGORICAL_COLS + numeric_cols + [LABEL_COL])
     if df.empty:
         return pd.DataFrame(), scaler
 
     if fit_scaler:
         scaler = MinMaxScaler()
-        df[NUMERIC_COLS] = scaler.fit_transform(df[NUMERIC_COLS])
+        df[numeric_cols] = scaler.fit_transform(df[numeric_cols])
     else:
-        df[NUMERIC_COLS] = scaler.transform(df[NUMERIC_COLS])
+        df[numeric_cols] = scaler.transform(df[numeric_cols])
 
     encoded = encoder.transform(df[CATEGORICAL_COLS])
     encoded_df = pd.DataFrame(
@@ -0,0 +1,183 @@
+"""
+bench_part1_buffer.py -- micro-benchmark of the Part1 row accumulation step.
+
+Compares, for the same stream of flows:
+  dicts   : flow_to_row() per flow (per-flow Zeek normalization), one 19-key
+            dict per flow + pd.DataFrame(list_of_dicts)           (old path)
+  columns : flow_to_raw_row() into a RAW_SCHEMA FlowColumnBuffer, to_frame()
+            and one vectorized normalize_raw_frame() pass  (process_pcap path)
+
+Both outputs must be identical; the synthetic pool includes unexpected
+conn_state/service values and DNS flags so the vectorized normalization is
+checked against the per-flow one. Reports wall time of each phase (no tracing) and peak traced
+memory (separate tracemalloc run, NumPy allocations included).
+
+Flows are synthetic NFlow look-alikes cycled from a pool; with --pcap the pool
+is the first --pool flows of a real capture instead. NFStream metering itself
+is not timed.
+
+    python bench_part1_buffer.py                     # 2M synthetic flows
+    python bench_part1_buffer.py --flows 5000000
+    python bench_part1_buffer.py --pcap ../../PCAP/Normal/normal_1.pcap
+"""
+import argparse
+import gc
+import itertools
+import random
+import time
+import tracemalloc
+from pathlib import Path
+from types import SimpleNamespace
+
+import pandas as pd
+
+
+def synthetic_pool(n, seed=0):
+    rnd = random.Random(seed)
+    pool = []
+    for i in range(n):
+        proto = rnd.choice((6, 6, 17, 17, 1))
+        src_pkts = rnd.randint(0, 40)
+        dst_pkts = rnd.randint(0, 40) if src_pkts else rnd.randint(1, 40)
+        first = 1_554_000_000_000 + i * 7
+        dur = rnd.randint(0, 60_000)
+        pool.append(SimpleNamespace(
+            src_ip=f"192.168.1.{rnd.randint(1, 254)}",
+            dst_ip=f"10.0.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}",
+            src_port=rnd.randint(1024, 65535),
+            dst_port=rnd.choice((53, 80, 443, 1883, rnd.randint(1, 65535))),
+            protocol=proto,
+            bidirectional_first_seen_ms=first,
+            bidirectional_last_seen_ms=first + dur,
+            bidirectional_duration_ms=dur,
+            dns_query="",
+            dns_rejected=rnd.choice((None, None, True, False)),
+            dns_rd=rnd.choice((None, True, False)),
+            connection_state=rnd.choice((None, None, None, "", "SF", "RSTO")),
+            requested_service=rnd.choice((None, None, None, "", "dns", "ftp")),
+            application_name=rnd.choice(("DNS", "HTTP", "TLS", "Unknown", "MQTT",
+                                         "HTTP.Google", None, "")),
+            src2dst_bytes=src_pkts * rnd.randint(40, 1500),
+            dst2src_bytes=dst_pkts * rnd.randint(40, 1500),
+            src2dst_packets=src_pkts,
+            dst2src_packets=dst_pkts,
+        ))
+    return pool
+
+
+def pcap_pool(mod, pcap, n):
+    import nfstream
+    stream = nfstream.NFStreamer(source=mod._to_ascii_safe_path(str(pcap)),
+                                 statistical_analysis=True, splt_analysis=True,
+                                 n_dissections=20)
+    return list(itertools.islice(iter(stream), n))
+
+
+def flow_to_row(mod, flow, label):
+    """The old per-flow path: NFlow -> tuple in BASE_COLUMNS order, normalized
+    flow by flow with Part1's scalar helpers."""
+    return (
+        flow.src_ip or "0.0.0.0",
+        flow.dst_ip or "0.0.0.0",
+        flow.src_port or 0,
+        flow.dst_port or 0,
+        mod.proto_to_str(flow.protocol),
+        getattr(flow, "bidirectional_first_seen_ms", 0.0),
+        getattr(flow, "bidirectional_last_seen_ms", 0.0),
+        (getattr(flow, "bidirectional_duration_ms", 0) or 0) / 1000.0,
+        getattr(flow, "dns_query", "") or "",
+        mod.dns_bool_to_zeek_str(getattr(flow, "dns_rejected", None)),
+        mod.dns_bool_to_zeek_str(getattr(flow, "dns_rd", None)),
+        mod.derive_conn_state(flow),
+        mod.derive_service(flow),
+        getattr(flow, "http_response_status_code", -1),
+        flow.src2dst_bytes,
+        flow.dst2src_bytes,
+        flow.src2dst_packets,
+        flow.dst2src_packets,
+        label,
+    )
+
+
+def run_dicts(mod, flows, label):
+    start = time.perf_counter()
+    rows = [dict(zip(mod.BASE_COLUMNS, flow_to_row(mod, f, label))) for f in flows]
+    t_accum = time.perf_counter() - start
+    start = time.perf_counter()
+    df = pd.DataFrame(rows)
+    t_convert = time.perf_counter() - start
+    return df, t_accum, t_convert
+
+
+def run_columns(mod, flows, label):
+    start = time.perf_counter()
+    buffer = mod.FlowColumnBuffer(mod.RAW_SCHEMA)
+    for f in flows:
+        buffer.append(mod.flow_to_raw_row(f, label))
+    t_accum = time.perf_counter() - start
+    start = time.perf_counter()
+    df = mod.normalize_raw_frame(buffer.to_frame(), mod.new_drift_counts())
+    t_convert = time.perf_counter() - start
+    return df, t_accum, t_convert
+
+
+def peak_mib(fn, *args):
+    gc.collect()
+    tracemalloc.start()
+    fn(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 2**20
+
+
+if __name__ == '__main__':
+    import importlib.util
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--flows", type=int, default=2_000_000)
+    parser.add_argument("--pool", type=int, default=4096,
+                        help="Distinct flow objects cycled to reach --flows.")
+    parser.add_argument("--pcap", default=None,
+                        help="Take the pool from a real capture instead of synthetic flows.")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="Skip the (slow) tracemalloc runs.")
+    args = parser.parse_args()
+
+    _here = Path(__file__).resolve().parent
+    spec = importlib.util.spec_from_file_location(
+        'p1', str(_here / 'TonIoT-Part1-integrator-PCAP.py')
+    )
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+
+    pool = pcap_pool(mod, args.pcap, args.pool) if args.pcap else synthetic_pool(args.pool)
+    if not pool:
+        raise SystemExit("Empty flow pool.")
+    flows = [pool[i % len(pool)] for i in range(args.flows)]
+    print(f"{len(flows):,} flows (pool of {len(pool)} "
+          f"{'from ' + str(args.pcap) if args.pcap else 'synthetic'})\n")
+
+    results = {}
+    for name, fn in (("dicts", run_dicts), ("columns", run_columns)):
+        gc.collect()
+        df, t_accum, t_convert = fn(mod, flows, 'normal')
+        results[name] = (df, t_accum, t_convert)
+        del df
+
+    df_dicts, df_cols = results["dicts"][0], results["columns"][0]
+    assert list(df_dicts.columns) == list(df_cols.columns)
+    assert df_dicts.astype(str).equals(df_cols.astype(str)), "outputs differ"
+    results = {k: v[1:] for k, v in results.items()}
+    del df_dicts, df_cols
+
+    print(f"{'path':<8s} {'accumulate s':>13s} {'convert s':>11s} {'total s':>9s} "
+          f"{'flows/s':>11s}")
+    for name, (t_accum, t_convert) in results.items():
+        total = t_accum + t_convert
+        print(f"{name:<8s} {t_accum:>13.2f} {t_convert:>11.2f} {total:>9.2f} "
+              f"{len(flows) / total:>11,.0f}")
+
+    if not args.no_memory:
+        print(f"\n{'path':<8s} {'peak traced MiB':>16s}")
+        for name, fn in (("dicts", run_dicts), ("columns", run_columns)):
+            print(f"{name:<8s} {peak_mib(fn, mod, flows, 'normal'):>16.1f}")
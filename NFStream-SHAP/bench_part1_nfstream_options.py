@@ -0,0 +1,86 @@
+"""
+bench_part1_nfstream_options.py -- flows/sec of Part1 with the full vs the
+minimal NFStreamer configuration on the same capture.
+
+  full    : FULL_NFSTREAM_OPTIONS (statistical + SPLT + n_dissections=20),
+            the default (--analysis full).
+  minimal : nfstream_options_for(part2_base_columns()), what --analysis auto
+            picks from Part2's SELECTED_FEATURES / REQUIRED_BASE_COLUMNS.
+
+Each configuration runs the whole process_pcap path (metering +
+flow_to_raw_row + column buffer + per-chunk normalization) --repeat times,
+alternating configurations so disk cache and thermal effects hit both
+equally. The outputs of both configurations are compared column by column:
+the columns Part2 consumes must be identical.
+
+    python bench_part1_nfstream_options.py --pcap ../../PCAP/Normal/normal_1.pcap
+    python bench_part1_nfstream_options.py --pcap <file> --repeat 5 --n-meters 1
+"""
+import argparse
+import statistics
+import time
+from pathlib import Path
+
+import pandas as pd
+
+
+def run_once(mod, pcap, options, n_meters):
+    start = time.perf_counter()
+    df = pd.concat(
+        mod.process_pcap(pcap, 'bench', n_meters=n_meters, nfstream_options=options),
+        ignore_index=True,
+    )
+    return df, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    import importlib.util
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pcap", required=True)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--n-meters", type=int, default=0,
+                        help="NFStreamer meters (0 = NFStream auto scaling).")
+    args = parser.parse_args()
+
+    _here = Path(__file__).resolve().parent
+    spec = importlib.util.spec_from_file_location(
+        'p1', str(_here / 'TonIoT-Part1-integrator-PCAP.py')
+    )
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+
+    needed = mod.part2_base_columns(_here)
+    configs = {
+        'full':    dict(mod.FULL_NFSTREAM_OPTIONS),
+        'minimal': mod.nfstream_options_for(needed),
+    }
+    for name, options in configs.items():
+        print(f"{name:<8s} {options}")
+
+    timings = {name: [] for name in configs}
+    frames = {}
+    for _ in range(args.repeat):
+        for name, options in configs.items():
+            frames[name], seconds = run_once(mod, args.pcap, options, args.n_meters)
+            timings[name].append(seconds)
+
+    n_flows = len(frames['full'])
+    print(f"\n{n_flows:,} flows, {args.repeat} repeats, n_meters={args.n_meters}\n")
+    print(f"{'config':<8s} {'median s':>9s} {'min s':>7s} {'flows/s':>11s}")
+    for name, secs in timings.items():
+        med = statistics.median(secs)
+        print(f"{name:<8s} {med:>9.2f} {min(secs):>7.2f} {n_flows / med:>11,.0f}")
+    speedup = statistics.median(timings['full']) / statistics.median(timings['minimal'])
+    print(f"\nspeedup minimal vs full: {speedup:.2f}x")
+
+    # With several meters the flow output order is not deterministic.
+    key = ['stime', 'src_ip', 'src_port', 'dst_ip', 'dst_port', 'proto', 'ltime']
+    full, minimal = (frames[name].sort_values(key, kind='mergesort').reset_index(drop=True)
+                     for name in ('full', 'minimal'))
+    assert len(full) == len(minimal), "different flow counts"
+    differing = [c for c in mod.BASE_COLUMNS
+                 if not full[c].astype(str).equals(minimal[c].astype(str))]
+    broken = [c for c in differing if c in needed]
+    print(f"Columns differing between configurations: {differing or 'none'}")
+    assert not broken, f"columns consumed by Part2 differ: {broken}"
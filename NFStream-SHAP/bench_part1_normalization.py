@@ -0,0 +1,73 @@
+"""
+bench_part1_normalization.py -- flows/sec of Part1 with the Zeek vocabulary
+normalization in the consumer vs inside the NFStream meters.
+
+  consumer : flow_to_raw_row() per flow + normalize_raw_frame() per chunk
+             (process_pcap default, --normalize-in consumer).
+  meters   : zeek_plugins() NFPlugins run at flow expiration inside each
+             meter process; the consumer copies flow.udps (--normalize-in
+             meters). Note NFStream syncs every packet with Python as soon as
+             any plugin is registered.
+
+Each mode runs the whole process_pcap path --repeat times, alternating modes.
+Both outputs must be identical (compared after sorting, since with several
+meters the flow order is not deterministic).
+
+    python bench_part1_normalization.py --pcap ../../PCAP/Normal/normal_1.pcap
+    python bench_part1_normalization.py --pcap <file> --n-meters 4 --repeat 5
+"""
+import argparse
+import statistics
+import time
+from pathlib import Path
+
+import pandas as pd
+
+
+def run_once(mod, pcap, mode, options, n_meters):
+    start = time.perf_counter()
+    df = pd.concat(
+        mod.process_pcap(pcap, 'bench', n_meters=n_meters, nfstream_options=options,
+                         normalize_in=mode),
+        ignore_index=True,
+    )
+    return df, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    import importlib.util
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pcap", required=True)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--n-meters", type=int, default=0,
+                        help="NFStreamer meters (0 = NFStream auto scaling).")
+    args = parser.parse_args()
+
+    _here = Path(__file__).resolve().parent
+    spec = importlib.util.spec_from_file_location(
+        'p1', str(_here / 'TonIoT-Part1-integrator-PCAP.py')
+    )
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    options = mod.nfstream_options_for(mod.BASE_COLUMNS)
+
+    timings = {mode: [] for mode in mod.NORMALIZE_MODES}
+    frames = {}
+    for _ in range(args.repeat):
+        for mode in mod.NORMALIZE_MODES:
+            frames[mode], seconds = run_once(mod, args.pcap, mode, options, args.n_meters)
+            timings[mode].append(seconds)
+
+    n_flows = len(frames['consumer'])
+    print(f"\n{n_flows:,} flows, {args.repeat} repeats, n_meters={args.n_meters}\n")
+    print(f"{'mode':<9s} {'median s':>9s} {'min s':>7s} {'flows/s':>11s}")
+    for mode, secs in timings.items():
+        med = statistics.median(secs)
+        print(f"{mode:<9s} {med:>9.2f} {min(secs):>7.2f} {n_flows / med:>11,.0f}")
+
+    key = mod.BASE_COLUMNS
+    consumer, meters = (frames[mode].astype(str).sort_values(key).reset_index(drop=True)
+                        for mode in mod.NORMALIZE_MODES)
+    assert consumer.equals(meters), "consumer and meters outputs differ"
+    print("\nOutputs identical.")
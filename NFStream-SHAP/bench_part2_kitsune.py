@@ -0,0 +1,263 @@
+"""
+bench_part2_kitsune.py -- KitsuneExtractor state store: array-backed tables
+(Part2) vs the previous dict-of-dicts of _DampedStat objects, kept here as the
+reference (LegacyKitsuneExtractor), plus the batch kernel
+(update_and_extract_batch) over the same stream.
+
+The synthetic stream first touches --pairs distinct (src, dst) pairs once
+each and then revisits random pairs until --flows flows; timestamps increase
+by a random 0-50 ms gap. Reports flows/sec of update_and_extract and the
+memory retained by the extractor state (tracemalloc, separate run), and
+checks both implementations return the same features. The batch kernel is
+fed --batch flows per call and must match the per-flow path exactly.
+With --workers N the batch kernel also runs on ShardedKitsuneExtractor (N
+processes, streams split by key hash) and must return identical columns.
+With --evict-below the batch kernel is re-run with decay-aware eviction and
+its state size, eviction counts and largest feature deviation are reported.
+With --full the batch kernel also computes every Kitsune column (all five
+families, including the 2D HH / HpHp stats, on all lambdas) over the same
+stream plus synthetic ports (a few source ports per pair, one service port).
+
+    python bench_part2_kitsune.py                           # 1.2M flows, 1M pairs
+    python bench_part2_kitsune.py --pairs 2000000 --flows 2500000
+    python bench_part2_kitsune.py --no-memory --batch 100000
+    python bench_part2_kitsune.py --no-memory --evict-below 1e-6
+    python bench_part2_kitsune.py --no-memory --workers 8
+    python bench_part2_kitsune.py --no-memory --full --workers 4
+"""
+import argparse
+import gc
+import math
+import random
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+
+class _LegacyDampedStat:
+    __slots__ = ('lam', 'last_t', 'count', 'lin_sum', 'sq_sum')
+
+    def __init__(self, lam):
+        self.lam = lam
+        self.last_t = None
+        self.count = 0.0
+        self.lin_sum = 0.0
+        self.sq_sum = 0.0
+
+    def update(self, t_ms, value):
+        if self.last_t is not None and t_ms > self.last_t:
+            decay = math.exp(-self.lam * ((t_ms - self.last_t) / 1000.0))
+            self.count *= decay
+            self.lin_sum *= decay
+            self.sq_sum *= decay
+        self.count += 1.0
+        self.lin_sum += value
+        self.sq_sum += value * value
+        self.last_t = t_ms
+
+    def mean(self):
+        return self.lin_sum / self.count if self.count > 0 else 0.0
+
+
+# The columns LegacyKitsuneExtractor returns; the array-backed extractor is
+# asked for the same ones.
+LEGACY_COLUMNS = [
+    'H_L0.01_weight', 'H_L0.1_weight', 'H_L1_weight', 'H_L3_weight', 'H_L0.01_mean',
+    'MI_dir_L0.01_weight', 'MI_dir_L0.1_weight', 'MI_dir_L1_weight', 'MI_dir_L0.1_mean',
+    'HH_jit_L1_mean',
+]
+
+
+class LegacyKitsuneExtractor:
+    """KitsuneExtractor before the array-backed state store."""
+    LAMBDAS_H      = (0.01, 0.1, 1.0, 3.0)
+    LAMBDAS_MI_DIR = (0.01, 0.1, 1.0)
+    LAMBDAS_HH_JIT = (1.0,)
+
+    def __init__(self):
+        self._H, self._MIdir, self._HHjit, self._HHjit_lastt = {}, {}, {}, {}
+
+    def update_and_extract(self, t_ms, src_ip, dst_ip, src_bytes, dst_bytes):
+        flow_bytes = float(src_bytes or 0) + float(dst_bytes or 0)
+        dir_bytes  = float(src_bytes or 0)
+        hh_key     = frozenset((src_ip, dst_ip))
+        H = self._H.setdefault(src_ip, {lam: _LegacyDampedStat(lam) for lam in self.LAMBDAS_H})
+        for lam in self.LAMBDAS_H:
+            H[lam].update(t_ms, flow_bytes)
+        MI = self._MIdir.setdefault((src_ip, dst_ip),
+                                    {lam: _LegacyDampedStat(lam) for lam in self.LAMBDAS_MI_DIR})
+        for lam in self.LAMBDAS_MI_DIR:
+            MI[lam].update(t_ms, dir_bytes)
+        last_t = self._HHjit_lastt.get(hh_key)
+        jitter = float(t_ms - last_t) if last_t is not None else 0.0
+        self._HHjit_lastt[hh_key] = t_ms
+        HH = self._HHjit.setdefault(hh_key,
+                                    {lam: _LegacyDampedStat(lam) for lam in self.LAMBDAS_HH_JIT})
+        for lam in self.LAMBDAS_HH_JIT:
+            HH[lam].update(t_ms, jitter)
+        return {
+            'H_L0.01_weight':       H[0.01].count,
+            'H_L0.1_weight':        H[0.1].count,
+            'H_L1_weight':          H[1.0].count,
+            'H_L3_weight':          H[3.0].count,
+            'H_L0.01_mean':         H[0.01].mean(),
+            'MI_dir_L0.01_weight':  MI[0.01].count,
+            'MI_dir_L0.1_weight':   MI[0.1].count,
+            'MI_dir_L1_weight':     MI[1.0].count,
+            'MI_dir_L0.1_mean':     MI[0.1].mean(),
+            'HH_jit_L1_mean':       HH[1.0].mean(),
+        }
+
+
+def synthetic_stream(n_flows, n_pairs, seed=0):
+    """List of (t_ms, src_ip, dst_ip, src_bytes, dst_bytes) tuples."""
+    rnd = random.Random(seed)
+    n_hosts = max(2, math.isqrt(n_pairs) + 1)
+    hosts = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(n_hosts)]
+    flows, t = [], 1_554_000_000_000
+    for i in range(n_flows):
+        p = i if i < n_pairs else rnd.randrange(n_pairs)
+        t += rnd.randint(0, 50)
+        flows.append((t, hosts[p % n_hosts], hosts[p // n_hosts],
+                      rnd.randint(40, 5000), rnd.randint(0, 5000)))
+    return flows
+
+
+def with_ports(flows, seed=0):
+    """flows plus (src_port, dst_port): one of 8 ephemeral ports, and a
+    service port fixed by the destination host."""
+    rnd = random.Random(seed)
+    services = (53, 80, 443, 1883)
+    return [f + (1024 + rnd.randrange(8), services[int(f[2].rsplit(".", 1)[1]) % len(services)])
+            for f in flows]
+
+
+def run(cls, flows):
+    kitsune = cls()
+    start = time.perf_counter()
+    for f in flows:
+        kitsune.update_and_extract(*f)
+    return kitsune, time.perf_counter() - start
+
+
+def run_batch(cls, flows, batch):
+    """update_and_extract_batch over consecutive slices of `batch` flows."""
+    columns = [np.array(c) for c in zip(*flows)]
+    kitsune = cls()
+    start = time.perf_counter()
+    outputs = [kitsune.update_and_extract_batch(*(c[i:i + batch] for c in columns))
+               for i in range(0, len(flows), batch)]
+    secs = time.perf_counter() - start
+    kitsune.close()
+    return {k: np.concatenate([o[k] for o in outputs]) for k in outputs[0]}, secs
+
+
+def retained_mib(cls, flows):
+    gc.collect()
+    tracemalloc.start()
+    kitsune = cls()
+    for f in flows:
+        kitsune.update_and_extract(*f)
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kitsune
+    return current / 2**20
+
+
+if __name__ == '__main__':
+    import importlib.util
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--flows", type=int, default=1_200_000)
+    parser.add_argument("--pairs", type=int, default=1_000_000)
+    parser.add_argument("--no-memory", action="store_true",
+                        help="Skip the (slow) tracemalloc runs.")
+    parser.add_argument("--batch", type=int, default=1_000_000,
+                        help="Flows per update_and_extract_batch call.")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Also run the batch kernel sharded over this many processes.")
+    parser.add_argument("--evict-below", type=float, default=None,
+                        help="Also run the batch kernel with eviction at this weight.")
+    parser.add_argument("--evict-every", type=float, default=60.0)
+    parser.add_argument("--full", action="store_true",
+                        help="Also run the batch kernel with every Kitsune column.")
+    args = parser.parse_args()
+
+    _here = Path(__file__).resolve().parent
+    spec = importlib.util.spec_from_file_location(
+        'part2', str(_here / 'TonIoT-Part2-integrator-of-features.py')
+    )
+    part2 = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(part2)
+
+    flows = synthetic_stream(args.flows, args.pairs)
+    print(f"{len(flows):,} flows, {args.pairs:,} distinct (src, dst) pairs\n")
+
+    arrays_cls = lambda: part2.KitsuneExtractor(columns=LEGACY_COLUMNS)
+    impls = (("dicts", LegacyKitsuneExtractor), ("arrays", arrays_cls))
+    print(f"{'state':<7s} {'seconds':>8s} {'flows/s':>10s}")
+    for name, cls in impls:
+        gc.collect()
+        kitsune, secs = run(cls, flows)
+        print(f"{name:<7s} {secs:>8.2f} {len(flows) / secs:>10,.0f}")
+        del kitsune
+    batch, secs = run_batch(part2.KitsuneExtractor, flows, args.batch)
+    print(f"{'batch':<7s} {secs:>8.2f} {len(flows) / secs:>10,.0f}")
+    if args.workers > 1:
+        sharded_cls = lambda: part2.ShardedKitsuneExtractor(args.workers)
+        sharded, secs = run_batch(sharded_cls, flows, args.batch)
+        print(f"{f'x{args.workers}':<7s} {secs:>8.2f} {len(flows) / secs:>10,.0f}")
+        assert all(np.array_equal(sharded[k], batch[k]) for k in batch)
+
+    # Same features on a sample (fresh extractors, first 200k flows).
+    sample = flows[:200_000]
+    legacy, arrays = LegacyKitsuneExtractor(), arrays_cls()
+    for f in sample:
+        assert legacy.update_and_extract(*f) == arrays.update_and_extract(*f), f
+    print(f"\nFeatures identical on the first {len(sample):,} flows.")
+    arrays = arrays_cls()
+    per_flow = [arrays.update_and_extract(*f) for f in sample]
+    for name in per_flow[0]:
+        assert batch[name][:len(sample)].tolist() == [r[name] for r in per_flow], name
+    print("Batch kernel identical to the per-flow path on the same flows.")
+    if args.workers > 1:
+        print(f"Sharded batch ({args.workers} workers) identical to the in-process batch.")
+
+    if args.evict_below is not None:
+        cls = lambda: part2.KitsuneExtractor(args.evict_below, args.evict_every)
+        evicting, secs = run_batch(cls, flows, args.batch)
+        deviation = {k: float(np.max(np.abs(evicting[k] - batch[k]))) for k in batch}
+        kitsune = cls()
+        kitsune.update_and_extract_batch(*(np.array(c) for c in zip(*flows)))
+        print(f"\neviction (weight < {args.evict_below:g} every {args.evict_every:g} s): "
+              f"{secs:.2f} s, {len(flows) / secs:,.0f} flows/s")
+        print(f"  live streams {kitsune.state_size()}, evicted {kitsune.evicted}")
+        print("  max |feature - no-eviction feature|: " + ", ".join(
+            f"{family} {max(v for k, v in deviation.items() if k.startswith(family + '_L')):.3g}"
+            for family in ('H', 'MI_dir', 'HH_jit')))
+
+    if args.full:
+        full_flows = with_ports(flows)
+        columns = list(part2.KitsuneExtractor.all_columns())
+        print(f"\nfull Kitsune ({len(columns)} columns, families "
+              f"{', '.join(part2.KitsuneExtractor.FAMILIES)}):")
+        full, secs = run_batch(lambda: part2.KitsuneExtractor(columns=columns),
+                               full_flows, args.batch)
+        print(f"  {'batch':<7s} {secs:>8.2f} {len(flows) / secs:>10,.0f} flows/s")
+        assert all(np.array_equal(full[k], batch[k]) for k in batch)
+        if args.workers > 1:
+            sharded_cls = lambda: part2.ShardedKitsuneExtractor(args.workers, columns=columns)
+            sharded, secs = run_batch(sharded_cls, full_flows, args.batch)
+            print(f"  {f'x{args.workers}':<7s} {secs:>8.2f} {len(flows) / secs:>10,.0f} flows/s")
+            assert all(np.array_equal(sharded[k], full[k]) for k in full)
+        print("  Default columns identical to the default batch run"
+              + (", sharded identical." if args.workers > 1 else "."))
+
+    if not args.no_memory:
+        print(f"\n{'state':<7s} {'retained MiB':>13s} {'bytes/pair':>11s}")
+        for name, cls in impls:
+            mib = retained_mib(cls, flows)
+            print(f"{name:<7s} {mib:>13.1f} {mib * 2**20 / args.pairs:>11,.0f}")
@@ -0,0 +1,272 @@
+"""
+bench_part2_suite.py -- benchmark suite for the Part2 Kitsune / enrichment
+implementations over synthetic time-ordered flow streams, with saved
+baselines to catch regressions.
+
+Each scenario is a synthetic stream with a given number of hosts, distinct
+(src, dst) pairs, burstiness and length: every pair is touched once and
+then revisited at random; with probability --burstiness a flow repeats the
+previous flow's pair 0-2 ms later (a burst), otherwise the gap is
+exponential with mean --mean-gap-ms. Implementations:
+
+  per-flow  KitsuneExtractor.update_and_extract, one call per flow
+  batch     KitsuneExtractor.update_and_extract_batch, --batch flows per call
+  sharded   ShardedKitsuneExtractor (--workers processes), same calls
+  full      batch with every Kitsune column (HH / HpHp 2D stats, 5 lambdas)
+  enrich    enrich_dataset over --batch-row base frames (the Part2 path)
+
+For each (scenario, implementation) it reports flows/sec, the latency of
+the call that returns a flow's features (p50 / p99 / max over flows, us)
+and, in a separate tracemalloc run, the peak traced memory and the state
+kept by the extractor at the end (state_nbytes; the only figure for
+sharded, whose state lives in the workers).
+
+--save writes the results as JSON; --compare loads such a file and flags
+every result whose flows/sec dropped or whose peak memory grew by more than
+--tolerance (exit status 1 if any did). Results are only compared against a
+baseline with the same scenario parameters.
+
+    python bench_part2_suite.py                                   # all scenarios
+    python bench_part2_suite.py --scenario bursty --impl batch enrich
+    python bench_part2_suite.py --hosts 500 --pairs 20000 --burstiness 0.9
+    python bench_part2_suite.py --save baselines/part2.json
+    python bench_part2_suite.py --compare baselines/part2.json --no-memory
+"""
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# name -> (hosts, distinct pairs, burstiness)
+SCENARIOS = {
+    'uniform':    (1_000, 50_000, 0.0),
+    'bursty':     (1_000, 50_000, 0.8),
+    'many-pairs': (20_000, 1_000_000, 0.2),
+    'few-hosts':  (40, 1_000, 0.5),
+}
+IMPLS = ('per-flow', 'batch', 'sharded', 'full', 'enrich')
+
+
+def synthetic_stream(n_flows, n_hosts, n_pairs, burstiness, mean_gap_ms=5.0, seed=0):
+    """Dict of flow columns (stime, src_ip, dst_ip, src/dst bytes, ports) in
+    stime order; see the module docstring for the model."""
+    rng = np.random.default_rng(seed)
+    n_pairs = min(n_pairs, n_hosts * n_hosts)
+    codes = rng.choice(n_hosts * n_hosts, n_pairs, replace=False)
+    pair = rng.integers(0, n_pairs, n_flows)
+    first = min(n_flows, n_pairs)
+    pair[:first] = rng.permutation(n_pairs)[:first]
+    burst = rng.random(n_flows) < burstiness
+    burst[0] = False
+    # A burst repeats the previous flow's pair (forward fill).
+    pair = pair[np.maximum.accumulate(np.where(burst, 0, np.arange(n_flows)))]
+    gaps = np.where(burst, rng.integers(0, 3, n_flows),
+                    np.round(rng.exponential(mean_gap_ms, n_flows)))
+    hosts = np.array([f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(n_hosts)],
+                     dtype=object)
+    src, dst = codes[pair] // n_hosts, codes[pair] % n_hosts
+    return {
+        'stime':        1_554_000_000_000 + np.cumsum(gaps).astype(np.int64),
+        'src_ip':       hosts[src],
+        'dst_ip':       hosts[dst],
+        'src_ip_bytes': rng.integers(40, 5000, n_flows),
+        'dst_ip_bytes': rng.integers(0, 5000, n_flows),
+        'src_port':     1024 + rng.integers(0, 8, n_flows),
+        'dst_port':     np.array([53, 80, 443, 1883])[dst % 4],
+    }
+
+
+def base_frame(stream, seed=0):
+    """_base.csv-like frame (as pd.read_csv returns it) for enrich_dataset."""
+    rng = np.random.default_rng(seed)
+    n = len(stream['stime'])
+    dur = rng.integers(0, 30_000, n)
+    pick = lambda values: np.array(values, dtype=object)[rng.integers(0, len(values), n)]
+    return pd.DataFrame({
+        **stream,
+        'proto': pick(('tcp', 'udp', 'icmp')),
+        'ltime': stream['stime'] + dur, 'dur': dur / 1000.0,
+        'dns_query': np.nan, 'dns_rejected': pick(('-', 'T', 'F')), 'dns_RD': '-',
+        'conn_state': pick(('SF', 'S0', 'OTH')), 'service': pick(('dns', 'http', '-')),
+        'http_status_code': -1,
+        'src_pkts': rng.integers(0, 40, n), 'dst_pkts': rng.integers(0, 40, n),
+        'label': 'normal',
+    })
+
+
+def _calls(part2, impl, stream, batch, workers):
+    """(extractor, list of (n_flows, call)) for one implementation; every
+    call processes the next n_flows flows."""
+    kits_inputs = ('stime', 'src_ip', 'dst_ip', 'src_ip_bytes', 'dst_ip_bytes')
+    n = len(stream['stime'])
+    spans = [(i, min(i + batch, n)) for i in range(0, n, batch)]
+    if impl == 'per-flow':
+        kitsune = part2.KitsuneExtractor()
+        rows = list(zip(*(stream[c].tolist() for c in kits_inputs)))
+        return kitsune, [(1, lambda f=f: kitsune.update_and_extract(*f)) for f in rows]
+    if impl == 'enrich':
+        kitsune, running, counters = part2.KitsuneExtractor(), defaultdict(float), None
+        frames = [base_frame({c: v[i:end] for c, v in stream.items()}, seed=i)
+                  for i, end in spans]
+        return kitsune, [(len(df), lambda df=df: part2.enrich_dataset(df, kitsune, running,
+                                                                      counters))
+                         for df in frames]
+    inputs = kits_inputs
+    if impl == 'sharded':
+        kitsune = part2.ShardedKitsuneExtractor(workers)
+    elif impl == 'full':
+        kitsune = part2.KitsuneExtractor(columns=list(part2.KitsuneExtractor.all_columns()))
+        inputs += ('src_port', 'dst_port')
+    else:
+        kitsune = part2.KitsuneExtractor()
+    return kitsune, [(end - i, lambda i=i, end=end: kitsune.update_and_extract_batch(
+                         *(stream[c][i:end] for c in inputs)))
+                     for i, end in spans]
+
+
+def run_timed(part2, impl, stream, batch, workers):
+    """flows/sec and per-flow latency percentiles (us) of one run."""
+    kitsune, calls = _calls(part2, impl, stream, batch, workers)
+    sizes = np.array([size for size, _ in calls])
+    latency = np.empty(len(calls))
+    gc.collect()
+    start = time.perf_counter()
+    for k, (_, call) in enumerate(calls):
+        t0 = time.perf_counter_ns()
+        call()
+        latency[k] = time.perf_counter_ns() - t0
+    secs = time.perf_counter() - start
+    kitsune.close()
+    # A flow's latency is that of the call that returns its features.
+    per_flow = np.repeat(latency, sizes) / 1000.0
+    return {
+        'flows_per_s': sizes.sum() / secs,
+        'p50_us': float(np.percentile(per_flow, 50)),
+        'p99_us': float(np.percentile(per_flow, 99)),
+        'max_us': float(per_flow.max()),
+    }
+
+
+def run_traced(part2, impl, stream, batch, workers):
+    """Peak traced memory during the run and state bytes at the end (MiB)."""
+    kitsune, calls = _calls(part2, impl, stream, batch, workers)
+    gc.collect()
+    tracemalloc.start()
+    for _, call in calls:
+        call()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    state = kitsune.state_nbytes()
+    kitsune.close()
+    return {'peak_mib': None if impl == 'sharded' else peak / 2**20, 'state_mib': state / 2**20}
+
+
+def compare(results, baseline, tolerance):
+    """Lines comparing results against a baseline; (lines, regressions)."""
+    lines, regressions = [], 0
+    for key, res in results.items():
+        base = baseline['results'].get(key)
+        if base is None or base['params'] != res['params']:
+            lines.append(f"{key:<22s} no baseline with these parameters")
+            continue
+        speed = res['flows_per_s'] / base['flows_per_s']
+        flags = []
+        if speed < 1.0 - tolerance:
+            flags.append("SLOWER")
+        line = f"{key:<22s} flows/s x{speed:.2f}"
+        if res.get('peak_mib') is not None and base.get('peak_mib'):
+            mem = res['peak_mib'] / base['peak_mib']
+            line += f"   peak MiB x{mem:.2f}"
+            if mem > 1.0 + tolerance:
+                flags.append("MORE MEMORY")
+        regressions += bool(flags)
+        lines.append(line + (f"   <-- {', '.join(flags)}" if flags else ""))
+    return lines, regressions
+
+
+if __name__ == '__main__':
+    import importlib.util
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scenario", nargs='+', choices=SCENARIOS, default=None,
+                        help="Preset scenarios (default: all, or 'custom' with --hosts/--pairs).")
+    parser.add_argument("--hosts", type=int, default=None)
+    parser.add_argument("--pairs", type=int, default=None)
+    parser.add_argument("--burstiness", type=float, default=0.0,
+                        help="Probability that a flow repeats the previous pair (custom).")
+    parser.add_argument("--flows", type=int, default=200_000)
+    parser.add_argument("--mean-gap-ms", type=float, default=5.0)
+    parser.add_argument("--impl", nargs='+', choices=IMPLS, default=None,
+                        help="Implementations (default: all but sharded; sharded with --workers).")
+    parser.add_argument("--batch", type=int, default=50_000,
+                        help="Flows per update_and_extract_batch / enrich_dataset call.")
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true",
+                        help="Skip the (slower) tracemalloc runs.")
+    parser.add_argument("--save", type=Path, default=None, help="Write results to this JSON.")
+    parser.add_argument("--compare", type=Path, default=None,
+                        help="Baseline JSON (from --save) to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Relative slowdown / memory growth flagged as a regression.")
+    args = parser.parse_args()
+
+    if args.hosts is not None or args.pairs is not None:
+        scenarios = {'custom': (args.hosts or 1_000, args.pairs or 50_000, args.burstiness)}
+    else:
+        scenarios = {name: SCENARIOS[name] for name in (args.scenario or SCENARIOS)}
+    impls = args.impl or [i for i in IMPLS if i != 'sharded' or args.workers > 1]
+    if 'sharded' in impls and args.workers < 2:
+        parser.error("sharded needs --workers N (N >= 2)")
+
+    _here = Path(__file__).resolve().parent
+    spec = importlib.util.spec_from_file_location(
+        'part2', str(_here / 'TonIoT-Part2-integrator-of-features.py')
+    )
+    part2 = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(part2)
+
+    results = {}
+    print(f"{'scenario/impl':<22s} {'flows/s':>10s} {'p50 us':>9s} {'p99 us':>9s} "
+          f"{'max us':>10s} {'peak MiB':>9s} {'state MiB':>10s}")
+    for name, (hosts, pairs, burstiness) in scenarios.items():
+        stream = synthetic_stream(args.flows, hosts, pairs, burstiness, args.mean_gap_ms)
+        distinct = len(pd.unique(pd.Series(stream['src_ip']) + '|' + stream['dst_ip']))
+        params = {'flows': args.flows, 'hosts': hosts, 'pairs': pairs, 'burstiness': burstiness,
+                  'mean_gap_ms': args.mean_gap_ms, 'batch': args.batch}
+        print(f"-- {name}: {args.flows:,} flows, {hosts:,} hosts, {distinct:,} distinct pairs, "
+              f"burstiness {burstiness:g}")
+        for impl in impls:
+            res = run_timed(part2, impl, stream, args.batch, args.workers)
+            if not args.no_memory:
+                res.update(run_traced(part2, impl, stream, args.batch, args.workers))
+            res['params'] = dict(params, workers=args.workers) if impl == 'sharded' else params
+            results[f"{name}/{impl}"] = res
+            mem = ""
+            if not args.no_memory:
+                peak = '-' if res['peak_mib'] is None else f"{res['peak_mib']:.1f}"
+                mem = f" {peak:>9s} {res['state_mib']:>10.1f}"
+            print(f"{f'{name}/{impl}':<22s} {res['flows_per_s']:>10,.0f} {res['p50_us']:>9.1f} "
+                  f"{res['p99_us']:>9.1f} {res['max_us']:>10.1f}{mem}")
+
+    if args.save:
+        args.save.parent.mkdir(parents=True, exist_ok=True)
+        meta = {'python': sys.version.split()[0], 'numpy': np.__version__,
+                'pandas': pd.__version__, 'machine': platform.platform()}
+        args.save.write_text(json.dumps({'meta': meta, 'results': results}, indent=2))
+        print(f"\nResults saved to {args.save}")
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        lines, regressions = compare(results, baseline, args.tolerance)
+        print(f"\nAgainst {args.compare} ({baseline['meta']['machine']}):")
+        print("\n".join(lines))
+        if regressions:
+            print(f"{regressions} regression(s) beyond {args.tolerance:.0%}.")
+            raise SystemExit(1)
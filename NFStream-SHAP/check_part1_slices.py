@@ -0,0 +1,68 @@
+"""
+check_part1_slices.py -- compares the serial Part1 output of one capture with
+the time-sliced one (process_pcap_sliced) and reports the differences.
+
+Rows are compared as sets (the sliced run writes interior rows first and the
+stitched boundary flows last). Rows that only differ in 'service' are counted
+apart: nDPI may classify a stitched flow differently than on the full flow,
+which is the documented approximation of the sliced mode. Any other difference
+is an error.
+
+    python check_part1_slices.py --pcap ../../PCAP/Normal/normal_1.pcap
+    python check_part1_slices.py --pcap <file> --slices 8 --slice-by time
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+
+if __name__ == '__main__':
+    import importlib.util
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pcap", required=True)
+    parser.add_argument("--slices", type=int, default=4)
+    parser.add_argument("--slice-by", choices=("bytes", "time"), default="bytes")
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    _here = Path(__file__).resolve().parent
+    spec = importlib.util.spec_from_file_location(
+        'p1', str(_here / 'TonIoT-Part1-integrator-PCAP.py')
+    )
+    mod = importlib.util.module_from_spec(spec)
+    # The slice workers pickle functions of this module by name.
+    sys.modules['p1'] = mod
+    spec.loader.exec_module(mod)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        serial_csv, sliced_csv = Path(tmp) / 'serial.csv', Path(tmp) / 'sliced.csv'
+        start = time.perf_counter()
+        mod.write_base_csv(mod.process_pcap(args.pcap, 'check'), serial_csv)
+        t_serial = time.perf_counter() - start
+        start = time.perf_counter()
+        _, n_merged = mod.process_pcap_sliced(args.pcap, 'check', sliced_csv, args.slices,
+                                              args.workers, slice_by=args.slice_by)
+        t_sliced = time.perf_counter() - start
+        serial = pd.read_csv(serial_csv, keep_default_na=False)
+        sliced = pd.read_csv(sliced_csv, keep_default_na=False)
+
+    print(f"serial: {len(serial):,} flows in {t_serial:.2f}s")
+    print(f"sliced: {len(sliced):,} flows in {t_sliced:.2f}s "
+          f"({args.slices} slices by {args.slice_by}, {n_merged} stitched)")
+
+    cols = [c for c in mod.BASE_COLUMNS if c != 'service']
+    diff = serial.merge(sliced, how='outer', indicator=True)
+    diff = diff[diff['_merge'] != 'both']
+    # A row pair that matches on everything but 'service' is the approximation.
+    only_service = diff.groupby(cols, sort=False)['_merge'].transform('nunique') == 2
+    print(f"rows differing only in service: {int(only_service.sum()) // 2}")
+    errors = diff[~only_service]
+    if len(errors):
+        print(errors.sort_values(['src_ip', 'src_port', 'stime']).to_string())
+        raise SystemExit(f"{len(errors)} rows differ beyond 'service'")
+    print("OK")
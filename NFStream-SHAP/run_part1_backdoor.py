@@ -29,8 +29,8 @@ if __name__ == '__main__':
     pcap_short = buf.value if buf.value else pcap_long
     print(f'PCAP path (short): {pcap_short}')
 
-    flows = mod.process_pcap(pcap_short, 'backdoor')
-    df = pd.DataFrame(flows)
+    # process_pcap emite chunks (DataFrames); para un solo PCAP chico se concatenan.
+    df = pd.concat(mod.process_pcap(pcap_short, 'backdoor'), ignore_index=True)
     print(f'Flows extracted: {len(df)}')
     print(f'conn_state distribution: {df["conn_state"].value_counts().to_dict()}')
 
@@ -29,8 +29,8 @@ if __name__ == '__main__':
     pcap = buf.value if buf.value else pcap_long
     print(f'Using path: {pcap}')
 
-    flows = mod.process_pcap(pcap, 'backdoor')
-    df = pd.DataFrame(flows)
+    # process_pcap emite chunks (DataFrames); para un solo PCAP chico se concatenan.
+    df = pd.concat(mod.process_pcap(pcap, 'backdoor'), ignore_index=True)
 
     expected = {
         'src_ip', 'dst_ip', 'src_port', 'dst_port', 'proto', 'stime',
@@ -1,32 +1,177 @@
-import pandas as pd
+import argparse
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
 
 
-#Cuenta cuantas instancias por archivo existen en los archivos
-#Se ejecuta para verificar la integridad de los archivos Generados
-# Que cumplan con la composicion deseada.
+# Perfil de los archivos generados por el pipeline (_base, _combined,
+# _processed, _shap y los subconjuntos finales), para verificar que cumplan
+# con la composicion deseada. Lee cada CSV una sola vez, por chunks, y calcula:
+# - Cantidad de instancias por clase ('category', o 'label' si no esta)
+# - Porcentaje de nulos por columna
+# - Minimo, maximo y media de las columnas numericas
+# - Cantidad de valores distintos de las columnas categoricas
+# El perfil se guarda en JSON, junto al CSV o en --output.
 
 
 csv_file_path = "TonIoT-formodels-allfets-multiclass.csv"
 
-def contar_por_categoria(csv_path):
-    if not os.path.exists(csv_path):
-        print(f"Archivo no encontrado: {csv_path}")
-        return
+CLASS_COLUMNS = ('category', 'label')
+CHUNK_ROWS = 500_000
+# Tope de valores distintos que se guardan por columna categorica, para que
+# una columna tipo id no ocupe memoria sin limite
+MAX_DISTINCT = 100_000
+
+def _scalar(value):
+    return value.item() if hasattr(value, 'item') else value
+
+def profile_csv(csv_path, class_column=None, chunk_rows=CHUNK_ROWS):
+    """Perfil de un CSV en una pasada por chunks (dict listo para JSON).
+    Lanza ValueError si class_column no esta en el header del archivo."""
+    header = pd.read_csv(csv_path, nrows=0).columns
+    if class_column is None:
+        class_column = next((col for col in CLASS_COLUMNS if col in header), None)
+    elif class_column not in header:
+        raise ValueError(f"La columna de clase '{class_column}' no está en {csv_path}")
+
+    rows, class_counts, columns, numeric_columns = 0, {}, {}, None
+    for chunk in pd.read_csv(csv_path, chunksize=chunk_rows):
+        if class_column is not None:
+            for value, n in chunk[class_column].value_counts(dropna=False).items():
+                key = None if pd.isna(value) else str(_scalar(value))
+                class_counts[key] = class_counts.get(key, 0) + int(n)
+
+        rows += len(chunk)
+        nulls = chunk.isna().sum()
+        if numeric_columns is None:
+            # Cada columna se clasifica una sola vez, por su dtype en el
+            # primer chunk
+            numeric_columns = chunk.select_dtypes('number').columns.tolist()
+        numeric = chunk[numeric_columns]
+        mixed = [col for col in numeric_columns if not pd.api.types.is_numeric_dtype(numeric[col])]
+        if mixed:
+            # Texto en una columna numerica: lo que no es numero no cuenta
+            # para min/max/media
+            numeric = numeric.assign(**{col: pd.to_numeric(numeric[col], errors='coerce') for col in mixed})
+        if len(numeric.columns):
+            stats = pd.DataFrame({'min': numeric.min(), 'max': numeric.max(),
+                                  'sum': numeric.sum(), 'count': numeric.count()})
+        for col in chunk.columns:
+            info = columns.setdefault(col, {'dtypes': [], 'nulls': 0})
+            dtype = str(chunk[col].dtype)
+            if dtype not in info['dtypes']:
+                info['dtypes'].append(dtype)
+            info['nulls'] += int(nulls[col])
+            if col in numeric.columns:
+                count = int(stats.at[col, 'count'])
+                if count:
+                    low, high = _scalar(stats.at[col, 'min']), _scalar(stats.at[col, 'max'])
+                    info['min'] = min(info.get('min', low), low)
+                    info['max'] = max(info.get('max', high), high)
+                    info['sum'] = info.get('sum', 0) + float(stats.at[col, 'sum'])
+                    info['count'] = info.get('count', 0) + count
+            else:
+                values = info.setdefault('values', set())
+                if not info.get('truncated'):
+                    values.update(chunk[col].dropna().unique())
+                    info['truncated'] = len(values) > MAX_DISTINCT
+
+    profile_columns = {}
+    for col, info in columns.items():
+        entry = {'dtype': '/'.join(info['dtypes']), 'nulls': info['nulls'],
+                 'null_rate': info['nulls'] / rows if rows else 0.0}
+        if 'count' in info:
+            entry.update(min=info['min'], max=info['max'], mean=info['sum'] / info['count'])
+        if 'values' in info:
+            entry['distinct'] = len(info['values'])
+            if info.get('truncated'):
+                entry['distinct_truncated'] = True
+        profile_columns[col] = entry
+
+    return {
+        'file': os.path.abspath(csv_path),
+        'rows': rows,
+        'class_column': class_column,
+        'class_counts': dict(sorted(class_counts.items(), key=lambda kv: -kv[1])),
+        'columns': profile_columns,
+    }
+
+def _profile_path(csv_path):
+    return os.path.splitext(csv_path)[0] + "_profile.json"
+
+def print_profile(profile):
+    print(f"\n{profile['file']}: {profile['rows']} filas, {len(profile['columns'])} columnas")
+    if profile['class_column'] is None:
+        print(f"No se encontró columna de clase ({', '.join(CLASS_COLUMNS)}).")
+    else:
+        print(f"Cantidad de instancias por tipo en '{profile['class_column']}':")
+        for value, n in profile['class_counts'].items():
+            print(f"  {value}: {n}")
+    with_nulls = {col: c['null_rate'] for col, c in profile['columns'].items() if c['nulls']}
+    if with_nulls:
+        print("Columnas con nulos:")
+        for col, rate in sorted(with_nulls.items(), key=lambda kv: -kv[1]):
+            print(f"  {col}: {rate:.2%}")
+
+def _csv_paths(paths):
+    # Un directorio se reemplaza por los CSV que contiene
+    for path in paths:
+        if os.path.isdir(path):
+            yield from (os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith(".csv"))
+        else:
+            yield path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Perfil (clases, nulos, rangos, distintos) de CSV del pipeline.")
+    parser.add_argument("paths", nargs="*", default=[csv_file_path],
+                        help="CSV o carpetas con CSV (default: %(default)s)")
+    parser.add_argument("--class-column", default=None,
+                        help="Columna de clase (default: 'category' o 'label').")
+    parser.add_argument("--output", default=None,
+                        help="JSON con todos los perfiles; sin esto, uno junto a cada CSV.")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Archivos que se perfilan en paralelo (default: CPUs).")
+    args = parser.parse_args()
 
-    try:
-        df = pd.read_csv(csv_path)
-        
-        if 'category' not in df.columns:
-            print("La columna 'category' no se encuentra en el archivo.")
-            return
+    paths = []
+    for path in _csv_paths(args.paths):
+        if os.path.exists(path):
+            paths.append(path)
+        else:
+            print(f"Archivo no encontrado: {path}")
 
-        conteo = df['category'].value_counts()
-        print("Cantidad de instancias por tipo en 'category':")
-        print(conteo)
+    if args.class_column is not None:
+        # Se revisa el header de cada archivo antes de empezar a leerlos
+        missing = []
+        for path in paths:
+            try:
+                if args.class_column not in pd.read_csv(path, nrows=0).columns:
+                    missing.append(path)
+            except Exception:
+                pass  # el error se informa al perfilar el archivo
+        if missing:
+            print(f"La columna de clase '{args.class_column}' no está en: {', '.join(missing)}")
+            exit(1)
 
-    except Exception as e:
-        print(f"Ocurrió un error al procesar el archivo: {e}")
+    with ProcessPoolExecutor(args.workers) as pool:
+        futures = [pool.submit(profile_csv, path, args.class_column, args.chunk_rows) for path in paths]
+        profiles = []
+        for path, future in zip(paths, futures):
+            try:
+                profiles.append(future.result())
+            except Exception as e:
+                print(f"Ocurrió un error al procesar {path}: {e}")
 
-# Ejecutar función
-contar_por_categoria(csv_file_path)
+    for profile in profiles:
+        print_profile(profile)
+        if args.output is None:
+            with open(_profile_path(profile['file']), 'w') as f:
+                json.dump(profile, f, indent=2)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(profiles, f, indent=2)
+    if profiles:
+        print(f"\nPerfiles guardados en: {args.output or ', '.join(_profile_path(p['file']) for p in profiles)}")
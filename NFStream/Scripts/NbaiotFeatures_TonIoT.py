@@ -1,12 +1,34 @@
 # generate_nbaiot_features.py
+#
+# Calcula las caracteristicas tipo N-BaIoT de cada flujo (flow_id) de una
+# tabla por paquete. extract_nbaiot_selected_features es la version por
+# flujo; extract_nbaiot_features_grouped calcula lo mismo para todos los
+# flujos a la vez: ordena una sola vez por flow_id (cada flujo queda en un
+# segmento contiguo) y reemplaza el loop sobre df.groupby por reducciones
+# sobre segmentos. Con --workers los flujos se reparten en rangos de
+# flow_id entre procesos.
 
+import argparse
+import math
 import pandas as pd
 import numpy as np
 import pywt
+from concurrent.futures import ProcessPoolExecutor
+from scipy.special import entr
 from scipy.stats import entropy
 from sklearn.metrics import mutual_info_score
 import os
 
+FEATURE_COLUMNS = [
+    'flow_id', 'MI-dir-L5-weight', 'HH-L3-weight', 'HH-L0.01-weight',
+    'HpHp-L0.01-weight', 'HpHp-L0.01-mean', 'HpHp-L0.01-std', 'HpHp-L0.01-magnitude',
+    'label'
+]
+
+# Flujos por bloque del motor agrupado (acota la memoria de los histogramas
+# de 100 bins: un arreglo (flujos, 100) por bloque).
+CHUNK_FLOWS = 100_000
+
 def extract_nbaiot_selected_features(flow_id, group):
     result = {}
 
@@ -39,7 +61,223 @@ def extract_nbaiot_selected_features(flow_id, group):
     result['label'] = group['label'].iloc[0]
     return result
 
+# ============================================================================
+# Motor agrupado: primitivas sobre segmentos contiguos
+# ============================================================================
+# Un segmento es values[start:start + length]. Las sumas se hacen con las
+# mismas operaciones que np.sum / np.dot sobre cada segmento (los segmentos
+# de un mismo largo se reducen juntos como filas de una matriz), asi los
+# resultados coinciden con los de la version por flujo.
+
+def _starts(lengths):
+    return np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+
+def _segment_reduce(values, starts, lengths, reduce):
+    """reduce(matriz (k, largo)) -> k valores, para los segmentos de cada largo."""
+    out = np.zeros(len(starts))
+    for length in np.unique(lengths):
+        sel = np.flatnonzero(lengths == length)
+        out[sel] = reduce(values[starts[sel, None] + np.arange(length)])
+    return out
+
+def _segment_sum(values, starts, lengths):
+    """np.sum de cada segmento."""
+    return _segment_reduce(values, starts, lengths, lambda rows: rows.sum(axis=1))
+
+def _segment_dot(values, starts, lengths):
+    """np.dot(s, s) de cada segmento s."""
+    return _segment_reduce(values, starts, lengths,
+                           lambda rows: np.matmul(rows[:, None, :], rows[:, :, None])[:, 0, 0])
+
+def _haar_step(values, starts, lengths):
+    """Aproximacion de pywt.dwt(s, 'db1') (modo symmetric) de cada segmento:
+    (s[2k] + s[2k+1]) / sqrt(2), repitiendo el ultimo valor si el largo es
+    impar. Devuelve (valores, starts, lengths) de los segmentos nuevos."""
+    h = np.sqrt(0.5)
+    out_lengths = (lengths + 1) // 2
+    out_starts = _starts(out_lengths)
+    k = np.arange(out_lengths.sum()) - np.repeat(out_starts, out_lengths)
+    first = np.repeat(starts, out_lengths) + 2 * k
+    second = np.minimum(first + 1, np.repeat(starts + lengths - 1, out_lengths))
+    return h * values[first] + h * values[second], out_starts, out_lengths
+
+def _histogram_entropy(values, flow, lo, hi, lengths, bins):
+    """entropy(np.histogram(s, bins, density=True)[0] + 1e-10) de cada
+    segmento s (flow es el segmento de cada valor; lo/hi, minimo y maximo de
+    cada segmento). Reproduce la asignacion a bins de np.histogram."""
+    integer = np.issubdtype(values.dtype, np.integer)
+    same = lo == hi
+    first = np.where(same, lo - 0.5, lo).astype(float)
+    last = np.where(same, hi + 0.5, hi).astype(float)
+    edges = np.linspace(first, last, bins + 1, axis=1)
+
+    # Con enteros np.histogram resta en enteros (salvo rango degenerado).
+    if integer:
+        offset = np.where(same[flow], values - first[flow], (values - lo[flow]).astype(float))
+        width = np.where(same, last - first, (hi - lo).astype(float))
+    else:
+        offset = values - first[flow]
+        width = last - first
+    index = ((offset / width[flow]) * bins).astype(np.intp)
+    index[index == bins] -= 1
+    index[values < edges[flow, index]] -= 1
+    index[(values >= edges[flow, index + 1]) & (index != bins - 1)] += 1
+
+    counts = np.bincount(flow * bins + index, minlength=len(lo) * bins).reshape(len(lo), bins)
+    hist = counts / np.diff(edges, axis=1) / lengths[:, None]
+    pk = hist + 1e-10
+    return entr(pk / pk.sum(axis=1, keepdims=True)).sum(axis=1)
+
+def _mutual_info(flow, a_codes, b_codes, lengths):
+    """mutual_info_score(a, b) de cada segmento; a_codes / b_codes son
+    codigos de los valores en orden (pd.factorize(sort=True)), flow el
+    segmento de cada fila. Mismas operaciones que sklearn, celda por celda
+    de la tabla de contingencia, en el mismo orden."""
+    order = np.lexsort((b_codes, a_codes, flow))
+    f, a, b = flow[order], a_codes[order], b_codes[order]
+    n = len(f)
+
+    # Celdas (flujo, a, b) y clases (flujo, a) / (flujo, b) con sus cuentas
+    new_a = np.ones(n, dtype=bool)
+    new_a[1:] = (f[1:] != f[:-1]) | (a[1:] != a[:-1])
+    new_cell = new_a.copy()
+    new_cell[1:] |= b[1:] != b[:-1]
+    cell_start = np.flatnonzero(new_cell)
+    nz = np.diff(np.append(cell_start, n))
+    a_run = np.cumsum(new_a) - 1
+    pi = np.bincount(a_run)[a_run[cell_start]]
+    b_key, b_uniques = pd.factorize(f.astype(np.int64) * (int(b.max()) + 1) + b)
+    pj = np.bincount(b_key)[b_key[cell_start]]
+
+    cell_flow = f[cell_start]
+    n_a = np.bincount(f[new_a], minlength=len(lengths))
+    n_b = np.bincount(b_uniques // (int(b.max()) + 1), minlength=len(lengths))
+
+    # log(N) con math.log, como sklearn (una vez por largo distinto)
+    uniq_n, inverse = np.unique(lengths, return_inverse=True)
+    log_n = np.array([math.log(v) for v in uniq_n.tolist()])[inverse][cell_flow]
+    total = lengths[cell_flow]
+    contingency_nm = nz / total
+    log_outer = -np.log(pi.astype(np.int64) * pj.astype(np.int64)) + log_n + log_n
+    mi = contingency_nm * (np.log(nz) - log_n) + contingency_nm * log_outer
+    mi = np.where(np.abs(mi) < np.finfo(mi.dtype).eps, 0.0, mi)
+
+    cells_per_flow = np.bincount(cell_flow, minlength=len(lengths))
+    score = _segment_sum(mi, _starts(cells_per_flow), cells_per_flow)
+    score[(n_a == 1) | (n_b == 1)] = 0.0
+    return np.clip(score, 0.0, None)
+
+def _extract_block(flow_ids, src_bytes, dst_bytes, labels, lengths):
+    """Features de un bloque de flujos contiguos (filas ya ordenadas por
+    flujo, lengths filas por flujo)."""
+    m = len(lengths)
+    flow = np.repeat(np.arange(m), lengths)
+
+    # Senal con padding a 4 valores por flujo (como np.pad en la version
+    # por flujo); el MI usa las filas sin padding.
+    padded_lengths = np.maximum(lengths, 4)
+    padded_starts = _starts(padded_lengths)
+    signal = np.zeros(padded_lengths.sum(), dtype=src_bytes.dtype)
+    rank = np.arange(len(flow)) - np.repeat(_starts(lengths), lengths)
+    signal[padded_starts[flow] + rank] = src_bytes
+    padded_flow = np.repeat(np.arange(m), padded_lengths)
+
+    # mutual_info_score falla si src/dst-ip-bytes tiene NaN o infinitos (y
+    # np.histogram, si el rango no es finito): esos flujos se omiten, con el
+    # mismo mensaje que la version por flujo.
+    starts = _starts(lengths)
+    bad_rows = ~(np.isfinite(src_bytes) & np.isfinite(dst_bytes))
+    ok = np.bincount(flow, weights=bad_rows, minlength=m) == 0
+    for k in np.flatnonzero(~ok):
+        rows = slice(starts[k], starts[k] + lengths[k])
+        values = next(v for v in (src_bytes[rows], dst_bytes[rows]) if not np.isfinite(v).all())
+        if np.isnan(values).any():
+            print(f"Error en flujo {flow_ids[k]}: Input contains NaN.")
+        else:
+            print(f"Error en flujo {flow_ids[k]}: Input contains infinity or a value too large "
+                  f"for dtype('{values.dtype}').")
+    lo = np.minimum.reduceat(signal, padded_starts)
+    hi = np.maximum.reduceat(signal, padded_starts)
+    if not ok.all():
+        keep_rows, keep_padded = ok[flow], ok[padded_flow]
+        flow_ids, labels, lengths = flow_ids[ok], labels[ok], lengths[ok]
+        src_bytes, dst_bytes = src_bytes[keep_rows], dst_bytes[keep_rows]
+        signal, lo, hi = signal[keep_padded], lo[ok], hi[ok]
+        padded_lengths = padded_lengths[ok]
+        padded_starts = _starts(padded_lengths)
+        m = len(lengths)
+        flow = np.repeat(np.arange(m), lengths)
+        padded_flow = np.repeat(np.arange(m), padded_lengths)
+    if m == 0:
+        return pd.DataFrame(columns=FEATURE_COLUMNS)
+
+    a_codes, _ = pd.factorize(src_bytes, sort=True)
+    b_codes, _ = pd.factorize(dst_bytes, sort=True)
+
+    # Wavelet db1 nivel 2 = dos pasos de Haar
+    values = signal.astype(float)
+    cA, cA_starts, cA_lengths = _haar_step(*_haar_step(values, padded_starts, padded_lengths))
+    cA_sum = _segment_sum(cA, cA_starts, cA_lengths)
+    cA_mean = cA_sum / cA_lengths
+    centered = cA - np.repeat(cA_mean, cA_lengths)
+
+    return pd.DataFrame({
+        'flow_id': flow_ids,
+        'MI-dir-L5-weight': _mutual_info(flow, a_codes, b_codes, lengths),
+        'HH-L3-weight': _histogram_entropy(signal, padded_flow, lo, hi, padded_lengths, 8),
+        'HH-L0.01-weight': _histogram_entropy(signal, padded_flow, lo, hi, padded_lengths, 100),
+        'HpHp-L0.01-weight': _segment_sum(np.square(cA), cA_starts, cA_lengths),
+        'HpHp-L0.01-mean': cA_mean,
+        'HpHp-L0.01-std': np.sqrt(_segment_sum(centered * centered, cA_starts, cA_lengths)
+                                  / cA_lengths),
+        'HpHp-L0.01-magnitude': np.sqrt(_segment_dot(cA, cA_starts, cA_lengths)),
+        'label': labels,
+    }, columns=FEATURE_COLUMNS)
+
+def extract_nbaiot_features_grouped(df, workers=1, chunk_flows=CHUNK_FLOWS):
+    """Features de todos los flujos de df, como aplicar
+    extract_nbaiot_selected_features a cada grupo de df.groupby('flow_id')
+    (mismo orden de flujos; label = la de la primera fila del flujo).
+
+    Ordena una sola vez por flow_id (sort estable) y procesa los flujos en
+    bloques de chunk_flows flujos contiguos; con workers > 1 los bloques
+    (rangos de flow_id) se calculan en un pool de procesos."""
+    df = df[df['flow_id'].notna()]
+    codes, flow_ids = pd.factorize(df['flow_id'], sort=True)
+    order = np.argsort(codes, kind='stable')
+    lengths = np.bincount(codes, minlength=len(flow_ids))
+    src_bytes = df['src-ip-bytes'].to_numpy()[order]
+    dst_bytes = df['dst-ip-bytes'].to_numpy()[order]
+    labels = df['label'].to_numpy()[order][_starts(lengths)] if len(df) else np.array([])
+    flow_ids = np.asarray(flow_ids)
+
+    row_starts = np.append(_starts(lengths), len(df))
+    blocks = []
+    for i in range(0, len(lengths), chunk_flows):
+        end = min(i + chunk_flows, len(lengths))
+        rows = slice(row_starts[i], row_starts[end])
+        blocks.append((flow_ids[i:end], src_bytes[rows], dst_bytes[rows],
+                       labels[i:end], lengths[i:end]))
+
+    if workers > 1 and len(blocks) > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            parts = list(pool.map(_extract_block, *zip(*blocks)))
+    else:
+        parts = [_extract_block(*block) for block in blocks]
+    if not parts:
+        return pd.DataFrame(columns=FEATURE_COLUMNS)
+    return pd.concat(parts, ignore_index=True)
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Caracteristicas tipo N-BaIoT por flow_id.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Procesos para repartir los flujos por rangos de flow_id.")
+    parser.add_argument("--chunk-flows", type=int, default=CHUNK_FLOWS,
+                        help="Flujos por bloque del motor agrupado.")
+    parser.add_argument("--per-flow", action="store_true",
+                        help="Usar la version por flujo (loop sobre groupby) en vez del motor agrupado.")
+    args = parser.parse_args()
+
     script_dir = os.path.dirname(os.path.abspath(__file__))
     input_file = os.path.join(script_dir, "DATASETS", "raw_flows.csv")
     output_file = os.path.join(script_dir, "DATASETS", "TonIoT_nbaiot_selected_features.csv")
@@ -52,17 +290,20 @@ if __name__ == '__main__':
     df = pd.read_csv(input_file)
 
     print("Extrayendo características por flujo...")
-    results = []
+    if args.per_flow:
+        results = []
 
-    for flow_id, group in df.groupby('flow_id'):
-        try:
-            result = extract_nbaiot_selected_features(flow_id, group)
-            results.append(result)
-        except Exception as e:
-            print(f"Error en flujo {flow_id}: {e}")
-            continue
+        for flow_id, group in df.groupby('flow_id'):
+            try:
+                result = extract_nbaiot_selected_features(flow_id, group)
+                results.append(result)
+            except Exception as e:
+                print(f"Error en flujo {flow_id}: {e}")
+                continue
 
-    features_df = pd.DataFrame(results)
+        features_df = pd.DataFrame(results)
+    else:
+        features_df = extract_nbaiot_features_grouped(df, args.workers, args.chunk_flows)
     features_df.to_csv(output_file, index=False)
 
     print(f"Características tipo N-BaIoT guardadas en: {output_file}")
@@ -13,109 +13,159 @@
 
 
 
+import math
 import os
 import pandas as pd
 import numpy as np
-import pywt
-from scipy.stats import entropy
-from sklearn.metrics import mutual_info_score
-from collections import defaultdict
+from scipy.special import entr
+
+def compute_nbaiot_features_batch(signal):
+    """Calcula las características tipo N-BaIoT de todas las filas a la vez.
+
+    signal es la matriz (n, 4) de [src_bytes, dst_bytes, src_pkts, dst_pkts]
+    (se completa con ceros si tiene menos columnas). Devuelve un dict
+    columna -> arreglo de n valores, idénticos a los de aplicar
+    compute_nbaiot_features fila por fila, pero con formas cerradas en vez
+    de llamar a pywt / sklearn / scipy.stats por fila:
+
+      - wavedec(db1, level=2) de 4 valores deja un único coeficiente de
+        aproximación: dos pasos de Haar, (a + b) / sqrt(2) por par. Su std
+        es 0 y su norma, el valor absoluto.
+      - mutual_info_score(arange(4), round(v)): cada etiqueta verdadera
+        tiene un solo elemento, así que la información mutua es la entropía
+        de los valores redondeados; se arma con las mismas operaciones que
+        sklearn a partir de cuántos elementos comparten valor.
+      - entropy(v + 1e-6) es la suma de entr() de la distribución
+        normalizada (scipy.stats.entropy con axis recorre fila por fila
+        cuando hay NaN, por eso se usa entr directamente).
+    """
+    values = np.asarray(signal, dtype=float)
+    if values.shape[1] < 4:
+        values = np.pad(values, ((0, 0), (0, 4 - values.shape[1])), 'constant')
+
+    # Haar nivel 2 (mismos productos que pywt, mismo redondeo)
+    h = np.sqrt(0.5)
+    approx = h * (h * values[:, 0] + h * values[:, 1]) + h * (h * values[:, 2] + h * values[:, 3])
+
+    # Información mutua = entropía de los valores redondeados, término a
+    # término como mutual_info_score (contingencia con una celda por fila)
+    rounded = np.round(values).astype(int)
+    counts = (rounded[:, :, None] == rounded[:, None, :]).sum(axis=2)
+    n_cols = values.shape[1]
+    log_n = math.log(n_cols)
+    terms = (1 / n_cols) * (0.0 - log_n) + (1 / n_cols) * (-np.log(counts) + log_n + log_n)
+    terms[np.abs(terms) < np.finfo(float).eps] = 0.0
+    mi_score = np.clip(terms.sum(axis=1), 0.0, None)
+
+    shifted = values + 1e-6
+    return {
+        'MI-dir-L5-weight': mi_score,
+        'HH-L3-weight': entr(shifted / shifted.sum(axis=1, keepdims=True)).sum(axis=1),
+        'HH-L0.01-weight': np.power(values / shifted.sum(axis=1, keepdims=True), 0.01).sum(axis=1),
+        'HpHp-L0.01-weight': np.square(values).sum(axis=1),
+        'HpHp-L0.01-mean': approx,
+        'HpHp-L0.01-std': np.abs(approx - approx),   # 0, o NaN si approx no es finito
+        'HpHp-L0.01-magnitude': np.abs(approx)
+    }
 
 def compute_nbaiot_features(values):
-    """Calcula características tipo N-BaIoT desde una lista de valores."""
-    values = np.array(values, dtype=float)
-    if len(values) < 4:
-        values = np.pad(values, (0, 4 - len(values)), 'constant')
+    """Características tipo N-BaIoT de una sola fila de valores."""
+    return {k: v[0] for k, v in compute_nbaiot_features_batch([values]).items()}
+
+def _is_text(col):
+    """True donde la columna trae texto (columnas object de read_csv): con
+    esos valores las operaciones numéricas de la fila fallan."""
+    if col.dtype != object:
+        return np.zeros(len(col), dtype=bool)
+    return col.map(lambda v: isinstance(v, str)).to_numpy(dtype=bool)
+
+def _ip_counts(ips):
+    """Conexiones vistas hasta cada fila (inclusive) por IP, como el
+    contador por fila: en columnas object los NaN son el mismo objeto y
+    cuentan juntos; en columnas numéricas cada NaN es una llave distinta."""
+    counts = ips.groupby(ips, sort=False, dropna=False).cumcount() + 1
+    if ips.dtype != object:
+        counts[ips.isna()] = 1
+    return counts
 
-    coeffs = pywt.wavedec(values, 'db1', level=2)
-    approx = coeffs[0]
-
-    rounded_vals = np.round(values).astype(int)
-    labels_true = np.arange(len(rounded_vals))
-    mi_score = mutual_info_score(labels_true, rounded_vals)
+def enrich_dataset(df):
+    required_fields = [
+        'src-ip', 'dst-ip', 'src-ip-bytes', 'dst-ip-bytes',
+        'src2dst_packets', 'dst2src_packets', 'protocol', 'stime', 'label'
+    ]
+    # Sin alguna de estas columnas ninguna fila se puede enriquecer
+    missing = [f for f in required_fields if f not in df.columns]
+    if missing:
+        print(f"Error enriqueciendo archivo: faltan las columnas {missing}")
+        return pd.DataFrame()
+    if df.empty:
+        return pd.DataFrame()
+
+    # Contadores IP: conexiones vistas hasta cada fila (inclusive). Cuentan
+    # todas las filas, también las que se descartan abajo.
+    src_ip_count = _ip_counts(df['src-ip'])
+    dst_ip_count = _ip_counts(df['dst-ip'])
+
+    # Filas con texto en las señales: fallan y se descartan de a una
+    signal_cols = ['src-ip-bytes', 'dst-ip-bytes', 'src2dst_packets', 'dst2src_packets']
+    invalid = np.zeros(len(df), dtype=bool)
+    for col in signal_cols:
+        invalid |= _is_text(df[col])
+    if invalid.any():
+        print(f"Error enriqueciendo {invalid.sum()} filas: valores no numéricos en {signal_cols}")
+        df = df[~invalid]
+        src_ip_count, dst_ip_count = src_ip_count[~invalid], dst_ip_count[~invalid]
+        if df.empty:
+            return pd.DataFrame()
+
+    # Señales para N-BaIoT
+    signal_values = df[signal_cols].to_numpy(dtype=float)
+    src_pkts, dst_pkts = signal_values[:, 2], signal_values[:, 3]
+    proto = df['protocol']
+
+    sent = src_pkts > 0
+    conditions = [sent & (dst_pkts == 0), sent & (dst_pkts > 0)]
+    conn_state = np.select(conditions, ["S0", "SF"], "OTH")
+    state_number = np.select(conditions, [1, 2], 0)
+
+    # N-BaIoT
+    nbaiot_feats = compute_nbaiot_features_batch(signal_values)
+
+    # BoT-IoT
+    botiot_feats = {
+        'N-IN-Conn-P-SrcIP': src_ip_count,
+        'N-IN-Conn-P-DstIP': dst_ip_count,
+        'state-number': state_number,
+        'proto-number': proto,
+        'stime': df['stime'],
+        'max': signal_values.max(axis=1),
+        'mean': signal_values.mean(axis=1),
+        'min': signal_values.min(axis=1),
+        'stddev': signal_values.std(axis=1)
+    }
 
-    return {
-        'MI-dir-L5-weight': mi_score,
-        'HH-L3-weight': entropy(values + 1e-6),
-        'HH-L0.01-weight': np.sum(np.power(values / np.sum(values + 1e-6), 0.01)),
-        'HpHp-L0.01-weight': np.sum(np.square(values)),
-        'HpHp-L0.01-mean': np.mean(approx),
-        'HpHp-L0.01-std': np.std(approx),
-        'HpHp-L0.01-magnitude': np.linalg.norm(approx)
+    def column(name, default):
+        return df[name] if name in df.columns else default
+
+    # ToN-IoT
+    toniot_feats = {
+        'dns-query': column('dns-query', ''),
+        'dns-rejected': column('dns-rejected', 0),
+        'dns-RD': column('dns-RD', 0),
+        'state': column('state', 'OTH'),
+        'service': column('service', '-'),
+        'http-status-code': column('http-status-code', -1),
+        'src-bytes': df['src-ip-bytes'],
+        'dst-ip-bytes': df['dst-ip-bytes']
     }
 
-def enrich_dataset(df):
-    src_ip_counter = defaultdict(int)
-    dst_ip_counter = defaultdict(int)
-
-    enriched_rows = []
-
-    for _, row in df.iterrows():
-        try:
-            # Valores base
-            src_ip = row['src-ip']
-            dst_ip = row['dst-ip']
-            src_bytes = row['src-ip-bytes']
-            dst_bytes = row['dst-ip-bytes']
-            src_pkts = row['src2dst_packets']
-            dst_pkts = row['dst2src_packets']
-            proto = row['protocol']
-            stime = row['stime']
-
-            # Contadores IP
-            src_ip_counter[src_ip] += 1
-            dst_ip_counter[dst_ip] += 1
-
-            if src_pkts > 0 and dst_pkts == 0:
-                conn_state = "S0"
-            elif src_pkts > 0 and dst_pkts > 0:
-                conn_state = "SF"
-            else:
-                conn_state = "OTH"
-            state_map = {"S0": 1, "SF": 2, "OTH": 0}
-            state_number = state_map.get(conn_state, 0)
-
-            # Señales para N-BaIoT
-            signal_values = [src_bytes, dst_bytes, src_pkts, dst_pkts]
-
-            # N-BaIoT
-            nbaiot_feats = compute_nbaiot_features(signal_values)
-
-            # BoT-IoT
-            botiot_feats = {
-                'N-IN-Conn-P-SrcIP': src_ip_counter[src_ip],
-                'N-IN-Conn-P-DstIP': dst_ip_counter[dst_ip],
-                'state-number': state_number,
-                'proto-number': proto,
-                'stime': stime,
-                'max': np.max(signal_values),
-                'mean': np.mean(signal_values),
-                'min': np.min(signal_values),
-                'stddev': np.std(signal_values)
-            }
-
-            # ToN-IoT
-            toniot_feats = {
-                'dns-query': row.get('dns-query', ''),
-                'dns-rejected': row.get('dns-rejected', 0),
-                'dns-RD': row.get('dns-RD', 0),
-                'state': row.get('state', 'OTH'),
-                'service': row.get('service', '-'),
-                'http-status-code': row.get('http-status-code', -1),
-                'src-bytes': src_bytes,
-                'dst-ip-bytes': dst_bytes
-            }
-
-            enriched_rows.append({
-                **toniot_feats,
-                **nbaiot_feats,
-                **botiot_feats,
-                'label': row['label']
-            })
-        except Exception as e:
-            print(f"Error enriqueciendo fila: {e}")
-
-    return pd.DataFrame(enriched_rows)
+    enriched = pd.DataFrame({
+        **toniot_feats,
+        **nbaiot_feats,
+        **botiot_feats,
+        'label': df['label']
+    }, index=df.index)
+    return enriched.reset_index(drop=True)
 
 if __name__ == "__main__":
     script_dir = os.path.dirname(os.path.abspath(__file__))
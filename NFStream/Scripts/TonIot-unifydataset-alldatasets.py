@@ -1,33 +1,36 @@
+import argparse
 import os
-import pandas as pd
 
-def merge_combined_csvs(input_folder, output_file):
-    all_dfs = []
-    total_rows = 0
-    total_files = 0
+from csv_merge import CHUNK_ROWS, stream_merge
 
+def merge_combined_csvs(input_folder, output_file, chunk_rows=CHUNK_ROWS, workers=None):
+    paths = []
     for file in os.listdir(input_folder):
         if file.endswith("_combined.csv"):
-            path = os.path.join(input_folder, file)
             print(f"Uniendo archivo: {file}")
-            df = pd.read_csv(path)
-            all_dfs.append(df)
-            total_rows += len(df)
-            total_files += 1
+            paths.append(os.path.join(input_folder, file))
 
-    if not all_dfs:
+    if not paths:
         print("No se encontraron archivos _combined.csv.")
         return
 
-    merged_df = pd.concat(all_dfs, ignore_index=True)
-    merged_df.to_csv(output_file, index=False)
+    # Mismas columnas que pd.concat: la union, vacia donde un archivo no la
+    # trae. Un archivo ilegible corta la union sin escribir final_dataset.csv.
+    total_files, total_rows, _ = stream_merge(
+        paths, output_file, 'union', chunk_rows, workers, skip_errors=False)
     print(f"\n {total_files} archivos unidos.")
     print(f" Total de filas combinadas: {total_rows}")
     print(f" Dataset final guardado en: {output_file}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Une los _combined.csv en el dataset final.")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Procesos que leen los archivos en paralelo (default: CPUs).")
+    args = parser.parse_args()
+
     script_dir = os.path.dirname(os.path.abspath(__file__))
     input_folder = os.path.join(script_dir, "Ton-IoT-MultiFet")
     output_file = os.path.join(script_dir, "final_dataset.csv")
 
-    merge_combined_csvs(input_folder, output_file)
+    merge_combined_csvs(input_folder, output_file, args.chunk_rows, args.workers)
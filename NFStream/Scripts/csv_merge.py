@@ -0,0 +1,237 @@
+# csv_merge.py
+#
+# Union de CSV grandes por chunks, compartida por TonIoT-unificator-4.py y
+# TonIot-unifydataset-alldatasets.py. Cada archivo se lee una sola vez, en
+# un pool de procesos: cada proceso alinea sus chunks a las columnas de la
+# salida, los escribe en un archivo parcial y devuelve el esquema del
+# archivo. Los dtypes se reconcilian al final y solo se reescriben las
+# partes cuyo texto cambia con el dtype final (por ejemplo enteros que
+# pasan a float). La memoria queda acotada por un chunk por proceso, no
+# por el dataset unido.
+
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+# Filas por chunk al leer y escribir.
+CHUNK_ROWS = 200_000
+
+def target_columns(headers, align):
+    """Columnas de la salida: las del primer archivo (align='first') o la
+    union en orden de aparicion, como pd.concat (align='union')."""
+    columns = pd.Index(headers[0])
+    if align == 'union':
+        for header in headers[1:]:
+            columns = columns.union(pd.Index(header), sort=False)
+    return columns.tolist()
+
+def _align(df, columns, align):
+    """Alinea df a las columnas de la salida como la union original: con
+    align='first' las que faltan en 0 y las que sobran fuera; con 'union'
+    las que faltan vacias."""
+    if align == 'union':
+        return df.reindex(columns=columns)
+    for col in columns:
+        if col not in df.columns:
+            df[col] = 0
+    return df[columns]
+
+def _write_part(path, part, columns, align, chunk_rows):
+    """Lee path de a chunks y escribe cada chunk alineado, sin header, en
+    part. Devuelve (esquema, dtypes de cada chunk alineado, error); el
+    esquema es (columnas, dtype por columna leyendo el archivo entero,
+    filas, columnas sin ningun valor)."""
+    try:
+        header, dtypes, chunk_dtypes, rows, has_values = None, {}, [], 0, set()
+        with open(part, 'w', newline='') as out:
+            for chunk in pd.read_csv(path, chunksize=chunk_rows):
+                if header is None:
+                    header = chunk.columns.tolist()
+                if len(chunk):
+                    for col, dtype in chunk.dtypes.items():
+                        dtypes.setdefault(col, []).append(dtype)
+                    has_values.update(chunk.columns[chunk.notna().any().to_numpy()])
+                    rows += len(chunk)
+                chunk = _align(chunk, columns, align)
+                if len(chunk):
+                    chunk_dtypes.append(chunk.dtypes)
+                chunk.to_csv(out, header=False, index=False)
+        if header is None:
+            header = pd.read_csv(path, nrows=0).columns.tolist()
+        # dtype que tendria cada columna leyendo el archivo entero: pandas
+        # une sus chunks internos con la misma regla que pd.concat
+        dtypes = {col: pd.concat([pd.Series(dtype=d) for d in ds]).dtype for col, ds in dtypes.items()}
+        schema = header, dtypes, rows, [col for col in header if col not in has_values]
+        return schema, chunk_dtypes, None
+    except Exception as e:
+        return None, None, e
+
+def _sample(schema):
+    """DataFrame de una fila con los dtypes del archivo (vacio si no tiene
+    filas): pd.concat decide el dtype final igual que con el archivo entero,
+    porque solo mira dtypes y si la columna esta completamente vacia."""
+    columns, dtypes, rows, empty = schema
+    if rows == 0:
+        return pd.DataFrame(columns=columns)
+    value = {np.dtype(bool): True, np.dtype(object): 'x'}
+    return pd.DataFrame({col: pd.Series([None if col in empty else value.get(dtypes[col], 1)],
+                                        dtype=dtypes[col]) for col in columns})
+
+class _Union:
+    """La union original (pd.concat) repetida sobre una fila por archivo.
+    merge(i, chunk) une un chunk del archivo i contra esas filas en lugar
+    de contra los archivos enteros: pd.concat convierte sus valores igual
+    (un bool que pasa por una columna float queda en 1.0 aunque el dtype
+    final sea object)."""
+
+    def __init__(self, schemas, columns, align):
+        self.schemas, self.columns, self.align = schemas, columns, align
+        self.samples = [_sample(schema) for schema in schemas]
+        if align == 'first':
+            self.samples[1:] = [_align(sample, columns, align) for sample in self.samples[1:]]
+            # prefixes[i]: la union de los archivos anteriores al i
+            self.prefixes = [self.samples[0].iloc[:0]]
+            for sample in self.samples[:-1]:
+                self.prefixes.append(pd.concat([self.prefixes[-1], sample], ignore_index=True))
+            self.final = pd.concat([self.prefixes[-1], self.samples[-1]], ignore_index=True).dtypes
+        else:
+            self.final = pd.concat(self.samples, ignore_index=True).dtypes
+
+    def merge(self, i, chunk):
+        if self.align == 'first':
+            if i:
+                chunk = _align(chunk, self.columns, self.align)
+            if chunk.dtypes.equals(self.final):
+                return chunk
+            start = len(self.prefixes[i])
+            frame = pd.concat([self.prefixes[i], chunk], ignore_index=True) if i else chunk
+            for sample in self.samples[i + 1:]:
+                if frame.dtypes.equals(self.final):
+                    break
+                frame = pd.concat([frame, sample], ignore_index=True)
+        else:
+            if chunk.columns.tolist() == self.columns and chunk.dtypes.equals(self.final):
+                return chunk
+            start = sum(len(sample) for sample in self.samples[:i])
+            frame = pd.concat(self.samples[:i] + [chunk] + self.samples[i + 1:], ignore_index=True)
+        return frame.iloc[start:start + len(chunk)]
+
+    def needs_rewrite(self, i, chunk_dtypes):
+        """Si la parte i (escrita con los dtypes de cada chunk) cambia al
+        pasarla por la union: algun chunk con otro dtype que el archivo, o
+        valores que la union convierte (se prueba con la fila de muestra)."""
+        columns, dtypes, rows, _ = self.schemas[i]
+        if rows == 0:
+            return False
+        kept = [col for col in columns if col in self.columns]
+        own = pd.Series({col: dtypes[col] for col in kept})
+        if any(not chunk[kept].equals(own) for chunk in chunk_dtypes):
+            return True
+        sample = _sample(self.schemas[i])
+        merged = self.merge(i, sample)
+        return merged.to_csv(index=False) != _align(sample, self.columns, self.align).to_csv(index=False)
+
+    def rewrite(self, i, part, chunk_rows):
+        """Relee la parte i con los dtypes del archivo, la pasa por la union
+        y la reescribe."""
+        columns, dtypes, _, _ = self.schemas[i]
+        # las columnas agregadas por _align: 0 (int64) con 'first', vacias con 'union'
+        added = np.dtype(np.int64) if self.align == 'first' else np.dtype(np.float64)
+        read_as = {col: dtypes.get(col, added) for col in self.columns}
+        tmp_part = part + ".cast"
+        with open(tmp_part, 'w', newline='') as out:
+            for chunk in pd.read_csv(part, header=None, names=self.columns, dtype=read_as,
+                                     float_precision='round_trip', chunksize=chunk_rows):
+                if self.align == 'union':
+                    chunk = chunk[columns]
+                self.merge(i, chunk).to_csv(out, header=False, index=False)
+        os.replace(tmp_part, part)
+
+def stream_merge(paths, output_file, align='first', chunk_rows=CHUNK_ROWS, workers=None,
+                 skip_errors=True):
+    """Une los CSV de paths (en ese orden) en output_file, con el mismo
+    resultado que leerlos enteros y unirlos con pd.concat.
+
+    align='first': las columnas son las del primer archivo legible; a los
+    demas se les agregan las que faltan con 0 y se les quitan las que
+    sobran, con un concat por archivo (merge_processed_files). align='union':
+    un solo pd.concat de todos, con la union de las columnas.
+
+    Primero se leen solo los headers (nrows=0) para fijar las columnas.
+    Despues cada archivo se lee una sola vez en un pool de `workers`
+    procesos, que escriben partes ya alineadas y devuelven el esquema del
+    archivo. Los dtypes se reconcilian repitiendo la union sobre una fila
+    por archivo (_Union) y solo se reescriben las partes que cambian con
+    el dtype final. Al final las partes se concatenan tal cual. Devuelve
+    (archivos unidos, filas, [(archivo omitido, error)]).
+
+    Un archivo que no se puede leer se omite; con skip_errors=False se
+    lanza su error sin escribir nada. La salida se escribe en output_file +
+    ".tmp" y reemplaza a output_file solo al terminar, asi un error a mitad
+    de camino no deja un archivo incompleto.
+
+    Limitaciones: la equivalencia con pd.concat depende de como pandas
+    combina dtypes (columnas completamente vacias, bool/int/float que pasan
+    a object); si eso cambia entre versiones, el resultado puede diferir
+    del concat directo."""
+    headers, skipped = [], []
+    for path in paths:
+        try:
+            headers.append((path, pd.read_csv(path, nrows=0).columns.tolist()))
+        except Exception as e:
+            if not skip_errors:
+                raise
+            skipped.append((path, e))
+    if not headers:
+        return 0, 0, skipped
+
+    part_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(output_file)))
+    tmp_file = output_file + ".tmp"
+    try:
+        with ProcessPoolExecutor(workers) as pool:
+            while True:
+                columns = target_columns([header for _, header in headers], align)
+                parts = [os.path.join(part_dir, f"{i}.csv") for i in range(len(headers))]
+                results = list(pool.map(_write_part, [path for path, _ in headers], parts,
+                                        repeat(columns), repeat(align), repeat(chunk_rows)))
+                failed = [(path, error) for (path, _), (_, _, error) in zip(headers, results)
+                          if error is not None]
+                if failed and not skip_errors:
+                    raise failed[0][1]
+                skipped += failed
+                kept = [i for i, (_, _, error) in enumerate(results) if error is None]
+                headers = [headers[i] for i in kept]
+                parts = [parts[i] for i in kept]
+                results = [results[i] for i in kept]
+                # un archivo que falla a mitad de lectura puede cambiar las
+                # columnas (el primero con align='first'): se repite sin el
+                if not failed or not headers or target_columns(
+                        [header for _, header in headers], align) == columns:
+                    break
+            skipped.sort(key=lambda item: paths.index(item[0]))
+            if not headers:
+                return 0, 0, skipped
+
+            union = _Union([schema for schema, _, _ in results], columns, align)
+            rewrite = [i for i, (_, chunk_dtypes, _) in enumerate(results)
+                       if union.needs_rewrite(i, chunk_dtypes)]
+            list(pool.map(union.rewrite, rewrite, [parts[i] for i in rewrite], repeat(chunk_rows)))
+
+        with open(tmp_file, 'w', newline='') as out:
+            pd.DataFrame(columns=columns).to_csv(out, index=False)
+            for part in parts:
+                with open(part, newline='') as src:
+                    shutil.copyfileobj(src, out)
+        os.replace(tmp_file, output_file)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    finally:
+        shutil.rmtree(part_dir, ignore_errors=True)
+    return len(headers), sum(schema[2] for schema, _, _ in results), skipped
@@ -37,12 +37,15 @@ LABEL_MAPPING = {
 # deseadas o ajustar las variables necesarias para generar la segunda parte
 # de caracteristicas deseadas.
 
-# Entrada -> Una ruta de archivo y una etiqueta
+# Entrada -> Una ruta de archivo, una etiqueta y el tamaño de chunk
 # Busca el archivo, lo lee y transforma el trafico en listas llamadas Flow
-# Salida -> Listas flow, que indican el trafico de red en los archivos PCAP
+# Salida -> Generador de DataFrames de a lo mas chunk_size flujos, para que
+#           la memoria no crezca con el tamaño del PCAP
 
+CHUNK_SIZE = 100000
 
-def process_pcap(file_path, label):
+
+def process_pcap(file_path, label, chunk_size=CHUNK_SIZE):
     print(f"Procesando {file_path} como {label}...")
 
     stream = nfstream.NFStreamer(
@@ -84,8 +87,14 @@ def process_pcap(file_path, label):
             })
         except Exception as e:
             print(f"Error en flujo: {e}")
+            continue
+
+        if len(flows) >= chunk_size:
+            yield pd.DataFrame(flows)
+            flows = []
 
-    return flows
+    if flows:
+        yield pd.DataFrame(flows)
 
 # Para leer los archivos PCAP, se plantea de
 # Una manera especifica el bloque Main
@@ -116,16 +125,20 @@ if __name__ == '__main__':
 
                 print(f"\nLeyendo archivo: {file_path}")
                 start_time = time.time()
-                flows = process_pcap(file_path, label)
+                output_name = os.path.splitext(pcap_file)[0] + "_base.csv"
+                output_path = os.path.join(output_folder, output_name)
+
+                # Cada chunk se agrega al CSV apenas sale del generador
+                n_flows = 0
+                for df in process_pcap(file_path, label):
+                    df.to_csv(output_path, mode='w' if n_flows == 0 else 'a',
+                              header=(n_flows == 0), index=False)
+                    n_flows += len(df)
                 elapsed = time.time() - start_time
                 print(f"Archivo procesado en {elapsed:.2f} segundos.")
 
-                if flows:
+                if n_flows:
                     total_pcap += 1
-                    df = pd.DataFrame(flows)
-                    output_name = os.path.splitext(pcap_file)[0] + "_base.csv"
-                    output_path = os.path.join(output_folder, output_name)
-                    df.to_csv(output_path, index=False)
-                    print(f"Guardado en: {output_path}")
+                    print(f"Guardado en: {output_path} ({n_flows} flujos)")
 
     print(f"\n{total_pcap} archivos PCAP procesados y flujos base generados.")
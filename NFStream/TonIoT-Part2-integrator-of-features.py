@@ -11,16 +11,17 @@
 # Entrada: Archivos CSV con caracteristicas parciales (_base.csv)
 # Salida : Archivos CSV con caracteristicas integradas (_combined.csv)
 #
-# Usa la libreria Scipy y SKlearn para generar las caracteristicas
-# deseadas a partir de los archivos csv generados en el paso previo
+# Usa la libreria Scipy para generar las caracteristicas
+# deseadas a partir de los archivos csv generados en el paso previo.
+# Las caracteristicas N-BaIoT se calculan para todas las filas a la vez
+# (compute_nbaiot_features_batch), con formas cerradas equivalentes a
+# pywt.wavedec, scipy.stats.entropy y sklearn mutual_info_score.
 
+import math
 import os
 import pandas as pd
 import numpy as np
-import pywt
-from scipy.stats import entropy
-from sklearn.metrics import mutual_info_score
-from collections import defaultdict
+from scipy.special import entr
 
 # Características integradas 
 SELECTED_FEATURES = [
@@ -32,99 +33,143 @@ SELECTED_FEATURES = [
     'stime', 'max', 'mean', 'min', 'stddev', 'label'
 ]
 
-def compute_nbaiot_features(values):
-    values = np.array(values, dtype=float)
-    if len(values) < 4:
-        values = np.pad(values, (0, 4 - len(values)), 'constant')
-    coeffs = pywt.wavedec(values, 'db1', level=2)
-    approx = coeffs[0]
-    rounded_vals = np.round(values).astype(int)
-    labels_true = np.arange(len(rounded_vals))
-    mi_score = mutual_info_score(labels_true, rounded_vals)
-
+def compute_nbaiot_features_batch(signal):
+    """Calcula las características tipo N-BaIoT de todas las filas a la vez.
+
+    signal es la matriz (n, 4) de [src_bytes, dst_bytes, src_pkts, dst_pkts]
+    (se completa con ceros si tiene menos columnas). Devuelve un dict
+    columna -> arreglo de n valores, idénticos a los de aplicar
+    compute_nbaiot_features fila por fila, pero con formas cerradas en vez
+    de llamar a pywt / sklearn / scipy.stats por fila:
+
+      - wavedec(db1, level=2) de 4 valores deja un único coeficiente de
+        aproximación: dos pasos de Haar, (a + b) / sqrt(2) por par. Su std
+        es 0 y su norma, el valor absoluto.
+      - mutual_info_score(arange(4), round(v)): cada etiqueta verdadera
+        tiene un solo elemento, así que la información mutua es la entropía
+        de los valores redondeados; se arma con las mismas operaciones que
+        sklearn a partir de cuántos elementos comparten valor.
+      - entropy(v + 1e-6) es la suma de entr() de la distribución
+        normalizada (scipy.stats.entropy con axis recorre fila por fila
+        cuando hay NaN, por eso se usa entr directamente).
+    """
+    values = np.asarray(signal, dtype=float)
+    if values.shape[1] < 4:
+        values = np.pad(values, ((0, 0), (0, 4 - values.shape[1])), 'constant')
+
+    # Haar nivel 2 (mismos productos que pywt, mismo redondeo)
+    h = np.sqrt(0.5)
+    approx = h * (h * values[:, 0] + h * values[:, 1]) + h * (h * values[:, 2] + h * values[:, 3])
+
+    # Información mutua = entropía de los valores redondeados, término a
+    # término como mutual_info_score (contingencia con una celda por fila)
+    rounded = np.round(values).astype(int)
+    counts = (rounded[:, :, None] == rounded[:, None, :]).sum(axis=2)
+    n_cols = values.shape[1]
+    log_n = math.log(n_cols)
+    terms = (1 / n_cols) * (0.0 - log_n) + (1 / n_cols) * (-np.log(counts) + log_n + log_n)
+    terms[np.abs(terms) < np.finfo(float).eps] = 0.0
+    mi_score = np.clip(terms.sum(axis=1), 0.0, None)
+
+    shifted = values + 1e-6
     return {
         'MI-dir-L5-weight': mi_score,
-        'HH-L3-weight': entropy(values + 1e-6),
-        'HH-L0.01-weight': np.sum(np.power(values / np.sum(values + 1e-6), 0.01)),
-        'HpHp-L0.01-weight': np.sum(np.square(values)),
-        'HpHp-L0.01-mean': np.mean(approx),
-        'HpHp-L0.01-std': np.std(approx),
-        'HpHp-L0.01-magnitude': np.linalg.norm(approx)
+        'HH-L3-weight': entr(shifted / shifted.sum(axis=1, keepdims=True)).sum(axis=1),
+        'HH-L0.01-weight': np.power(values / shifted.sum(axis=1, keepdims=True), 0.01).sum(axis=1),
+        'HpHp-L0.01-weight': np.square(values).sum(axis=1),
+        'HpHp-L0.01-mean': approx,
+        'HpHp-L0.01-std': np.abs(approx - approx),   # 0, o NaN si approx no es finito
+        'HpHp-L0.01-magnitude': np.abs(approx)
     }
 
-def enrich_dataset(df):
-    src_ip_counter = defaultdict(int)
-    dst_ip_counter = defaultdict(int)
-    enriched_rows = []
+def compute_nbaiot_features(values):
+    """Características tipo N-BaIoT de una sola fila de valores."""
+    return {k: v[0] for k, v in compute_nbaiot_features_batch([values]).items()}
+
+def _is_text(col):
+    """True donde la columna trae texto (columnas object de read_csv): con
+    esos valores las operaciones numéricas de la fila fallan."""
+    if col.dtype != object:
+        return np.zeros(len(col), dtype=bool)
+    return col.map(lambda v: isinstance(v, str)).to_numpy(dtype=bool)
 
+def enrich_dataset(df):
     required_fields = [
         'src-ip', 'dst-ip', 'src2dst_packets', 'dst2src_packets',
         'src-ip-bytes', 'dst-ip-bytes', 'protocol', 'dst-port',
         'stime', 'label'
     ]
 
-    for _, row in df.iterrows():
-        # Validar campos críticos
-        if any(pd.isna(row.get(f)) for f in required_fields):
-            continue
-
-        try:
-            src_ip = row['src-ip']
-            dst_ip = row['dst-ip']
-            src_bytes = row['src-ip-bytes']
-            dst_bytes = row['dst-ip-bytes']
-            src_pkts = row['src2dst_packets']
-            dst_pkts = row['dst2src_packets']
-            proto = row['protocol']
-            dst_port = row['dst-port']
-            stime = row['stime']
-
-            # Conn-state estilo Zeek
-            if src_pkts > 0 and dst_pkts == 0:
-                conn_state = "S0"
-            elif src_pkts > 0 and dst_pkts > 0:
-                conn_state = "SF"
-            else:
-                conn_state = "OTH"
-            state_map = {"S0": 1, "SF": 2, "OTH": 0}
-            state_number = state_map.get(conn_state, 0)
-
-            src_ip_counter[src_ip] += 1
-            dst_ip_counter[dst_ip] += 1
-
-            signal_values = [src_bytes, dst_bytes, src_pkts, dst_pkts]
-            nbaiot_feats = compute_nbaiot_features(signal_values)
-
-            feature_row = {
-                'state': row.get('state', 'OTH'),
-                'service': row.get('service', '-'),
-                'http-status-code': row.get('http-status-code', -1),
-                'src-bytes': src_bytes,
-                'dst-ip-bytes': dst_bytes,
-                'dst-port': dst_port,
-                'conn-state': conn_state,
-                'src-pkts': src_pkts,
-                'proto': proto,
-                **nbaiot_feats,
-                'N-IN-Conn-P-SrcIP': src_ip_counter[src_ip],
-                'N-IN-Conn-P-DstIP': dst_ip_counter[dst_ip],
-                'state-number': state_number,
-                'proto-number': proto,
-                'stime': stime,
-                'max': np.max(signal_values),
-                'mean': np.mean(signal_values),
-                'min': np.min(signal_values),
-                'stddev': np.std(signal_values),
-                'label': row['label']
-            }
-
-            filtered_row = {key: feature_row[key] for key in SELECTED_FEATURES}
-            enriched_rows.append(filtered_row)
-
-        except Exception as e:
-            print(f"Error enriqueciendo fila: {e}")
-
-    return pd.DataFrame(enriched_rows)
+    # Validar campos críticos: se descartan las filas con alguno vacío
+    if any(f not in df.columns for f in required_fields):
+        return pd.DataFrame()
+    df = df[df[required_fields].notna().all(axis=1)]
+    if df.empty:
+        return pd.DataFrame()
+
+    # Filas con texto en las señales: fallan de a una, como en el recorrido
+    # fila por fila. Conn-state falla si src_pkts es texto, o si src_pkts > 0
+    # y dst_pkts es texto, y esas filas no llegan a los contadores de IP;
+    # con texto en dst_pkts o en los bytes la fila cuenta y falla después.
+    src_txt = _is_text(df['src2dst_packets'])
+    dst_txt = _is_text(df['dst2src_packets'])
+    bytes_txt = _is_text(df['src-ip-bytes']) | _is_text(df['dst-ip-bytes'])
+    src_num = df['src2dst_packets'].where(~src_txt).to_numpy(dtype=float)
+    counted = ~(src_txt | ((src_num > 0) & dst_txt))
+    valid = counted & ~dst_txt & ~bytes_txt
+    if not valid.all():
+        print(f"Error enriqueciendo {(~valid).sum()} filas: valores no numéricos en las señales")
+
+    # Conexiones vistas hasta cada fila (inclusive) por IP
+    src_ip_count = df[counted].groupby('src-ip', sort=False).cumcount() + 1
+    dst_ip_count = df[counted].groupby('dst-ip', sort=False).cumcount() + 1
+    df = df[valid]
+    if df.empty:
+        return pd.DataFrame()
+    src_ip_count, dst_ip_count = src_ip_count[df.index], dst_ip_count[df.index]
+
+    src_bytes = df['src-ip-bytes']
+    dst_bytes = df['dst-ip-bytes']
+    signal_values = df[['src-ip-bytes', 'dst-ip-bytes',
+                        'src2dst_packets', 'dst2src_packets']].to_numpy(dtype=float)
+    src_pkts, dst_pkts = signal_values[:, 2], signal_values[:, 3]
+    proto = df['protocol']
+
+    # Conn-state estilo Zeek
+    sent = src_pkts > 0
+    conditions = [sent & (dst_pkts == 0), sent & (dst_pkts > 0)]
+    conn_state = np.select(conditions, ["S0", "SF"], "OTH")
+    state_number = np.select(conditions, [1, 2], 0)
+    nbaiot_feats = compute_nbaiot_features_batch(signal_values)
+
+    def column(name, default):
+        return df[name] if name in df.columns else default
+
+    feature_cols = {
+        'state': column('state', 'OTH'),
+        'service': column('service', '-'),
+        'http-status-code': column('http-status-code', -1),
+        'src-bytes': src_bytes,
+        'dst-ip-bytes': dst_bytes,
+        'dst-port': df['dst-port'],
+        'conn-state': conn_state,
+        'src-pkts': df['src2dst_packets'],
+        'proto': proto,
+        **nbaiot_feats,
+        'N-IN-Conn-P-SrcIP': src_ip_count,
+        'N-IN-Conn-P-DstIP': dst_ip_count,
+        'state-number': state_number,
+        'proto-number': proto,
+        'stime': df['stime'],
+        'max': signal_values.max(axis=1),
+        'mean': signal_values.mean(axis=1),
+        'min': signal_values.min(axis=1),
+        'stddev': signal_values.std(axis=1),
+        'label': df['label']
+    }
+
+    enriched = pd.DataFrame(feature_cols, index=df.index)
+    return enriched[SELECTED_FEATURES].reset_index(drop=True)
 
 if __name__ == "__main__":
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -1,8 +1,13 @@
 """Shared pytest fixtures: tiny synthetic frames that mimic each dataset's schema."""
+import importlib.util
+from pathlib import Path
+
 import numpy as np
 import pandas as pd
 import pytest
 
+REPO_ROOT = Path(__file__).resolve().parents[2]
+
 
 @pytest.fixture
 def rng():
@@ -39,3 +44,20 @@ def gens_frame(rng):
         "label": lab,
     })
     return df
+
+
+@pytest.fixture(scope="session")
+def load_script():
+    """Loads a repo script by path relative to the repo root (the NFStream
+    scripts have hyphenated names and can't be imported)."""
+    loaded = {}
+
+    def load(relpath):
+        if relpath not in loaded:
+            spec = importlib.util.spec_from_file_location(
+                Path(relpath).stem.replace("-", "_"), REPO_ROOT / relpath)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            loaded[relpath] = module
+        return loaded[relpath]
+    return load
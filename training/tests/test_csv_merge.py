@@ -0,0 +1,98 @@
+"""csv_merge.stream_merge through both unificator scripts against the
+original whole-file pd.concat merges: same output bytes across mixed dtypes,
+missing columns, all-empty columns, files without rows and unreadable files."""
+import os
+import random
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+SCRIPTS = Path(__file__).resolve().parents[2] / "NFStream" / "Scripts"
+
+
+@pytest.fixture(scope="module")
+def scripts(load_script):
+    # the scripts import csv_merge from their own folder, as when run directly
+    sys.path.insert(0, str(SCRIPTS))
+    try:
+        yield (load_script("NFStream/Scripts/TonIoT-unificator-4.py"),
+               load_script("NFStream/Scripts/TonIot-unifydataset-alldatasets.py"))
+    finally:
+        sys.path.remove(str(SCRIPTS))
+
+
+def old_processed(input_folder, output_file):
+    merged_df, reference_columns = None, None
+    for file in sorted(os.listdir(input_folder)):
+        if file.endswith("_processed.csv"):
+            try:
+                df = pd.read_csv(os.path.join(input_folder, file))
+                if merged_df is None:
+                    merged_df = df.copy()
+                    reference_columns = df.columns.tolist()
+                else:
+                    for col in reference_columns:
+                        if col not in df.columns:
+                            df[col] = 0
+                    df = df[reference_columns]
+                    merged_df = pd.concat([merged_df, df], ignore_index=True)
+            except Exception:
+                pass
+    if merged_df is not None:
+        merged_df.to_csv(output_file, index=False)
+
+
+def old_combined(input_folder, output_file):
+    all_dfs = [pd.read_csv(os.path.join(input_folder, file))
+               for file in os.listdir(input_folder) if file.endswith("_combined.csv")]
+    pd.concat(all_dfs, ignore_index=True).to_csv(output_file, index=False)
+
+
+def column(kind, n, rng):
+    if kind == 'int':
+        return rng.integers(-5, 1000, n)
+    if kind == 'float':
+        return rng.random(n) * 100
+    if kind == 'nan_float':
+        return np.where(rng.random(n) < .3, np.nan, rng.random(n))
+    if kind == 'all_nan':
+        return np.full(n, np.nan)
+    if kind == 'bool':
+        return rng.random(n) < .5
+    if kind == 'str':
+        return rng.choice(['a', 'b', 'c d'], n)
+    return np.where(rng.random(n) < .05, 'x', rng.integers(0, 9, n).astype(str))   # mixed
+
+
+def write_inputs(folder, seed):
+    r, rng = random.Random(seed), np.random.default_rng(seed)
+    names = [f"c{i}" for i in range(8)]
+    kinds = ['int', 'float', 'nan_float', 'all_nan', 'bool', 'str', 'mixed']
+    for f in range(r.randint(2, 5)):
+        cols = r.sample(names, r.randint(3, 8))
+        n = r.choice([0, 1, 7, 25, 60])
+        df = pd.DataFrame({c: column(r.choice(kinds), n, rng) for c in cols})
+        for suffix in ("_processed.csv", "_combined.csv"):
+            df.to_csv(folder / f"f{f}{suffix}", index=False)
+        if f and r.random() < .2:
+            (folder / f"f{f}_processed.csv").write_text("")   # unreadable: skipped
+
+
+@pytest.mark.filterwarnings("ignore")
+@pytest.mark.parametrize("seed", range(12))
+def test_stream_merge_matches_concat(scripts, tmp_path, seed):
+    unificator, unifydataset = scripts
+    write_inputs(tmp_path, seed)
+    out = tmp_path / "out"
+    out.mkdir()
+    old_processed(tmp_path, out / "old_processed.csv")
+    old_combined(tmp_path, out / "old_combined.csv")
+    unificator.merge_processed_files(tmp_path, str(out / "new_processed.csv"), chunk_rows=7, workers=2)
+    unifydataset.merge_combined_csvs(tmp_path, str(out / "new_combined.csv"), chunk_rows=7, workers=2)
+    for name in ("processed", "combined"):
+        assert (out / f"new_{name}.csv").read_bytes() == (out / f"old_{name}.csv").read_bytes()
+    assert sorted(os.listdir(out)) == sorted(["old_processed.csv", "old_combined.csv",
+                                              "new_processed.csv", "new_combined.csv"])
@@ -0,0 +1,162 @@
+"""Legacy NFStream/ enrich_dataset (closed-form N-BaIoT over whole frames)
+against the original row-by-row loops, kept here as the reference: same
+_combined.csv text, including NaN IPs, NaN/inf bytes and text in signal
+columns (rows that failed one by one)."""
+import contextlib
+import io
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pywt = pytest.importorskip("pywt")
+from scipy.stats import entropy                      # noqa: E402
+from sklearn.metrics import mutual_info_score        # noqa: E402
+
+
+def ref_nbaiot(values):
+    values = np.array(values, dtype=float)
+    approx = pywt.wavedec(values, 'db1', level=2)[0]
+    return {
+        'MI-dir-L5-weight': mutual_info_score(np.arange(len(values)), np.round(values).astype(int)),
+        'HH-L3-weight': entropy(values + 1e-6),
+        'HH-L0.01-weight': np.sum(np.power(values / np.sum(values + 1e-6), 0.01)),
+        'HpHp-L0.01-weight': np.sum(np.square(values)),
+        'HpHp-L0.01-mean': np.mean(approx),
+        'HpHp-L0.01-std': np.std(approx),
+        'HpHp-L0.01-magnitude': np.linalg.norm(approx),
+    }
+
+
+def conn_state(src_pkts, dst_pkts):
+    if src_pkts > 0 and dst_pkts == 0:
+        return "S0", 1
+    if src_pkts > 0 and dst_pkts > 0:
+        return "SF", 2
+    return "OTH", 0
+
+
+def ref_alldatasets(df):
+    src_count, dst_count, rows = defaultdict(int), defaultdict(int), []
+    for _, row in df.iterrows():
+        try:
+            src_count[row['src-ip']] += 1
+            dst_count[row['dst-ip']] += 1
+            signal = [row['src-ip-bytes'], row['dst-ip-bytes'],
+                      row['src2dst_packets'], row['dst2src_packets']]
+            _, state_number = conn_state(signal[2], signal[3])
+            rows.append({
+                'dns-query': row.get('dns-query', ''), 'dns-rejected': row.get('dns-rejected', 0),
+                'dns-RD': row.get('dns-RD', 0), 'state': row.get('state', 'OTH'),
+                'service': row.get('service', '-'),
+                'http-status-code': row.get('http-status-code', -1),
+                'src-bytes': signal[0], 'dst-ip-bytes': signal[1], **ref_nbaiot(signal),
+                'N-IN-Conn-P-SrcIP': src_count[row['src-ip']],
+                'N-IN-Conn-P-DstIP': dst_count[row['dst-ip']],
+                'state-number': state_number, 'proto-number': row['protocol'],
+                'stime': row['stime'], 'max': np.max(signal), 'mean': np.mean(signal),
+                'min': np.min(signal), 'stddev': np.std(signal), 'label': row['label'],
+            })
+        except Exception:
+            pass
+    return pd.DataFrame(rows)
+
+
+def ref_part2(df, selected):
+    required = ['src-ip', 'dst-ip', 'src2dst_packets', 'dst2src_packets', 'src-ip-bytes',
+                'dst-ip-bytes', 'protocol', 'dst-port', 'stime', 'label']
+    src_count, dst_count, rows = defaultdict(int), defaultdict(int), []
+    for _, row in df.iterrows():
+        if any(pd.isna(row.get(f)) for f in required):
+            continue
+        try:
+            signal = [row['src-ip-bytes'], row['dst-ip-bytes'],
+                      row['src2dst_packets'], row['dst2src_packets']]
+            state, state_number = conn_state(signal[2], signal[3])
+            src_count[row['src-ip']] += 1
+            dst_count[row['dst-ip']] += 1
+            out = {
+                'state': row.get('state', 'OTH'), 'service': row.get('service', '-'),
+                'http-status-code': row.get('http-status-code', -1),
+                'src-bytes': signal[0], 'dst-ip-bytes': signal[1], 'dst-port': row['dst-port'],
+                'conn-state': state, 'src-pkts': signal[2], 'proto': row['protocol'],
+                **ref_nbaiot(signal),
+                'N-IN-Conn-P-SrcIP': src_count[row['src-ip']],
+                'N-IN-Conn-P-DstIP': dst_count[row['dst-ip']],
+                'state-number': state_number, 'proto-number': row['protocol'],
+                'stime': row['stime'], 'max': np.max(signal), 'mean': np.mean(signal),
+                'min': np.min(signal), 'stddev': np.std(signal), 'label': row['label'],
+            }
+            rows.append({k: out[k] for k in selected})
+        except Exception:
+            pass
+    return pd.DataFrame(rows)
+
+
+def base_frame(n=300, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'src-ip': rng.choice(['10.0.0.1', '10.0.0.2', '10.0.0.3'], n).astype(object),
+        'dst-ip': rng.choice(['10.0.1.1', '10.0.1.2'], n).astype(object),
+        'src-ip-bytes': rng.integers(0, 3000, n).astype(float),
+        'dst-ip-bytes': rng.integers(0, 3000, n).astype(float),
+        'src2dst_packets': rng.integers(0, 4, n),
+        'dst2src_packets': rng.integers(0, 4, n),
+        'protocol': rng.choice([6, 17], n), 'dst-port': rng.integers(1, 1000, n),
+        'stime': np.arange(n) * 10.0, 'label': rng.choice(['normal', 'dos'], n),
+        'state': 'SF', 'service': '-',
+    })
+    df.loc[[3, 40, 41], 'src-ip'] = np.nan
+    df.loc[[7], 'dst-ip'] = np.nan
+    df.loc[[5, 60], 'src-ip-bytes'] = np.nan
+    df.loc[[9, 61], 'dst-ip-bytes'] = np.inf
+    df.loc[[12], 'src-ip-bytes'] = -np.inf
+    return df
+
+
+def as_read(df):
+    buf = io.StringIO()
+    df.to_csv(buf, index=False)
+    buf.seek(0)
+    return pd.read_csv(buf)
+
+
+def with_text(df):
+    df = df.astype({'src2dst_packets': object, 'dst2src_packets': object, 'src-ip-bytes': object})
+    df.loc[[20, 21], 'dst2src_packets'] = 'x'
+    df.loc[20, 'src2dst_packets'], df.loc[21, 'src2dst_packets'] = 0, 2
+    df.loc[30, 'src2dst_packets'] = 'y'
+    df.loc[50, 'src-ip-bytes'] = 'z'
+    return df
+
+
+FRAMES = {
+    'read_csv': lambda: as_read(base_frame()),
+    'text_values': lambda: with_text(base_frame()),
+    'float_nan_ips': lambda: as_read(base_frame()).assign(**{'src-ip': np.nan}),
+    'missing_label': lambda: as_read(base_frame()).drop(columns=['label']),
+}
+
+
+def quiet(fn, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args)
+
+
+@pytest.mark.filterwarnings("ignore")
+@pytest.mark.parametrize("frame", FRAMES)
+def test_alldatasets_matches_rowwise(load_script, frame):
+    mod = load_script("NFStream/Scripts/TonIoT-integrator-alldatasets-2.py")
+    df = FRAMES[frame]()
+    new = quiet(mod.enrich_dataset, df.copy()).to_csv(index=False)
+    assert new == ref_alldatasets(df).to_csv(index=False)
+
+
+@pytest.mark.filterwarnings("ignore")
+@pytest.mark.parametrize("frame", FRAMES)
+def test_legacy_part2_matches_rowwise(load_script, frame):
+    mod = load_script("NFStream/TonIoT-Part2-integrator-of-features.py")
+    df = FRAMES[frame]()
+    new = quiet(mod.enrich_dataset, df.copy()).to_csv(index=False)
+    assert new == ref_part2(df, mod.SELECTED_FEATURES).to_csv(index=False)
@@ -0,0 +1,60 @@
+"""NbaiotFeatures_TonIoT: the grouped segment engine against the per-flow
+loop over df.groupby('flow_id'): same CSV text, including flows with NaN or
+inf bytes, NaN flow_ids and flows that fail one by one."""
+import contextlib
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("pywt")
+
+
+@pytest.fixture(scope="module")
+def nbaiot(load_script):
+    return load_script("NFStream/Scripts/NbaiotFeatures_TonIoT.py")
+
+
+def raw_flows(n_flows=300, seed=3):
+    rng = np.random.default_rng(seed)
+    lengths = rng.choice([1, 2, 3, 4, 5, 7, 8, 9, 16, 33, 130], n_flows)
+    flow_id = np.repeat(rng.permutation(n_flows) * 3 + 7, lengths).astype(float)
+    n = len(flow_id)
+    df = pd.DataFrame({
+        'flow_id': flow_id,
+        'src-ip-bytes': rng.choice([0, 40, 60, 52, 1500], n) * 1.37,
+        'dst-ip-bytes': rng.choice([0, 40, 1500], n).astype(float),
+        'label': rng.choice(['normal', 'ddos'], n),
+    }).sample(frac=1, random_state=1, ignore_index=True)
+    df.loc[0:4, 'src-ip-bytes'] = np.nan
+    df.loc[5:7, 'flow_id'] = np.nan
+    df.loc[8:19, 'dst-ip-bytes'] = np.nan
+    df.loc[20:22, 'src-ip-bytes'] = np.inf
+    df.loc[23:25, 'dst-ip-bytes'] = -np.inf
+    # a whole run of flows with NaN dst bytes
+    first = np.sort(df['flow_id'].dropna().unique())[:60]
+    df.loc[df['flow_id'].isin(first), 'dst-ip-bytes'] = np.nan
+    buf = io.StringIO()
+    df.to_csv(buf, index=False)
+    buf.seek(0)
+    return pd.read_csv(buf)
+
+
+def per_flow(nbaiot, df):
+    results = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for flow_id, group in df.groupby('flow_id'):
+            try:
+                results.append(nbaiot.extract_nbaiot_selected_features(flow_id, group))
+            except Exception:
+                pass
+    return pd.DataFrame(results)
+
+
+@pytest.mark.filterwarnings("ignore")
+@pytest.mark.parametrize("chunk_flows", [7, 100_000])
+def test_grouped_matches_per_flow(nbaiot, chunk_flows):
+    df = raw_flows()
+    got = nbaiot.extract_nbaiot_features_grouped(df, chunk_flows=chunk_flows)
+    assert got.to_csv(index=False) == per_flow(nbaiot, df).to_csv(index=False)
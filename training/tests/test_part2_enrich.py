@@ -0,0 +1,45 @@
+"""Part2 enrich_dataset (columnar) against the row-wise reference kept in
+bench_part2_enrich.py: same _combined.csv text, file after file."""
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture(scope="module")
+def part2(load_script):
+    return load_script("NFStream-SHAP/TonIoT-Part2-integrator-of-features.py")
+
+
+@pytest.fixture(scope="module")
+def bench(load_script):
+    return load_script("NFStream-SHAP/bench_part2_enrich.py")
+
+
+def base_frames(bench):
+    frames = [bench.synthetic_base(800, 1_554_000_000_000 + k * 2400, seed=k) for k in range(2)]
+    frames[0].loc[[3, 50], "src_ip"] = np.nan          # dropped by both
+    frames[1].loc[[7], "dst_ip_bytes"] = np.nan
+    return frames
+
+
+def combined_csvs(part2, enrich, frames):
+    kitsune, running = part2.KitsuneExtractor(), defaultdict(float)
+    return [enrich(df, kitsune, running).to_csv(index=False) for df in frames]
+
+
+def rowwise(part2, bench):
+    return lambda df, kitsune, running: bench.enrich_rowwise(part2, df, kitsune, running)
+
+
+def test_enrich_matches_rowwise(part2, bench):
+    frames = base_frames(bench)
+    new = combined_csvs(part2, part2.enrich_dataset, frames)
+    assert new == combined_csvs(part2, rowwise(part2, bench), frames)
+
+
+def test_enrich_without_http_status_code(part2, bench):
+    frames = [df.drop(columns="http_status_code") for df in base_frames(bench)]
+    new = combined_csvs(part2, part2.enrich_dataset, frames)
+    assert new == combined_csvs(part2, rowwise(part2, bench), frames)
+    assert "http_status_code" in new[0].splitlines()[0]